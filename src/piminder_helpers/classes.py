@@ -11,10 +11,12 @@ https://github.com/ZAdamMac/Piminder
 """
 
 import base64
-import datetime
 import http.client
 import json
 import ssl
+import time
+import uuid
+from .timestamps import now
 
 
 class PiminderException(BaseException):
@@ -22,7 +24,18 @@ class PiminderException(BaseException):
 
 
 class PiminderService(object):
-    def __init__(self, username, password, host, port, service_name, cert_path=None, self_signed=False):
+    """A connection to the Piminder service for one reporting job.
+
+    A post that times out, fails to connect, or is refused with a 429 or 5xx status is retried up to retries more
+    times, backing off between attempts. Every attempt at one post carries the same Idempotency-Key, so a retry of a
+    post the service already took is not stored twice.
+
+    The username and password are exchanged for a bearer token from /api/tokens/, which is used until shortly before
+    it expires, sparing the service a password check on each post. A service too old to issue tokens is sent the
+    username and password every time, as before.
+    """
+    def __init__(self, username, password, host, port, service_name, cert_path=None, self_signed=False,
+                 timeout=10, retries=3):
         auth_precode = username + ":" + password
         self.Piminder_key = "Basic %s" % (base64.b64encode(auth_precode.encode('utf8')).decode('utf8'))
         self.host = str(host)
@@ -32,14 +45,55 @@ class PiminderService(object):
         if self_signed:
             self.ssl_context.check_hostname = False
             self.ssl_context.verify_mode = ssl.CERT_NONE
+        self.timeout = timeout
+        self.retries = int(retries)
+        self.token = None
+        self.token_expiry = 0  # time.monotonic() after which the token is renewed, a minute before it lapses.
+        self.use_tokens = True
+
+    def send(self, method, endpoint, body, headers):
+        """Sends one request on a fresh connection.
+
+        :return: a tuple of the response and its body.
+        """
+        connection = http.client.HTTPSConnection(host=self.host, port=self.port, context=self.ssl_context,
+                                                 timeout=self.timeout)
+        try:
+            connection.request(method, endpoint, body=body, headers=headers)
+            resp = connection.getresponse()
+            return resp, resp.read()
+        finally:
+            connection.close()
+
+    def authorization(self):
+        """The Authorization header for the next request: the bearer token, fetched or renewed if need be, or the
+        basic credentials if no token can be had."""
+        if not self.use_tokens:
+            return self.Piminder_key
+        if self.token is None or time.monotonic() >= self.token_expiry:
+            self.token = None
+            resp, payload = self.send("POST", "/api/tokens/", None, {"Authorization": self.Piminder_key})
+            if resp.status == 200:
+                try:
+                    dict_resp = json.loads(payload)
+                    token, expires_in = str(dict_resp["token"]), int(dict_resp["expiresIn"])
+                except (KeyError, TypeError, ValueError):  # Such as a proxy's HTML page; the credentials still work.
+                    return self.Piminder_key
+                self.token = "Bearer %s" % token
+                self.token_expiry = time.monotonic() + expires_in - 60
+            elif resp.status in [404, 405]:  # This service predates tokens.
+                self.use_tokens = False
+            else:  # Let the post itself report the problem, if there is one.
+                return self.Piminder_key
+
+        return self.token or self.Piminder_key
 
     def post_message(self, message, level, unique=False, update_timestamp=False):
-        connection = http.client.HTTPSConnection(host=self.host, port=self.port, context=self.ssl_context)
         request_data = {
             "name": self.name,
             "message": message,
             "errorlevel": level,
-            "timestamp": datetime.datetime.utcnow().isoformat(sep="T", timespec="seconds") + "Z",
+            "timestamp": now(),
         }
         if unique:
             endpoint = "/api/messages/unique/"
@@ -47,11 +101,30 @@ class PiminderService(object):
         else:
             endpoint = "/api/messages/"
         request_body = json.dumps(request_data)
-        connection.request("POST", endpoint, body=request_body, headers={"Authorization": self.Piminder_key,
-                                                                                 "Content-type": "application/json"})
-        resp = connection.getresponse()
-        if resp.status != 200:  # We have encountered an error condition
-            raise PiminderException()
+        headers = {"Content-type": "application/json", "Idempotency-Key": str(uuid.uuid4())}
+        renewed = False
+        attempt = 0
+        while True:
+            retry_after = None
+            try:
+                headers["Authorization"] = self.authorization()
+                resp, payload = self.send("POST", endpoint, request_body, headers)
+            except (OSError, http.client.HTTPException):  # Timeouts and refused connections are OSErrors.
+                if attempt == self.retries:
+                    raise
+            else:
+                if resp.status == 200:
+                    return
+                if resp.status == 401 and self.token is not None and not renewed:
+                    # The token was revoked, or the service restarted without a fixed secret; get a new one.
+                    self.token = None
+                    renewed = True
+                    continue
+                if resp.status != 429 and resp.status < 500 or attempt == self.retries:
+                    raise PiminderException()  # We have encountered an error condition
+                retry_after = resp.getheader("Retry-After")
+            time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else 2 ** attempt)
+            attempt += 1
 
     def info(self, message, unique=False, update_timestamp=False):
         self.post_message(message, "info", unique, update_timestamp)
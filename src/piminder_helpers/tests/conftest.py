@@ -0,0 +1,16 @@
+"""
+This script is a component of the Piminder helpers package.
+It sets up the helpers' tests, which import the package from the source tree.
+
+Author: Zac Adam-MacEwen (zadammac@arcanalabs.com)
+An Arcana Labs utility
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
@@ -0,0 +1,54 @@
+"""
+This script is a component of the Piminder helpers package.
+It tests how PiminderService exchanges its credentials for a bearer token before posting.
+
+Author: Zac Adam-MacEwen (zadammac@arcanalabs.com)
+An Arcana Labs utility
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from piminder_helpers.classes import PiminderService
+
+
+class Response(object):
+    def __init__(self, status):
+        self.status = status
+
+    def getheader(self, name):
+        return None
+
+
+def service_answering(token_payload):
+    """A PiminderService whose token exchange gets token_payload with a 200, and whose posts all succeed. The
+    Authorization header of each post is kept in sent."""
+    service = PiminderService("reporter", "password", "localhost", 443, "test")
+    sent = []
+
+    def send(method, endpoint, body, headers):
+        if endpoint == "/api/tokens/":
+            return Response(200), token_payload
+        sent.append(headers["Authorization"])
+        return Response(200), b'{"error": 200}'
+
+    service.send = send
+
+    return service, sent
+
+
+def test_token_is_used_once_fetched():
+    service, sent = service_answering(b'{"token": "abc", "expiresIn": 900, "error": 200}')
+    service.info("Ran.")
+
+    assert sent == ["Bearer abc"]
+
+
+@pytest.mark.parametrize("payload", [b'{"error": 200}', b'{"token": "abc", "expiresIn": "soon"}', b'[]', b'<html>'])
+def test_malformed_token_response_falls_back_to_the_credentials(payload):
+    service, sent = service_answering(payload)
+    service.info("Ran.")
+
+    assert sent == [service.Piminder_key]
@@ -0,0 +1,105 @@
+"""
+This script is a component of the Piminder helpers package. It is the ISO 8601 timestamp codec shared by the helpers,
+the monitor and the service, which all exchange timestamps in the fixed-width form 2021-06-01T04:00:00Z. That form is
+parsed and written by hand, without strptime or strftime; anything else ISO 8601 falls back to fromisoformat.
+The service's Docker image copies this package in when it is built.
+
+Author: Zac Adam-MacEwen (zadammac@arcanalabs.com)
+An Arcana Labs utility
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import datetime
+import time
+
+list_month_days = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+min_epoch = 0
+max_epoch = 2 ** 31 - 1  # The last second a MariaDB TIMESTAMP can hold, early in 2038.
+
+
+def days_from_civil(year, month, day):
+    """Days from 1970-01-01 to the given proleptic Gregorian date (Howard Hinnant's algorithm)."""
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+
+    return era * 146097 + day_of_era - 719468
+
+
+def parse_timestamp(text):
+    """Converts an ISO 8601 timestamp to integer epoch seconds. A timestamp without an offset is taken to be UTC.
+
+    :param text: a timestamp such as 2021-06-01T04:00:00Z.
+    :return: the timestamp as seconds since the epoch, truncated to the second.
+    :raises ValueError: if text is not an ISO 8601 timestamp.
+    """
+    if len(text) == 20 and text[4] == "-" and text[7] == "-" and text[10] == "T" and text[13] == ":" \
+            and text[16] == ":" and text[19] == "Z":
+        try:
+            year, month, day = int(text[0:4]), int(text[5:7]), int(text[8:10])
+            hour, minute, second = int(text[11:13]), int(text[14:16]), int(text[17:19])
+        except ValueError:
+            raise ValueError("Not an ISO 8601 timestamp: %r" % text)
+        leap_day = month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+        if not (1 <= month <= 12 and 1 <= day <= list_month_days[month - 1] + leap_day and hour < 24
+                and minute < 60 and second < 60):
+            raise ValueError("Not an ISO 8601 timestamp: %r" % text)
+        return days_from_civil(year, month, day) * 86400 + hour * 3600 + minute * 60 + second
+
+    parsed = datetime.datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+
+    return int(parsed.timestamp())
+
+
+def format_timestamp(epoch):
+    """Converts epoch seconds to the fixed-width ISO 8601 form, in UTC. Times outside min_epoch to max_epoch, which
+    only a row stored before to_epoch checked its range can hold, are shown as the nearer end of that range.
+
+    :param epoch: seconds since the epoch.
+    :return: a timestamp such as 2021-06-01T04:00:00Z.
+    """
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % time.gmtime(min(max(int(epoch), min_epoch), max_epoch))[:6]
+
+
+def to_epoch(value):
+    """Accepts either an ISO 8601 timestamp or epoch seconds, as an API client may send either.
+
+    :return: integer epoch seconds.
+    :raises ValueError: if value is neither, or is outside min_epoch to max_epoch, which the database cannot store.
+    """
+    if isinstance(value, bool):
+        raise ValueError("Not a timestamp: %r" % value)
+    if isinstance(value, (int, float)):
+        try:
+            epoch = int(value)
+        except OverflowError:  # Infinity; NaN raises a ValueError on its own.
+            raise ValueError("Not a timestamp: %r" % value)
+    else:
+        epoch = parse_timestamp(value)
+    if not min_epoch <= epoch <= max_epoch:
+        raise ValueError("Timestamp out of range: %r" % value)
+
+    return epoch
+
+
+def abbreviate(text):
+    """Shortens a timestamp to the minute, with a two-digit year, as the monitor's display shows it: 21-06-01T04:00Z.
+
+    :param text: an ISO 8601 timestamp.
+    """
+    if len(text) == 20 and text[19] == "Z":
+        return text[2:16] + "Z"
+
+    return format_timestamp(parse_timestamp(text))[2:16] + "Z"
+
+
+def now():
+    """The current time as a fixed-width ISO 8601 timestamp."""
+    return format_timestamp(time.time())
@@ -15,23 +15,34 @@ __version__ = "1.0.6"
 import argparse
 import base64
 from configparser import ConfigParser
+from functools import partial
 import getpass
-from gfxhat import touch
-import http.client
-import json
 from os import environ
-from time import sleep
+import queue
+from time import sleep, time
+from . import cache
+from .backends import create_backend
 from . import screendriver as disp
+from .backoff import CircuitBreaker, RetryPolicy
+from .connection import RejectedError, ServiceConnection, ServiceError, transient_statuses
+from .outbox import Outbox
+from piminder_helpers.timestamps import abbreviate
 import ssl
 import textwrap
-from datetime import datetime as dt
 
-# Globals are a bad code smell, but in a single-threaded environment nobody should care:
-current_index = 0  # For safety reasons, both these two indexes must be modulated in the actual display function.
-current_line_index = 0
-mark_current_read = False
-delete_current = False
-touched = 0  # A number of process cycles before the system will go back into standby mode. Prevents API hammering
+# Button presses arrive on the gfxhat touch thread; they are only ever queued there and applied by the main loop so
+# that every press is handled exactly once, in order, without the two threads sharing mutable state.
+input_events = queue.SimpleQueue()
+touch_cooldown = 500  # A number of process cycles before the system will go back into standby mode. Prevents API hammering
+resync_slack = 300  # Seconds before the last sync that catching up starts from, for posting clients whose clocks lag.
+
+
+class DisplayState(object):
+    """Navigation state owned by the main loop. Only the thread running runtime() may touch this."""
+    def __init__(self):
+        self.current_index = 0  # For safety reasons, both these indexes must be modulated in the actual display function.
+        self.current_line_index = 0
+        self.touched = 0
 
 
 def display_splash():
@@ -44,29 +55,37 @@ def display_splash():
 
 def enable_touch():  # It may be desirable in future to break the buttons out as unique handlers.
     for i in range(6):
-        touch.on(i, handler=handle_input)
-        touch.set_led(i, 0)
+        disp.on_touch(i, handle_input)
+        disp.set_led(i, 0)
 
 
 def handle_input(ch, event):
-    global current_index, current_line_index, mark_current_read, delete_current, touched
-    if event != 'press':
-        return
+    """Touch callback, run on the gfxhat thread. It does nothing but hand the channel to the main loop."""
+    if event == 'press':
+        input_events.put(ch)
+
+
+def drain_input():
+    """Yields every press queued since the last cycle, oldest first. Each press is yielded exactly once."""
+    while True:
+        try:
+            yield input_events.get_nowait()
+        except queue.Empty:
+            return
+
+
+def apply_navigation(ch, state):
+    """Applies a scrolling or paging press to the display state. Read/delete presses are handled by runtime()."""
     if ch == 0:  # "^" button, scroll up.
-        current_line_index -= 1
+        state.current_line_index -= 1
     if ch == 1:  # "v" button, scroll down
-        current_line_index += 1
-    if ch == 2:  # "<" button, mark the message as read.
-        mark_current_read = True
+        state.current_line_index += 1
     if ch == 3:  # "-" button, go to the previous message
-        current_index -= 1
-        current_line_index = 0
-    if ch == 4:  # Circle/middle button, delete message
-        delete_current = True
+        state.current_index -= 1
+        state.current_line_index = 0
     if ch == 5:  # "+" button, go to the next message
-        current_index += 1
-        current_line_index = 0
-    touched = 500
+        state.current_index += 1
+        state.current_line_index = 0
 
 
 def parse_args():
@@ -106,19 +125,17 @@ def parse_config(config_path):
     return vars_config
 
 
-def retrieve_messages(configuration, ssl_context):
-    conf = configuration
-    conn = http.client.HTTPSConnection(conf["service_host"], int(conf["service_port"]), context=ssl_context)
-    conn.request("GET", "/api/messages/", headers={"Authorization": conf["authorization"],
-                                                   "Content-type": "application/json"})
-    resp = conn.getresponse()
-    dict_resp = json.loads(resp.read())
-    if dict_resp["error"] not in [200, 400]:  # 400 just indicates that the message should not be marked read twice.
-        disp.clear_screen()
-        disp.print_line(0, "Retrieval Error:")
-        disp.print_line(1, "HTTP %s" % dict_resp["error"])
-        disp.print_line(2, "Fatal, exiting.")
-        exit(1)
+def retrieve_messages(service):
+    status, dict_resp = service.request("GET", "/api/messages/")
+    if status in transient_statuses:  # The service is up but struggling; back off and try again later.
+        raise ServiceError(status)
+    if status not in [200, 400]:  # 400 just indicates that the message should not be marked read twice.
+        raise RejectedError(status)
+
+    return unpack_listing(dict_resp)
+
+
+def unpack_listing(dict_resp):
     list_msg = []
     for item in dict_resp.items():  # We don't actually want an item, an ordered list of message objects is fine.
         if item[0] != "error":
@@ -127,66 +144,140 @@ def retrieve_messages(configuration, ssl_context):
     return list_msg
 
 
-def delete_message(configuration, list_messages, target_index, ssl_context):
+def retrieve_changes(service, since):
+    """Fetches only the messages raised or seen again since the given epoch seconds.
+
+    :return: a list of message dictionaries, or None if the service did not answer with one.
+    """
+    status, dict_resp = service.request("GET", "/api/messages/?changedSince=%d" % since)
+    if status in transient_statuses:
+        raise ServiceError(status)
+    if status != 200:
+        return None
+
+    return unpack_listing(dict_resp)
+
+
+def summary_matches(service, list_messages):
+    """Whether the service's message totals agree with a listing. A message deleted or marked read elsewhere is not
+    among the changes since the last sync, but it does show in the totals."""
+    status, dict_resp = service.request("GET", "/api/messages/summary/")
+    if status in transient_statuses:
+        raise ServiceError(status)
+    unread = len([message for message in list_messages if not message["read"]])
+
+    return status == 200 and dict_resp.get("total") == len(list_messages) and dict_resp.get("unread") == unread
+
+
+def merge_changes(list_messages, changes):
+    """Replaces or adds each changed message in a listing, keeping it newest first."""
+    merged = {message["messageId"]: message for message in list_messages}
+    merged.update((message["messageId"], message) for message in changes)
+
+    return sorted(merged.values(), key=lambda message: message["timestamp"], reverse=True)
+
+
+def catch_up(service, list_messages, synced, outbox):
+    """Brings a listing shown from the snapshot, or kept through an outage, up to date. Only the messages changed since
+    it was last synced are fetched, so long as the service's totals then agree with the result; otherwise, or if it
+    was never synced, the whole listing is fetched instead.
+
+    :param synced: when list_messages was last synced with the service, in epoch seconds, or None.
+    :return: the up-to-date list of message dictionaries.
+    """
+    if synced is not None and not outbox.has_pending():  # Unsent actions would put the totals out either way.
+        changes = retrieve_changes(service, max(0, synced - resync_slack))
+        if changes is not None:
+            merged = merge_changes(list_messages, changes)
+            if summary_matches(service, merged):
+                return merged
+
+    return retrieve_messages(service)
+
+
+def send_action(service, method, message_id):
+    """Sends a single mark-read (PATCH) or delete (DELETE) request for a message, returning the HTTP status."""
+    status, dict_resp = service.request(method, "/api/messages/", body={"messageId": message_id})
+
+    return status
+
+
+def delete_message(list_messages, target_index, outbox):
+    """Removes the message from the local list at once and leaves telling the service to the outbox."""
     if len(list_messages) > 0: # Needed to prevent a crash; calling this same length later can lead to a div/0 error
         target_index = target_index % len(list_messages)
-        conf = configuration
         target_mid = list_messages[target_index]["messageId"]
         list_messages.pop(target_index)  # this simply removes the message from list_messages
-        body_out = "{\"messageId\":\"%s\"}" % target_mid
-        conn = http.client.HTTPSConnection(conf["service_host"], int(conf["service_port"]), context=ssl_context)
-        conn.request("DELETE", "/api/messages/", headers={"Authorization": conf["authorization"],
-                                                          "Content-type": "application/json"}, body=body_out)
-        resp = conn.getresponse()
-        dict_resp = json.loads(resp.read())
-        if dict_resp["error"] not in [200, 400]:  # 400 prevents double-deletion from being fatal.
-            disp.clear_screen()
-            disp.print_line(0, "Deletion Error:")
-            disp.print_line(1, "HTTP %s" % dict_resp["error"])
-            disp.print_line(2, "Fatal, exiting.")
-            exit(1)
-    updated_messages = retrieve_messages(configuration, ssl_context)  # Fetching the messages forces a screen update
+        outbox.submit("DELETE", target_mid)
 
-    return updated_messages
+    return list_messages
 
 
-def mark_read_message(configuration, list_messages, target_index, ssl_context):
+def mark_read_message(list_messages, target_index, outbox):
+    """Marks the message read in the local list at once and leaves telling the service to the outbox."""
     if len(list_messages) > 0:  # Needed to prevent a crash; calling this same length later can lead to a div/0 error
         target_index = target_index % len(list_messages)
-        conf = configuration
-        target_mid = list_messages[target_index]["messageId"]
-        body_out = "{\"messageId\":\"%s\"}" % target_mid
-        conn = http.client.HTTPSConnection(conf["service_host"], int(conf["service_port"]), context=ssl_context)
-        conn.request("PATCH", "/api/messages/", headers={"Authorization": conf["authorization"],
-                                                         "Content-type": "application/json"}, body=body_out)
-        resp = conn.getresponse()
-        dict_resp = json.loads(resp.read())
-        if dict_resp["error"] not in [200, 400]:  # 400 is an error but not fatal; just means the message got hit twice.
-            disp.clear_screen()
-            disp.print_line(0, "Marking Read Error:")
-            disp.print_line(1, "HTTP %s" % dict_resp["error"])
-            disp.print_line(2, "Fatal, exiting.")
-            exit(1)
-    updated_messages = retrieve_messages(configuration, ssl_context)  # fetching the messages forces a screen update.
+        target_message = list_messages[target_index]
+        if not target_message["read"]:  # The service would only answer 400 for a second marking.
+            target_message["read"] = True
+            outbox.submit("PATCH", target_message["messageId"])
+
+    return list_messages
+
+
+def locate_message(list_messages, message_id, fallback_index):
+    """Finds where a message now sits in a refreshed listing, so the display stays on it across a sync."""
+    for index, message in enumerate(list_messages):
+        if message["messageId"] == message_id:
+            return index
+
+    return fallback_index
+
+
+def connection_glyph(breaker, offline):
+    """Picks the character shown after the timestamp: nothing while in sync, a clock while the listing is stale and
+    being retried, and a "!" while the circuit breaker considers the service down."""
+    if breaker.state == CircuitBreaker.open:
+        return "!"
+    if offline:
+        return "\u008B"
 
-    return updated_messages
+    return ""
 
 
-def display_messages(list_messages, target_message, current_top_line, config):
+def display_fault(breaker, config, rejected=None):
+    """Shown in place of messages when the service is unreachable and there is no listing to fall back on.
+
+    :param rejected: the HTTP status of the last RejectedError, if that was the fault, such as 401.
+    """
+    for each in range(6):
+        disp.set_led(each, 0)
+    disp.backlight_set_hue(config["minor_error_color"])
+    disp.print_line(3, "Piminder Monitor")
+    disp.print_line(4, "v%s" % __version__)
+    disp.print_line(5, "HTTP %s" % rejected if rejected else "")
+    disp.print_line(6, "Retry in %ds" % breaker.seconds_until_retry())
+    if breaker.state == CircuitBreaker.open:
+        disp.print_line(7, "Service Down...!")
+    else:
+        disp.print_line(7, "Network Fault...\u008B")
+
+
+def display_messages(list_messages, target_message, current_top_line, config, glyph=""):
     if len(list_messages) > 0: # Needed to prevent a crash; calling this same length later can lead to a div/0 error
         target_message = target_message % len(list_messages)
         this_message = list_messages[target_message]
         severity = this_message["errorLevel"]
         body = this_message["message"]
         service = this_message["name"]
-        time = this_message["timestamp"]
-        time_modifier = dt.strptime(time, "%Y-%m-%dT%H:%M:%SZ")  # The API returns an ISO 8601-compliant timestamp, but
-        time = time_modifier.strftime("%y-%m-%dT%H:%MZ")         # we need a shorter output time for the display
+        time = abbreviate(this_message["timestamp"])  # The API returns an ISO 8601 timestamp; the display needs it shorter
+        if glyph:  # The connection state; see connection_glyph().
+            time = "%-15s%s" % (time, glyph)
         is_read = this_message["read"]
         if not is_read:
-            touch.set_led(2, 1)
+            disp.set_led(2, 1)
         else:
-            touch.set_led(2, 0)
+            disp.set_led(2, 0)
         if severity.lower() == "info":
             disp.backlight_set_hue(config["info_color"])
             service = "%-15s\u0089" % service
@@ -199,21 +290,21 @@ def display_messages(list_messages, target_message, current_top_line, config):
         body_wrapped = textwrap.wrap(body, 16)
         current_top_line = current_top_line % len(body_wrapped)
         if current_top_line == 0:
-            touch.set_led(0, 0)
+            disp.set_led(0, 0)
         else:
-            touch.set_led(0, 1)
+            disp.set_led(0, 1)
         if current_top_line < len(body_wrapped) and len(body_wrapped) > 6:
-            touch.set_led(1, 1)
+            disp.set_led(1, 1)
         else:
-            touch.set_led(1, 0)
+            disp.set_led(1, 0)
         if target_message == 0:
-            touch.set_led(3, 0)
+            disp.set_led(3, 0)
         else:
-            touch.set_led(3, 1)
+            disp.set_led(3, 1)
         if target_message != (len(list_messages) - 1):
-            touch.set_led(5, 1)
+            disp.set_led(5, 1)
         else:
-            touch.set_led(5, 0)
+            disp.set_led(5, 0)
         disp.print_line(0, service)
         disp.print_line(1, time)
         for each in range(6):
@@ -236,51 +327,97 @@ def obtain_ssl_context(config):
 
 
 def runtime():
-    global current_index, current_line_index, mark_current_read, delete_current, touched
     path_config = parse_args()  # Since the monitor is callable (I _think_) from modules, we need to know where .cfg is
     dict_config = parse_config(path_config)  # If there was ever a kenshosec code smell, it's returning cfg as a dict
+    disp.set_backend(create_backend(dict_config))
     ssl_context = obtain_ssl_context(dict_config)
+    service = ServiceConnection(dict_config["service_host"], dict_config["service_port"],
+                                dict_config["authorization"], ssl_context,
+                                timeout=float(dict_config.get("service_timeout", 10)))
+    retry_policy = RetryPolicy(dict_config.get("retry_base_seconds", 1), dict_config.get("retry_cap_seconds", 300))
+    breaker = CircuitBreaker(retry_policy, dict_config.get("breaker_threshold", 3))
+    state = DisplayState()
+    outbox = Outbox(partial(send_action, service), retry_policy)
+    outbox.start()
     enable_touch()  # each button needs its own handler so we can't just loop.
-    disp.backlight_set_hue(dict_config["color_resting"])
-    display_splash()  # The delay for the splash screen display is set in display_splash as a constant.
-    list_messages = []  # To avoid a race condition that can cause a crash.
+    snapshot = cache.Snapshot(dict_config["cache_path"]) if dict_config.get("cache_path") else None
+    synced = None  # When list_messages was last synced with the service, in epoch seconds.
+    if snapshot:
+        list_messages, synced = snapshot.load()
+    else:
+        list_messages = []  # To avoid a race condition that can cause a crash.
+    offline = True  # Until the first sync, anything on screen is from the snapshot.
+    rejected = None  # The status of the last RejectedError, until a sync succeeds.
+    if list_messages:  # Warm start; show what we knew at shutdown while the first sync runs.
+        display_messages(list_messages, state.current_index, state.current_line_index, dict_config,
+                         connection_glyph(breaker, offline))
+    else:
+        disp.backlight_set_hue(dict_config["color_resting"])
+        display_splash()  # The delay for the splash screen display is set in display_splash as a constant.
     while True:
         try:
-            if touched == 0:
-                list_messages = retrieve_messages(dict_config, ssl_context)
-                touched = 500
-            else:
-                touched -= 1
-            if delete_current:
-                list_messages = delete_message(dict_config, list_messages, current_index, ssl_context)
-                delete_current = False
-            if mark_current_read:
-                list_messages = mark_read_message(dict_config, list_messages, current_index, ssl_context)
-                mark_current_read = False
+            changed = False
+            if state.touched > 0:
+                state.touched -= 1
+            elif breaker.allow():
+                state.touched = touch_cooldown
+                if list_messages:
+                    current_mid = list_messages[state.current_index % len(list_messages)]["messageId"]
+                else:
+                    current_mid = None
+                started = time()
+                if offline:  # Catch up with whatever changed while the listing was from the snapshot or stale.
+                    list_messages = outbox.reconcile(catch_up(service, list_messages, synced, outbox))
+                else:
+                    list_messages = outbox.reconcile(retrieve_messages(service))
+                synced = started
+                breaker.record_success()
+                state.current_index = locate_message(list_messages, current_mid, state.current_index)
+                offline = False
+                rejected = None
+                changed = True
+            for ch in drain_input():  # Presses are applied in the order made, so "+" then "O" deletes the next one.
+                if ch == 2:  # "<" button, mark the message as read.
+                    list_messages = mark_read_message(list_messages, state.current_index, outbox)
+                    changed = True
+                elif ch == 4:  # Circle/middle button, delete message
+                    list_messages = delete_message(list_messages, state.current_index, outbox)
+                    changed = True
+                else:
+                    apply_navigation(ch, state)
+                state.touched = touch_cooldown
+            if changed and snapshot:
+                try:
+                    snapshot.save(list_messages, synced)
+                except OSError:  # Losing the snapshot only costs the next warm start; it is not a network fault.
+                    pass
             if len(list_messages) != 0:
-                display_messages(list_messages, current_index, current_line_index, dict_config)
+                display_messages(list_messages, state.current_index, state.current_line_index, dict_config,
+                                 connection_glyph(breaker, offline))
+            elif offline:
+                display_fault(breaker, dict_config, rejected)
+                sleep(1)
             else:
-                touched = 0  # Without this, we will iterate over touch at a rate of -1 in 15 sec = Bad
+                state.touched = 0  # Without this, we will iterate over touch at a rate of -1 in 15 sec = Bad
                 disp.backlight_set_hue(dict_config["color_resting"])
                 disp.clear_screen()
                 for each in range(6):
-                    touch.set_led(each, 0)
+                    disp.set_led(each, 0)
                 display_splash()
         except KeyboardInterrupt:  # Hard to imagine how this could happen but it would still be nice to be graceful
+            service.close()
             disp.clear_screen()
             disp.kill_backlight()
             for each in range(6):
-                touch.set_led(each, 0)
+                disp.set_led(each, 0)
             exit(0)
-        except OSError:  # In the event of a network availability issue, the other functions can raise this.
-            disp.clear_screen()
-            for each in range(6):
-                touch.set_led(each, 0)
-            disp.print_line(3, "Piminder Monitor")
-            disp.print_line(4, "v%s" % __version__)
-            disp.print_line(7, "Network Fault...\u008B")
-            disp.backlight_set_hue(dict_config["minor_error_color"])
-            sleep(60)
+        except OSError as error:  # In the event of a network availability issue, the other functions can raise this.
+            breaker.record_failure()  # The breaker now decides when the next sync may be attempted.
+            rejected = error.status if isinstance(error, RejectedError) else None
+            state.touched = 0
+            if not offline:
+                disp.clear_screen()
+            offline = True
 
 
 if __name__ == "__main__":
@@ -0,0 +1,137 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It defines the display backends screendriver can draw to: the GFX HAT itself, and a headless in-memory stand-in which
+lets the monitor be run, inspected and timed on machines without the HAT.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from collections import Counter
+import struct
+import zlib
+
+lcd_width = 128
+lcd_height = 64
+
+
+class GfxHatBackend(object):
+    """Draws to the Pimoroni GFX HAT. gfxhat is imported here rather than at module load so that nothing else in the
+    monitor needs it installed."""
+    def __init__(self):
+        from gfxhat import lcd, backlight, touch
+        self.lcd = lcd
+        self.backlight = backlight
+        self.touch = touch
+
+    def set_pixel(self, x, y, value):
+        self.lcd.set_pixel(x, y, value)
+
+    def show(self):
+        self.lcd.show()
+
+    def clear(self):
+        self.lcd.clear()
+
+    def set_backlight(self, red, green, blue):
+        self.backlight.set_all(red, green, blue)
+        self.backlight.show()
+
+    def set_led(self, channel, value):
+        self.touch.set_led(channel, value)
+
+    def on_touch(self, channel, handler):
+        self.touch.on(channel, handler=handler)
+
+
+class HeadlessBackend(object):
+    """Keeps the LCD, backlight and LEDs in memory. Every call is tallied in self.calls, which is what the rendering
+    benchmark reports per redraw; press() stands in for a finger on the touch pads.
+
+    :param frame_path: if given, every show() also writes the visible frame to this path as a PNG.
+    :param scale: the size in image pixels of one LCD pixel in dumped PNGs.
+    """
+    def __init__(self, frame_path=None, scale=4):
+        self.frame_path = frame_path
+        self.scale = int(scale)
+        self.pixels = [bytearray(lcd_width) for _ in range(lcd_height)]  # The LCD's buffer, not yet shown.
+        self.frame = [bytearray(lcd_width) for _ in range(lcd_height)]   # What the LCD is showing.
+        self.backlight = (0, 0, 0)
+        self.leds = [0] * 6
+        self.handlers = {}
+        self.calls = Counter()
+
+    def set_pixel(self, x, y, value):
+        self.calls["set_pixel"] += 1
+        self.pixels[y][x] = 1 if value else 0
+
+    def show(self):
+        self.calls["show"] += 1
+        self.frame = [bytearray(row) for row in self.pixels]
+        if self.frame_path:
+            self.dump_png(self.frame_path)
+
+    def clear(self):
+        self.calls["clear"] += 1
+        self.pixels = [bytearray(lcd_width) for _ in range(lcd_height)]
+
+    def set_backlight(self, red, green, blue):
+        self.calls["set_backlight"] += 1
+        self.backlight = (red, green, blue)
+
+    def set_led(self, channel, value):
+        self.calls["set_led"] += 1
+        self.leds[channel] = value
+
+    def on_touch(self, channel, handler):
+        self.handlers[channel] = handler
+
+    def press(self, channel):
+        """Simulates pressing and releasing a touch pad, exactly as gfxhat reports it."""
+        handler = self.handlers.get(channel)
+        if handler:
+            handler(channel, 'press')
+            handler(channel, 'release')
+
+    def dump_png(self, path):
+        """Writes the visible frame as an RGB PNG: lit pixels dark, unlit pixels in the backlight colour.
+
+        :param path: where to write the image.
+        :return:
+        """
+        scale = self.scale
+        lit = b"\x00\x00\x00" * scale
+        unlit = bytes(self.backlight) * scale
+        rows = []
+        for row in self.frame:
+            scanline = b"\x00" + b"".join(lit if pixel else unlit for pixel in row)  # Leading 0: no PNG filter.
+            rows.extend([scanline] * scale)
+        header = struct.pack(">IIBBBBB", lcd_width * scale, lcd_height * scale, 8, 2, 0, 0, 0)
+        with open(path, "wb") as f:
+            f.write(b"\x89PNG\r\n\x1a\n")
+            f.write(png_chunk(b"IHDR", header))
+            f.write(png_chunk(b"IDAT", zlib.compress(b"".join(rows))))
+            f.write(png_chunk(b"IEND", b""))
+
+
+def png_chunk(chunk_type, data):
+    checksum = zlib.crc32(chunk_type + data) & 0xffffffff
+
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", checksum)
+
+
+def create_backend(config):
+    """Builds the backend named by the display_backend option of the monitor config, defaulting to the GFX HAT.
+
+    :param config: the dictionary returned by parse_config().
+    :return: a backend object for screendriver.set_backend().
+    """
+    name = str(config.get("display_backend", "gfxhat")).lower()
+    if name == "gfxhat":
+        return GfxHatBackend()
+    if name == "headless":
+        return HeadlessBackend(frame_path=config.get("frame_path"))
+    raise ValueError("Unknown display_backend: %s" % name)
@@ -0,0 +1,77 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It defines the retry policy and circuit breaker the monitor uses to recover from network faults quickly without
+hammering a service that is genuinely down.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import random
+import time
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter: the nth retry waits a random time between zero and base * 2^n seconds,
+    never more than cap seconds. The jitter keeps several monitors from retrying in lockstep after an outage."""
+    def __init__(self, base_seconds=1.0, cap_seconds=300.0):
+        self.base_seconds = float(base_seconds)
+        self.cap_seconds = float(cap_seconds)
+
+    def delay(self, attempt):
+        """
+        :param attempt: how many retries have already been made, starting from 0.
+        :return: seconds to wait before the next one.
+        """
+        ceiling = min(self.cap_seconds, self.base_seconds * (2 ** min(attempt, 32)))
+
+        return random.uniform(0, ceiling)
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures of calls to the service and decides when the next call may be made.
+
+    closed: calls are allowed; failures so far are retried after a backoff delay.
+    open: at least `threshold` consecutive failures; the service is treated as down until the backoff delay passes.
+    half-open: the delay has passed and one trial call is being made. Success closes the breaker, failure reopens it
+    with a longer delay.
+
+    The breaker is not locked; it belongs to whichever single thread makes the calls it guards.
+    """
+    closed = "closed"
+    open = "open"
+    half_open = "half-open"
+
+    def __init__(self, policy, threshold=3, clock=time.monotonic):
+        self.policy = policy
+        self.threshold = int(threshold)
+        self.clock = clock
+        self.state = self.closed
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def allow(self):
+        """Returns whether a call may be made now, moving an open breaker to half-open once its delay has passed."""
+        if self.clock() < self.retry_at:
+            return False
+        if self.state == self.open:
+            self.state = self.half_open
+
+        return True
+
+    def record_success(self):
+        self.state = self.closed
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def record_failure(self):
+        self.failures += 1
+        self.retry_at = self.clock() + self.policy.delay(self.failures - 1)
+        if self.state == self.half_open or self.failures >= self.threshold:
+            self.state = self.open
+
+    def seconds_until_retry(self):
+        return max(0.0, self.retry_at - self.clock())
@@ -0,0 +1,107 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It benchmarks the monitor's rendering path against the headless display backend, so changes to screendriver, the font
+or display_messages can be measured on any machine: `python3 -m piminder_monitor.benchmark`.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from . import screendriver as disp
+from .__main__ import display_messages
+from .backends import HeadlessBackend
+
+sample_config = {"info_color": "#00FF00", "minor_error_color": "#FFF70F", "major_error_color": "#FF0000"}
+sample_messages = [
+    {"messageId": "0", "name": "backup-job", "errorLevel": "major", "timestamp": "2021-06-01T04:00:00Z",
+     "read": False, "message": "Nightly backup failed: the destination volume was not mounted at /mnt/backup."},
+    {"messageId": "1", "name": "cert-watch", "errorLevel": "minor", "timestamp": "2021-06-01T05:30:00Z",
+     "read": True, "message": "Certificate for the lab proxy expires in 12 days."},
+    {"messageId": "2", "name": "uptime", "errorLevel": "info", "timestamp": "2021-06-01T06:00:00Z",
+     "read": False, "message": "All hosts answered."},
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark Piminder monitor rendering on the headless backend.")
+    parser.add_argument('--seconds', type=float, default=2.0, help="How long to run each timed loop.")
+    parser.add_argument('--png', help="Also write the last rendered frame to this path.", action="store")
+    return parser.parse_args()
+
+
+def time_loop(func, seconds):
+    """Calls func repeatedly for roughly the given number of seconds.
+
+    :return: a tuple of (calls made, calls per second).
+    """
+    calls = 0
+    start = time.perf_counter()
+    deadline = start + seconds
+    while time.perf_counter() < deadline:
+        func(calls)
+        calls += 1
+    elapsed = time.perf_counter() - start
+
+    return calls, calls / elapsed
+
+
+def time_import(module):
+    """Times a cold import of module in a fresh interpreter, so earlier imports in this process do not skew it."""
+    code = "import time; t = time.perf_counter(); import %s; print(time.perf_counter() - t)" % module
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+
+    return float(output.stdout.strip())
+
+
+def bench_print_line(backend, seconds):
+    text = "Piminder Monitor"
+    calls, rate = time_loop(lambda i: disp.print_line(i % 8, text), seconds)
+    backend.calls.clear()
+    disp.print_line(0, text)
+
+    return rate, dict(backend.calls)
+
+
+def bench_display_messages(backend, seconds):
+    def redraw(i):
+        display_messages(sample_messages, i, 0, sample_config)
+    calls, rate = time_loop(redraw, seconds)
+    backend.calls.clear()
+    redraw(0)
+
+    return rate, dict(backend.calls)
+
+
+def runtime():
+    args = parse_args()
+    backend = HeadlessBackend()
+    disp.set_backend(backend)
+
+    print("%-36s %12s" % ("benchmark", "result"))
+    for module in ["piminder_monitor.font", "piminder_monitor.screendriver", "piminder_monitor.__main__"]:
+        print("%-36s %10.1fms" % ("import " + module, time_import(module) * 1000))
+
+    rate, calls = bench_print_line(backend, args.seconds)
+    print("%-36s %10.1f/s" % ("print_line", rate))
+    for name in sorted(calls):
+        print("%-36s %12d" % ("  %s per line" % name, calls[name]))
+
+    rate, calls = bench_display_messages(backend, args.seconds)
+    print("%-36s %10.1f/s" % ("display_messages (frames)", rate))
+    for name in sorted(calls):
+        print("%-36s %12d" % ("  %s per redraw" % name, calls[name]))
+
+    if args.png:
+        backend.dump_png(args.png)
+        print("Last frame written to %s" % args.png)
+
+
+if __name__ == "__main__":
+    runtime()
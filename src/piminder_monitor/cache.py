@@ -0,0 +1,119 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It keeps an on-disk snapshot of the last message listing the monitor saw, so that it has something to show straight
+after boot and for as long as the service cannot be reached.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import json
+import os
+import tempfile
+
+snapshot_version = 1
+# Each message is stored as a bare list in this order, which keeps the file small on an SD card.
+snapshot_fields = ["messageId", "name", "errorLevel", "timestamp", "read", "message"]
+
+
+def snapshot_rows(list_messages):
+    """:return: the listing as the rows pack_snapshot stores, which compare equal exactly when what is stored would."""
+    return [[message[field] for field in snapshot_fields] for message in list_messages]
+
+
+def pack_snapshot(list_messages, synced=None):
+    """Serializes a message listing into the compact snapshot format.
+
+    :param list_messages: the list of message dictionaries as used by the monitor.
+    :param synced: when the listing was last brought up to date with the service, in epoch seconds, if ever.
+    :return: bytes ready to be written by save_snapshot.
+    """
+    return pack_rows(snapshot_rows(list_messages), synced)
+
+
+def pack_rows(rows, synced=None):
+    snapshot = {"v": snapshot_version, "messages": rows}
+    if synced is not None:
+        snapshot["synced"] = int(synced)
+
+    return json.dumps(snapshot, separators=(",", ":")).encode('utf8')
+
+
+def save_snapshot(path, packed):
+    """Atomically replaces the snapshot at path, so a power cut leaves either the old snapshot or the new one.
+
+    :param path: the path to the snapshot file.
+    :param packed: the bytes returned by pack_snapshot.
+    :return:
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    descriptor, path_temp = tempfile.mkstemp(prefix=".piminder-snapshot-", dir=directory)
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(packed)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path_temp, path)
+    except OSError:
+        try:
+            os.unlink(path_temp)
+        except OSError:
+            pass
+        raise
+
+
+def load_snapshot(path):
+    """Reads the snapshot at path back into a message listing. A missing, unreadable or foreign snapshot is treated
+    as empty rather than as an error, since it is only ever a head start.
+
+    :param path: the path to the snapshot file.
+    :return: a tuple of a list of message dictionaries, possibly empty, and when it was last synced in epoch seconds,
+    or None if that is not known.
+    """
+    try:
+        with open(path, "rb") as f:
+            snapshot = json.loads(f.read())
+        if snapshot["v"] != snapshot_version:
+            return [], None
+        return [dict(zip(snapshot_fields, row)) for row in snapshot["messages"]], snapshot.get("synced")
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return [], None
+
+
+class Snapshot(object):
+    """The snapshot at path, rewritten only when the listing has changed or the sync time it holds is more than refresh
+    seconds behind, which spares the SD card a write on every sync while keeping a warm start's catch-up short.
+
+    :param path: the path to the snapshot file.
+    :param refresh: seconds the saved sync time may lag the latest before it is rewritten on its own.
+    """
+    def __init__(self, path, refresh=600):
+        self.path = path
+        self.refresh = refresh
+        self.rows = None  # What was last saved or loaded, to compare against.
+        self.synced = None
+
+    def load(self):
+        """:return: the same as load_snapshot."""
+        list_messages, self.synced = load_snapshot(self.path)
+        self.rows = snapshot_rows(list_messages)
+
+        return list_messages, self.synced
+
+    def save(self, list_messages, synced):
+        """Saves the listing and when it was synced, if either has moved on enough to be worth a write; raises OSError
+        if the write fails.
+
+        :return: whether the snapshot was written.
+        """
+        rows = snapshot_rows(list_messages)
+        stale = synced is not None and (self.synced is None or synced - self.synced >= self.refresh)
+        if rows == self.rows and not stale:
+            return False
+        save_snapshot(self.path, pack_rows(rows, synced))
+        self.rows, self.synced = rows, synced
+
+        return True
@@ -0,0 +1,146 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It manages the single keep-alive HTTPS connection the monitor uses for every call to the Piminder service.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import http.client
+import json
+import threading
+import time
+
+
+class ServiceError(ConnectionError):
+    """Raised for HTTP statuses that mean the service is temporarily unable to answer, such as a 503 or a proxy's 502.
+    Being an OSError, it is handled exactly like the network being down."""
+    def __init__(self, status):
+        super().__init__("The service answered HTTP %s" % status)
+        self.status = status
+
+
+class RejectedError(ServiceError):
+    """Raised for any other status given instead of a listing, such as a 401 once the monitor's password has been
+    changed, or a 404 from a misconfigured proxy. These will not pass on their own, but the monitor keeps retrying at
+    its backoff and shows the status, so it recovers once an operator has fixed the cause."""
+
+
+transient_statuses = [408, 429, 500, 502, 503, 504]
+
+
+class ResumingHTTPSConnection(http.client.HTTPSConnection):
+    """An HTTPSConnection which offers the previous TLS session back to the server whenever it has to reconnect,
+    sparing the Pi a full handshake where the server supports resumption."""
+    def __init__(self, host, port, context, timeout):
+        super().__init__(host, port, context=context, timeout=timeout)
+        self.tls_session = None
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)  # Plain TCP first, exactly as HTTPSConnection does.
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host, session=self.tls_session)
+
+    def remember_session(self):
+        """Keeps the current session for the next reconnect. TLS 1.3 only delivers the ticket after the handshake, so
+        this is called once a response has come back rather than from connect()."""
+        if self.sock is not None and self.sock.session is not None:
+            self.tls_session = self.sock.session
+
+
+class ServiceConnection(object):
+    """One persistent connection to the Piminder service, shared by the main loop and the outbox worker.
+
+    Requests are serialized by a lock. A connection the server has quietly dropped is reopened and the request tried
+    once more; any other failure closes the connection and is raised as an OSError for the caller to handle.
+
+    The basic credentials are exchanged for a bearer token from /api/tokens/, which is renewed a minute before it
+    expires or whenever the service stops accepting it. A service too old to issue tokens gets the credentials instead.
+    """
+    def __init__(self, host, port, authorization, ssl_context, timeout=10):
+        self.authorization = authorization
+        self.token = None
+        self.token_expiry = 0  # time.monotonic() after which the token is renewed.
+        self.use_tokens = True
+        self.lock = threading.Lock()
+        self.connection = ResumingHTTPSConnection(host, int(port), context=ssl_context, timeout=timeout)
+
+    def request(self, method, path, body=None):
+        """Sends a request and reads the whole response.
+
+        :param method: the HTTP method.
+        :param path: the path on the service, eg "/api/messages/".
+        :param body: an optional object to be sent as the JSON body.
+        :return: a tuple of the HTTP status and the deserialized JSON response.
+        """
+        if body is not None:
+            body = json.dumps(body)
+        with self.lock:
+            authorization = self.current_authorization()
+            status, payload = self.exchange(method, path, body, authorization)
+            if status == 401 and authorization == self.token:  # Revoked, or the service has a new secret.
+                self.token = None
+                status, payload = self.exchange(method, path, body, self.current_authorization())
+
+        return status, self.parse(payload)
+
+    def current_authorization(self):
+        """The bearer token, fetched or renewed if need be, or the basic credentials if no token can be had. Called
+        with the lock held. Raises RejectedError if the service answers 200 without a usable token."""
+        if not self.use_tokens:
+            return self.authorization
+        if self.token is None or time.monotonic() >= self.token_expiry:
+            self.token = None
+            status, payload = self.exchange("POST", "/api/tokens/", None, self.authorization)
+            dict_resp = self.parse(payload)
+            if status == 200:
+                try:
+                    token, expires_in = str(dict_resp["token"]), int(dict_resp["expiresIn"])
+                except (KeyError, TypeError, ValueError):  # Raised as an OSError, so callers retry it as any other.
+                    raise RejectedError(status)
+                self.token = "Bearer %s" % token
+                self.token_expiry = time.monotonic() + expires_in - 60
+            elif status in [404, 405]:  # This service predates tokens.
+                self.use_tokens = False
+
+        return self.token or self.authorization
+
+    def exchange(self, method, path, body, authorization):
+        """Sends one request on the shared connection, reconnecting once if the keep-alive was dropped. Called with
+        the lock held.
+
+        :return: a tuple of the HTTP status and the raw response body.
+        """
+        headers = {"Authorization": authorization, "Content-type": "application/json"}
+        for attempt in range(2):
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                resp = self.connection.getresponse()
+                self.connection.remember_session()
+                payload = resp.read()
+                break
+            except (ConnectionResetError, BrokenPipeError, http.client.CannotSendRequest):
+                # Most likely a keep-alive the server already closed; a fresh connection gets one more try.
+                self.connection.close()
+                if attempt:
+                    raise
+            except http.client.HTTPException as e:
+                self.connection.close()
+                raise ConnectionError("Malformed response from the service: %s" % e) from e
+            except OSError:
+                self.connection.close()
+                raise
+
+        return resp.status, payload
+
+    def parse(self, payload):
+        try:
+            return json.loads(payload)
+        except ValueError:  # Proxies answer errors in HTML; the status is all we need in that case.
+            return {}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,116 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It holds the outbox which carries mark-read and delete requests to the service in the background, so that the monitor
+can apply them to its own message list the moment a button is pressed.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from .backoff import RetryPolicy
+
+
+class Outbox(object):
+    """A single background worker which sends queued actions to the service, retrying until the service settles them.
+
+    An action is a (method, message_id) pair, where method is the HTTP method to use against /api/messages/.
+    Actions stay pending until the service has answered them, and pending actions are re-applied over every listing
+    fetched in the meantime so a refresh never brings back a message the user has already dealt with.
+
+    An action that fails is not waited on; it is given a time to be retried at, and the worker goes on to whatever else
+    is due first, so one failing action never holds up those queued behind it. Any answer from the service settles an
+    action except a 5xx, 408 or 429, which are worth retrying. A 400 just means the message was already read or
+    already deleted, and other 4xx would be answered the same way however often they were retried.
+    """
+    retried_statuses = [408, 429]
+
+    def __init__(self, sender, policy=None, max_attempts=12, clock=time.monotonic):
+        """
+        :param sender: a callable taking (method, message_id) and returning the HTTP status of the response. It may
+        raise OSError when the service cannot be reached.
+        :param policy: the RetryPolicy deciding how long to wait before retrying an action the service did not settle.
+        :param max_attempts: how many times to try an action before giving up on it.
+        :param clock: the monotonic clock retries are scheduled against.
+        """
+        self.sender = sender
+        self.policy = policy or RetryPolicy()
+        self.max_attempts = max_attempts
+        self.clock = clock
+        self.pending = set()
+        self.lock = threading.Condition()
+        self.schedule = []  # A heap of (due time, sequence, method, message_id, attempt); earliest first.
+        self.sequence = itertools.count()  # Keeps actions due at the same time in the order they were scheduled.
+        self.worker = threading.Thread(target=self.run, name="piminder-outbox", daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def submit(self, method, message_id):
+        with self.lock:
+            self.pending.add((method, message_id))
+            self.enqueue(self.clock(), method, message_id, 1)
+
+    def enqueue(self, due, method, message_id, attempt):
+        """Schedules an attempt at an action; the caller holds the lock."""
+        heapq.heappush(self.schedule, (due, next(self.sequence), method, message_id, attempt))
+        self.lock.notify()
+
+    def has_pending(self):
+        with self.lock:
+            return bool(self.pending)
+
+    def settles(self, status):
+        return status < 500 and status not in self.retried_statuses
+
+    def reconcile(self, list_messages):
+        """Applies every still-pending action to a freshly-retrieved listing.
+
+        :param list_messages: the list of message dictionaries as returned by the service.
+        :return: the list with pending deletions removed and pending mark-reads applied.
+        """
+        with self.lock:
+            pending = set(self.pending)
+        if not pending:
+            return list_messages
+        reconciled = []
+        for message in list_messages:
+            message_id = message["messageId"]
+            if ("DELETE", message_id) in pending:
+                continue
+            if ("PATCH", message_id) in pending:
+                message["read"] = True
+            reconciled.append(message)
+
+        return reconciled
+
+    def next_due(self):
+        """Waits until the earliest scheduled attempt is due, and takes it off the schedule."""
+        with self.lock:
+            while True:
+                wait = self.schedule[0][0] - self.clock() if self.schedule else None
+                if wait is not None and wait <= 0:
+                    return heapq.heappop(self.schedule)[2:]
+                self.lock.wait(wait)  # Woken early by enqueue(), in case the new action is due sooner.
+
+    def run(self):
+        while True:
+            self.send(*self.next_due())
+
+    def send(self, method, message_id, attempt):
+        """Makes one attempt at an action, and settles it or schedules the next."""
+        try:
+            settled = self.settles(self.sender(method, message_id))
+        except OSError:  # The network or the service is down; that is what retrying is for.
+            settled = False
+        with self.lock:
+            if settled or attempt >= self.max_attempts:
+                self.pending.discard((method, message_id))
+            else:
+                self.enqueue(self.clock() + self.policy.delay(attempt - 1), method, message_id, attempt + 1)
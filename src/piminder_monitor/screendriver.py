@@ -9,9 +9,24 @@ Full license and documentation to be found at:
 https://github.com/ZAdamMac/Piminder
 """
 
-from gfxhat import lcd, backlight
 from . import font
 
+backend = None  # Whatever set_backend() was given; the GFX HAT is loaded on first use if nothing else was chosen.
+
+
+def set_backend(new_backend):
+    """Directs all further drawing to new_backend, such as a backends.HeadlessBackend."""
+    global backend
+    backend = new_backend
+
+
+def get_backend():
+    global backend
+    if backend is None:
+        from .backends import GfxHatBackend
+        backend = GfxHatBackend()
+    return backend
+
 
 def print_line(line_index, input_string):
     """ Prints the displayed text on one of the 5 output rows. Strings too long to be displayed will be truncated.
@@ -20,6 +35,7 @@ def print_line(line_index, input_string):
     :param input_string: Output string not to exceed 16 characters.
     :return:
    """
+    display = get_backend()
     line_absolute = dict_absolute_line_indexes[line_index]
     # a dictionary of the positions of the upper row of each printable "line"
     char_index = 0
@@ -32,17 +48,16 @@ def print_line(line_index, input_string):
             for pixel in font.font[this_character][line_offset]:
                 addr_x = char_index + pixel_offset
                 addr_y = line_absolute + line_offset
-                lcd.set_pixel(addr_x, addr_y, pixel)
+                display.set_pixel(addr_x, addr_y, pixel)
                 pixel_offset += 1
             line_offset += 1
         char_index += 8
 
-    lcd.show()
+    display.show()
 
 
 def kill_backlight():
-    backlight.set_all(0, 0, 0)
-    backlight.show()
+    get_backend().set_backlight(0, 0, 0)
 
 
 def backlight_set_hue(hue):
@@ -54,13 +69,23 @@ def backlight_set_hue(hue):
     red = int(hue[1:3], 16)
     green = int(hue[3:5], 16)
     blue = int(hue[5:7], 16)
-    backlight.set_all(red, green, blue)
-    backlight.show()
+    get_backend().set_backlight(red, green, blue)
 
 
 def clear_screen():
-    lcd.clear()
-    lcd.show()
+    display = get_backend()
+    display.clear()
+    display.show()
+
+
+def set_led(channel, value):
+    """Lights (1) or darkens (0) the LED behind one of the six touch pads."""
+    get_backend().set_led(channel, value)
+
+
+def on_touch(channel, handler):
+    """Registers handler(channel, event) to be called from the touch thread when the given pad is used."""
+    get_backend().on_touch(channel, handler)
 
 # This small dictionary allows us to address the lines as lines of text rather than individual pixel-tall lines
 dict_absolute_line_indexes = {
@@ -0,0 +1,28 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It sets up the monitor's tests, which draw to a headless backend instead of the GFX HAT.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from piminder_monitor import screendriver  # noqa: E402
+from piminder_monitor.backends import HeadlessBackend  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def headless():
+    backend = HeadlessBackend()
+    screendriver.set_backend(backend)
+    yield backend
+    screendriver.set_backend(None)
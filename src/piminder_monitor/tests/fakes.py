@@ -0,0 +1,41 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It holds the stand-ins the monitor's tests use in place of the service.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+
+class FakeService(object):
+    """Answers request() as ServiceConnection would, from responses keyed by (method, path).
+
+    :param responses: a dictionary of (method, path): (status, dictionary) pairs.
+    """
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    def request(self, method, path, body=None):
+        self.requests.append((method, path))
+        return self.responses[(method, path)]
+
+
+class Clock(object):
+    """A time.monotonic() that only moves when a test sets now."""
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def listing(*messages):
+    """A listing as GET /api/messages/ returns it."""
+    response = {str(position): message for position, message in enumerate(messages)}
+    response["error"] = 200
+
+    return response
@@ -0,0 +1,83 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It tests the retry policy's delays and walks the circuit breaker through its states against a fake clock.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from piminder_monitor.backoff import CircuitBreaker, RetryPolicy
+from fakes import Clock
+
+
+class DoublingPolicy(object):
+    """RetryPolicy without the jitter: the nth retry waits 10 * 2^n seconds."""
+    def delay(self, attempt):
+        return 10.0 * 2 ** attempt
+
+
+def breaker(threshold=3):
+    return CircuitBreaker(DoublingPolicy(), threshold, clock=Clock())
+
+
+@pytest.mark.parametrize("attempt, ceiling", [(0, 1.0), (1, 2.0), (5, 32.0), (9, 300.0), (1000, 300.0)])
+def test_delays_stay_under_the_ceiling(attempt, ceiling):
+    policy = RetryPolicy(base_seconds=1, cap_seconds=300)
+
+    assert all(0 <= policy.delay(attempt) <= ceiling for each in range(200))
+
+
+def test_opens_after_threshold_failures():
+    guard = breaker()
+    for each in range(2):
+        assert guard.allow()
+        guard.record_failure()
+        assert guard.state == CircuitBreaker.closed  # Still closed, but waiting out the backoff.
+        guard.clock.now = guard.retry_at
+    guard.record_failure()
+
+    assert guard.state == CircuitBreaker.open
+    assert guard.seconds_until_retry() == 40.0
+    assert not guard.allow()
+
+
+def test_half_open_trial_success_closes():
+    guard = breaker(threshold=1)
+    guard.record_failure()
+    guard.clock.now = 9.0
+    assert not guard.allow() and guard.state == CircuitBreaker.open
+
+    guard.clock.now = 10.0
+    assert guard.allow()
+    assert guard.state == CircuitBreaker.half_open
+
+    guard.record_success()
+    assert guard.state == CircuitBreaker.closed
+    assert guard.failures == 0 and guard.allow()
+
+
+def test_half_open_trial_failure_reopens_for_longer():
+    guard = breaker(threshold=1)
+    guard.record_failure()
+    guard.clock.now = 10.0
+    guard.allow()
+    guard.record_failure()
+
+    assert guard.state == CircuitBreaker.open
+    assert guard.seconds_until_retry() == 20.0
+    assert not guard.allow()
+
+
+def test_success_while_closed_resets_the_count():
+    guard = breaker()
+    guard.record_failure()
+    guard.record_failure()
+    guard.record_success()
+    guard.record_failure()
+
+    assert guard.state == CircuitBreaker.closed
+    assert guard.failures == 1
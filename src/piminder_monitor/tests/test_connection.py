@@ -0,0 +1,44 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It tests how the monitor's connection exchanges its credentials for a bearer token.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from piminder_monitor.connection import RejectedError, ServiceConnection
+
+
+def connection_answering(token_payload):
+    """A ServiceConnection whose token exchange gets token_payload, and whose other requests get an empty listing."""
+    connection = ServiceConnection("localhost", 443, "Basic YWRtaW46cGFzc3dvcmQ=", None)
+    sent = []
+
+    def exchange(method, path, body, authorization):
+        sent.append((path, authorization))
+        if path == "/api/tokens/":
+            return 200, token_payload
+        return 200, b'{"error": 200}'
+
+    connection.exchange = exchange
+
+    return connection, sent
+
+
+def test_token_is_used_once_fetched():
+    connection, sent = connection_answering(b'{"token": "abc", "expiresIn": 900, "error": 200}')
+
+    assert connection.request("GET", "/api/messages/") == (200, {"error": 200})
+    assert sent[-1] == ("/api/messages/", "Bearer abc")
+
+
+@pytest.mark.parametrize("payload", [b'{"error": 200}', b'{"token": "abc", "expiresIn": "soon"}', b'[]', b'<html>'])
+def test_malformed_token_response_is_rejected(payload):
+    connection, sent = connection_answering(payload)
+
+    with pytest.raises(RejectedError):  # An OSError, which the outbox and main loop retry.
+        connection.request("GET", "/api/messages/")
@@ -0,0 +1,49 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It tests that button presses reach the main loop exactly once each, in the order they were made.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import threading
+
+from piminder_monitor.__main__ import DisplayState, apply_navigation, drain_input, handle_input
+
+
+def test_presses_are_drained_once_in_order():
+    for ch in [5, 5, 2, 3]:
+        handle_input(ch, "press")
+    handle_input(4, "release")  # Only presses count.
+
+    assert list(drain_input()) == [5, 5, 2, 3]
+    assert list(drain_input()) == []
+
+
+def test_presses_from_another_thread_are_all_kept():
+    def press_many():
+        for each in range(1000):
+            handle_input(each % 6, "press")
+
+    presser = threading.Thread(target=press_many)
+    presser.start()
+    drained = []
+    while presser.is_alive():
+        drained.extend(drain_input())
+    presser.join()
+    drained.extend(drain_input())
+
+    assert drained == [each % 6 for each in range(1000)]
+
+
+def test_navigation_moves_between_messages_and_lines():
+    state = DisplayState()
+    for ch in [5, 5, 1, 1, 3]:
+        apply_navigation(ch, state)
+
+    assert (state.current_index, state.current_line_index) == (1, 0)
+    apply_navigation(1, state)
+    assert state.current_line_index == 1
@@ -0,0 +1,100 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It tests the outbox's retry schedule, stepping its worker by hand against a fake clock.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from piminder_monitor.outbox import Outbox
+from fakes import Clock
+
+
+class FixedPolicy(object):
+    """Waits 10 seconds before the first retry, 20 before the second, and so on."""
+    def delay(self, attempt):
+        return 10.0 * (attempt + 1)
+
+
+def outbox_answering(statuses, max_attempts=12):
+    """An outbox whose sender answers each message id with the next status listed for it, raising OSError for
+    None. Every call is kept in sent."""
+    sent = []
+
+    def sender(method, message_id):
+        sent.append((method, message_id))
+        status = statuses[message_id].pop(0)
+        if status is None:
+            raise OSError("unreachable")
+        return status
+
+    return Outbox(sender, FixedPolicy(), max_attempts, clock=Clock()), sent
+
+
+def due(outbox):
+    return sorted((when, message_id, attempt) for when, sequence, method, message_id, attempt in outbox.schedule)
+
+
+def test_failures_are_rescheduled_without_holding_up_others():
+    outbox, sent = outbox_answering({"a": [503, 200], "b": [200]})
+    outbox.submit("PATCH", "a")
+    outbox.submit("DELETE", "b")
+    outbox.send(*outbox.next_due())
+
+    assert due(outbox) == [(0.0, "b", 1), (10.0, "a", 2)]  # b is not kept waiting behind a's retry.
+    outbox.send(*outbox.next_due())
+    assert sent == [("PATCH", "a"), ("DELETE", "b")]
+    assert outbox.pending == {("PATCH", "a")}
+
+    outbox.clock.now = 10.0
+    outbox.send(*outbox.next_due())
+    assert not outbox.has_pending()
+
+
+def test_actions_are_sent_in_due_order():
+    outbox, sent = outbox_answering({"a": [None, 200], "b": [None, None, 200], "c": [200]})
+    for message_id in ["a", "b"]:
+        outbox.submit("PATCH", message_id)
+    outbox.send(*outbox.next_due())
+    outbox.send(*outbox.next_due())
+    outbox.clock.now = 5.0
+    outbox.submit("PATCH", "c")
+
+    assert outbox.next_due()[1] == "c"
+    outbox.clock.now = 10.0
+    assert [outbox.next_due()[1] for each in range(2)] == ["a", "b"]  # Both due at 10, so in the order scheduled.
+
+
+@pytest.mark.parametrize("status, settled", [(200, True), (400, True), (401, True), (404, True), (408, False),
+                                             (429, False), (500, False), (503, False), (None, False)])
+def test_which_answers_settle(status, settled):
+    outbox, sent = outbox_answering({"a": [status]})
+    outbox.submit("DELETE", "a")
+    outbox.send(*outbox.next_due())
+
+    assert outbox.has_pending() is not settled
+    assert len(outbox.schedule) == (0 if settled else 1)
+
+
+def test_gives_up_after_max_attempts():
+    outbox, sent = outbox_answering({"a": [503, 503, 503]}, max_attempts=3)
+    outbox.submit("PATCH", "a")
+    for retry_at in [0.0, 10.0, 30.0]:
+        outbox.clock.now = retry_at
+        outbox.send(*outbox.next_due())
+
+    assert len(sent) == 3
+    assert not outbox.has_pending() and not outbox.schedule
+
+
+def test_pending_actions_are_applied_to_a_fresh_listing():
+    outbox, sent = outbox_answering({})
+    outbox.submit("PATCH", "a")
+    outbox.submit("DELETE", "b")
+    listing = [{"messageId": "a", "read": False}, {"messageId": "b", "read": False}, {"messageId": "c", "read": False}]
+
+    assert outbox.reconcile(listing) == [{"messageId": "a", "read": True}, {"messageId": "c", "read": False}]
@@ -0,0 +1,59 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It tests that the on-disk snapshot gives back the listing, and when it was last synced, as they were saved.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from piminder_monitor.cache import Snapshot, load_snapshot, pack_snapshot, save_snapshot
+
+list_messages = [{"messageId": "b", "name": "backup", "errorLevel": "major", "timestamp": "2021-06-02T00:00:00Z",
+                  "read": False, "message": "Backup failed."},
+                 {"messageId": "a", "name": "cron", "errorLevel": "info", "timestamp": "2021-06-01T00:00:00Z",
+                  "read": True, "message": "Ran."}]
+
+
+def test_round_trip_keeps_messages_and_synced(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    save_snapshot(path, pack_snapshot(list_messages, synced=1622505600.7))
+
+    assert load_snapshot(path) == (list_messages, 1622505600)
+
+
+def test_never_synced_loads_as_none(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    save_snapshot(path, pack_snapshot(list_messages))
+
+    assert load_snapshot(path) == (list_messages, None)
+
+
+def test_saving_replaces_the_old_snapshot(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    save_snapshot(path, pack_snapshot(list_messages, synced=1))
+    save_snapshot(path, pack_snapshot(list_messages[:1], synced=2))
+
+    assert load_snapshot(path) == (list_messages[:1], 2)
+    assert [each.name for each in tmp_path.iterdir()] == ["snapshot.json"]  # No temporary files left behind.
+
+
+def test_missing_or_bad_snapshot_is_empty(tmp_path):
+    assert load_snapshot(str(tmp_path / "absent.json")) == ([], None)
+    for content in [b"not json", b"[]", b'{"v": 99, "messages": []}', b'{"v": 1}']:
+        (tmp_path / "bad.json").write_bytes(content)
+        assert load_snapshot(str(tmp_path / "bad.json")) == ([], None)
+
+
+def test_snapshot_is_rewritten_when_the_listing_changes_or_its_sync_time_lags(tmp_path):
+    snapshot = Snapshot(str(tmp_path / "snapshot.json"), refresh=600)
+    snapshot.load()
+
+    assert snapshot.save(list_messages, 1000)
+    assert not snapshot.save(list_messages, 1300)  # Nothing changed, and the saved sync time is recent enough.
+    assert snapshot.save(list_messages[:1], 1400)
+    assert not snapshot.save(list_messages[:1], 1900)
+    assert snapshot.save(list_messages[:1], 2000)
+    assert load_snapshot(snapshot.path) == (list_messages[:1], 2000)
@@ -0,0 +1,93 @@
+"""
+This script is a component of the monitoring service for the Piminder alert management utility.
+It tests how the monitor fetches message listings from the service, and catches up on what changed while it was away.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+A Kensho Security Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from piminder_monitor.__main__ import catch_up, resync_slack, retrieve_messages
+from piminder_monitor.connection import RejectedError, ServiceError
+from fakes import FakeService, listing
+
+
+class Outbox(object):
+    def __init__(self, pending=False):
+        self.pending = pending
+
+    def has_pending(self):
+        return self.pending
+
+
+def message(message_id, timestamp, read=False):
+    return {"messageId": message_id, "name": "test", "errorLevel": "info", "timestamp": timestamp, "read": read,
+            "message": "Message %s" % message_id}
+
+
+def test_listing_is_unpacked_in_order():
+    service = FakeService({("GET", "/api/messages/"): (200, listing(message("b", "2021-06-02T00:00:00Z"),
+                                                                  message("a", "2021-06-01T00:00:00Z")))})
+
+    assert [each["messageId"] for each in retrieve_messages(service)] == ["b", "a"]
+
+
+@pytest.mark.parametrize("status", [401, 403, 404])
+def test_other_errors_are_rejected_rather_than_fatal(status):
+    service = FakeService({("GET", "/api/messages/"): (status, {})})
+    with pytest.raises(RejectedError) as raised:
+        retrieve_messages(service)
+
+    assert raised.value.status == status
+    assert isinstance(raised.value, OSError)  # So runtime() hands it to the circuit breaker.
+
+
+def test_transient_errors_are_service_errors():
+    service = FakeService({("GET", "/api/messages/"): (503, {})})
+    with pytest.raises(ServiceError) as raised:
+        retrieve_messages(service)
+
+    assert not isinstance(raised.value, RejectedError)
+
+
+synced = 1622592000  # 2021-06-02T00:00:00Z
+changes_path = "/api/messages/?changedSince=%d" % (synced - resync_slack)
+shown = [message("b", "2021-06-02T00:00:00Z"), message("a", "2021-06-01T00:00:00Z")]
+fresh = [message("c", "2021-06-03T00:00:00Z"), message("b", "2021-06-02T00:00:00Z", read=True),
+         message("a", "2021-06-01T00:00:00Z")]
+
+
+def test_changes_are_merged_when_the_totals_agree():
+    service = FakeService({("GET", changes_path): (200, listing(fresh[0], fresh[1])),
+                           ("GET", "/api/messages/summary/"): (200, {"total": 3, "unread": 2, "error": 200})})
+
+    assert catch_up(service, shown, synced, Outbox()) == fresh
+    assert service.requests == [("GET", changes_path), ("GET", "/api/messages/summary/")]
+
+
+def test_full_fetch_when_the_totals_disagree():
+    # "a" was deleted elsewhere, which is not among the changes but does show in the totals.
+    service = FakeService({("GET", changes_path): (200, listing(fresh[0])),
+                           ("GET", "/api/messages/summary/"): (200, {"total": 2, "unread": 2, "error": 200}),
+                           ("GET", "/api/messages/"): (200, listing(fresh[0], shown[0]))})
+
+    assert catch_up(service, shown, synced, Outbox()) == [fresh[0], shown[0]]
+    assert service.requests[-1] == ("GET", "/api/messages/")
+
+
+def test_full_fetch_when_changes_are_refused():
+    service = FakeService({("GET", changes_path): (400, {}), ("GET", "/api/messages/"): (200, listing(*fresh))})
+
+    assert catch_up(service, shown, synced, Outbox()) == fresh
+    assert service.requests == [("GET", changes_path), ("GET", "/api/messages/")]
+
+
+@pytest.mark.parametrize("last_synced, pending", [(None, False), (synced, True)])
+def test_full_fetch_when_never_synced_or_actions_pending(last_synced, pending):
+    service = FakeService({("GET", "/api/messages/"): (200, listing(*fresh))})
+
+    assert catch_up(service, shown, last_synced, Outbox(pending)) == fresh
+    assert service.requests == [("GET", "/api/messages/")]
@@ -10,7 +10,10 @@ https://github.com/ZAdamMac/Piminder
 
 from flask import Blueprint
 from flask_restful import Api
+from resources.instrumentation import begin_request, end_request
 from resources.messages import MessageAPI
+from resources.summary import SummaryAPI
+from resources.tokens import TokenAPI
 from resources.users import UsersAPI
 from resources.unique_messages import UniqueMessageAPI
 
@@ -19,8 +22,12 @@ __version__ = "1.1.0"  # This version represents the overall version of the serv
 
 api_bp = Blueprint('api', __name__)
 api = Api(api_bp)
+api_bp.before_request(begin_request)  # Per-phase timing for every API request; see resources/instrumentation.py
+api_bp.after_request(end_request)
 
 # New Routes below this line
 api.add_resource(MessageAPI, '/messages/')
 api.add_resource(UniqueMessageAPI, '/messages/unique/')
+api.add_resource(SummaryAPI, '/messages/summary/')
 api.add_resource(UsersAPI, '/users/')
+api.add_resource(TokenAPI, '/tokens/')
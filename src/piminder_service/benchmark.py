@@ -0,0 +1,402 @@
+"""
+This script is a component of Piminder's back-end controller.
+It is a load-testing harness: it brings the service up in-process against the configured database, drives it with a
+configurable mix of requests from concurrent clients, and reports latency percentiles, throughput and database
+queries per request (as reported in each response's Server-Timing header). Run it from this directory, like run.py,
+against a database you do not mind filling. With --validators it instead times the request validators, and with
+--ids it compares the insert rate of random and time-ordered message ids, and with --hammer it checks that concurrent
+patches and deletes of one message each succeed exactly once.
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+
+An Arcana Labs utility.
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import math
+import os
+from os import environ
+import random
+import re
+import sys
+import threading
+import time
+import timeit
+import uuid
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+# In a checkout, piminder_helpers is next to this directory rather than installed or copied in beside it.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from piminder_helpers.timestamps import now  # noqa: E402
+from resources.db_autoinit import runtime as db_autoinit  # noqa: E402
+from resources.ids import new_id  # noqa: E402
+from resources.messages import schema_message  # noqa: E402
+from resources.storage import connect_backend  # noqa: E402
+from resources.users import schema_user  # noqa: E402
+from run import create_app, enforce_defaults, parse_config, parse_env  # noqa: E402
+
+bench_name = "piminder-benchmark"  # Every message posted by the benchmark carries this name, so it can be cleaned up.
+default_mix = "post=4,unique=2,get=2,patch=1,delete=1,users=0"
+
+
+def queries_from_server_timing(header):
+    """Pulls the query count out of the db entry the instrumentation adds to each Server-Timing header."""
+    match = re.search(r'db;desc="(\d+) queries"', header or "")
+
+    return int(match.group(1)) if match else 0
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):  # Per-request logging would be most of what we measured.
+        pass
+
+
+class Results(object):
+    """Latencies, statuses and query counts for each operation in the mix."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.queries = {}
+
+    def record(self, operation, seconds, ok, queries):
+        with self.lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            self.errors[operation] = self.errors.get(operation, 0) + (0 if ok else 1)
+            self.queries[operation] = self.queries.get(operation, 0) + queries
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load-test the Piminder service API.")
+    parser.add_argument('--config', default="piminder-service.conf", help="Path to the service config file.")
+    parser.add_argument('--clients', type=int, default=8, help="Number of concurrent clients.")
+    parser.add_argument('--requests', type=int, default=200, help="Requests made by each client.")
+    parser.add_argument('--mix', default=default_mix,
+                        help="Relative weights of post, unique, get, patch, delete and users requests.")
+    parser.add_argument('--keep', action="store_true", help="Leave the benchmark's messages in the database.")
+    parser.add_argument('--validators', action="store_true",
+                        help="Instead of load-testing, compare the compiled request validators with json_validate.")
+    parser.add_argument('--ids', type=int, metavar="ROWS",
+                        help="Instead of load-testing, insert ROWS messages with random ids and then with "
+                             "time-ordered ids, straight through the storage layer, and compare the insert rates.")
+    parser.add_argument('--hammer', type=int, metavar="THREADS",
+                        help="Instead of load-testing, have THREADS clients patch and then delete the same message at "
+                             "once, over and over, and check that exactly one of each succeeds and the summary agrees.")
+    parser.add_argument('--sqlite', metavar="PATH",
+                        help="Run against a SQLite database at PATH (created if needed) instead of the configured one.")
+    return parser.parse_args()
+
+
+def json_validate(test_json, dict_schema):
+    """The request validator that resources/schema.py replaced, kept here as the baseline for --validators.
+
+    A simplistic JSON validator for pre-clearing missing or incorrectly-
+    typed arguments in a request body. Controlled by arguments and returns
+    a tuple in (boolean, errors) format indicating whether or not the body
+    passed and what, if any, errors are indicated.
+
+    :param test_json: A deserialized JSON object (usually a dict)
+    :param dict_schema: a dictionary of the object schema with key-value pairs
+    where value should be of the same type as the expected type in the JSON.
+    :return: tuple of boolean and an error dictionary.
+    """
+    list_response = []
+    testable = {0: (test_json, dict_schema)}
+    counter = 0
+    for thing in testable:
+        test_object, active_schema = testable[thing]
+        for field in active_schema:
+            try:
+                value = test_json[field]
+            except KeyError:
+                list_response.append({str(field): "Field missing from request"})
+                continue
+            expect_type = dict_schema[field]
+            if not isinstance(value, type(expect_type)):
+                # We use type(expect_type) here because sometimes the value is a dict or list
+                # rather than being a type object
+                list_response.append({str(field): ("Value is not of the expected type: %s" % type(expect_type))})
+                continue
+            if expect_type == dict:
+                counter += 1
+                testable.update({counter: (value, dict_schema[field])})
+        if len(list_response) == 0:
+            return True, list_response
+        else:
+            dict_response = {}
+            for error in list_response:
+                dict_response.update(error)
+            return False, dict_response
+
+
+def legacy_message_validate(body):
+    """messages_post's validation as it was: json_validate, then a separate errorlevel check."""
+    json_valid, errors = json_validate(body, {"name": "", "timestamp": "", "errorlevel": "", "message": ""})
+    if body["errorlevel"] not in ["info", "minor", "major"]:
+        json_valid = False
+    return json_valid, errors
+
+
+def legacy_user_validate(body):
+    json_valid, errors = json_validate(body, {"username": "", "permissionLevel": "", "memo": "", "password": ""})
+    if body["permissionLevel"] not in {"service": 1, "monitor": 2, "admin": 3}:
+        json_valid = False
+    return json_valid, errors
+
+
+def bench_validators():
+    """Times each validator on the same bodies, and prints the mean microseconds per call of each."""
+    message = {"name": bench_name, "timestamp": "2021-06-01T04:00:00Z", "errorlevel": "major", "message": "Failed."}
+    bad_message = {"name": 7, "timestamp": "2021-06-01T04:00:00Z", "errorlevel": "dire", "message": "Failed."}
+    user = {"username": "monitor", "permissionLevel": "monitor", "memo": "The office Pi.", "password": "hunter2"}
+    cases = [("message, valid", legacy_message_validate, schema_message.validate, message),
+             ("message, invalid", legacy_message_validate, schema_message.validate, bad_message),
+             ("user, valid", legacy_user_validate, schema_user.validate, user)]
+
+    print("%-20s %14s %14s %9s" % ("body", "json_validate", "Schema", "speedup"))
+    for name, legacy, compiled, body in cases:
+        results = []
+        for validate in [legacy, compiled]:
+            number, seconds = timeit.Timer(lambda: validate(body)).autorange()
+            results.append(seconds / number * 1000000)
+        print("%-20s %12.2fus %12.2fus %8.1fx" % (name, results[0], results[1], results[0] / results[1]))
+
+
+def bench_ids(config, rows, keep=False):
+    """Inserts rows messages through the storage layer once with random (version 4) ids, as the service used to make
+    them, and once with time-ordered (version 7) ids from resources/ids.py, committing every 100, and prints the insert
+    rate of each. The difference grows with the size of the table, so run it against one with plenty of messages.
+    """
+    print("%-8s %10s %12s" % ("ids", "seconds", "inserts/s"))
+    for label, make_id in [("uuid4", lambda: str(uuid.uuid4())), ("uuid7", new_id)]:
+        store = connect_backend(vars(config))
+        inserted = []
+        start = time.perf_counter()
+        for first in range(0, rows, 100):
+            for each in range(first, min(first + 100, rows)):
+                inserted.append(make_id())
+                store.insert_message({"id": inserted[-1], "name": bench_name, "timestamp": int(time.time()),
+                                      "errorlevel": "info", "message": "Insert %d." % each, "read": False})
+            store.commit()
+        seconds = time.perf_counter() - start
+        print("%-8s %10.2f %12.1f" % (label, seconds, rows / seconds))
+        if not keep:
+            store.delete_messages(inserted)
+            store.commit()
+        store.close()
+
+
+def parse_mix(mix):
+    weights = {}
+    for term in mix.split(","):
+        operation, weight = term.split("=")
+        weights[operation.strip()] = int(weight)
+
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already-sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+
+    return sorted_values[rank - 1]
+
+
+class Client(object):
+    """One benchmark client: a keep-alive connection and its share of the request mix."""
+    def __init__(self, port, authorization, message_ids, results):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port)
+        self.headers = {"Authorization": authorization, "Content-type": "application/json"}
+        self.message_ids = message_ids
+        self.results = results
+
+    def request(self, method, path, body=None):
+        self.connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                                headers=self.headers)
+        resp = self.connection.getresponse()
+        payload = resp.read()
+        self.last_queries = queries_from_server_timing(resp.getheader("Server-Timing"))
+
+        return resp.status, payload
+
+    def run(self, operations, count):
+        for each in range(count):
+            operation = random.choice(operations)
+            method, path, body = self.build(operation)
+            start = time.perf_counter()
+            status, payload = self.request(method, path, body)
+            elapsed = time.perf_counter() - start
+            ok = status == 200 or (status == 400 and operation in ["patch", "delete"])  # 400: another client won.
+            self.results.record(operation, elapsed, ok, self.last_queries)
+            if operation == "get" and status == 200:
+                self.message_ids.refill(payload)
+
+    def build(self, operation):
+        timestamp = now()
+        if operation == "post":
+            return "POST", "/api/messages/", {"name": bench_name, "timestamp": timestamp, "errorlevel": "info",
+                                              "message": "Benchmark message %s" % random.random()}
+        if operation == "unique":
+            return "POST", "/api/messages/unique/", {"name": bench_name, "timestamp": timestamp, "errorlevel": "minor",
+                                                     "message": "Benchmark repeat %s" % random.randint(0, 9),
+                                                     "updateTimestamp": True}
+        if operation == "get":
+            return "GET", "/api/messages/", None
+        if operation == "patch":
+            return "PATCH", "/api/messages/", {"messageId": self.message_ids.pick()}
+        if operation == "delete":
+            return "DELETE", "/api/messages/", {"messageId": self.message_ids.take()}
+        if operation == "users":
+            return "GET", "/api/users/", None
+        raise ValueError("Unknown operation in mix: %s" % operation)
+
+
+class MessageIds(object):
+    """The pool of benchmark message ids that patch and delete requests draw from, refilled by each listing."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = []
+
+    def refill(self, payload):
+        listing = json.loads(payload)
+        ids = [message["messageId"] for key, message in listing.items()
+               if key != "error" and message["name"] == bench_name]
+        with self.lock:
+            self.ids = ids
+
+    def pick(self):
+        with self.lock:
+            return random.choice(self.ids) if self.ids else "no-such-message"
+
+    def take(self):
+        with self.lock:
+            return self.ids.pop(random.randrange(len(self.ids))) if self.ids else "no-such-message"
+
+
+def bench_hammer(port, authorization, threads, rounds=20):
+    """Posts a message, has threads clients patch it at the same moment and then delete it at the same moment, and
+    counts the successes; exactly one of each should succeed, however the requests interleave. Then checks that the
+    summary's counts still agree with the listing.
+
+    :return: True if every round and the final check passed.
+    """
+    status, payload = Client(port, authorization, None, None).request("POST", "/api/tokens/")
+    if status == 200:  # A bcrypt check per request would serialize the clients before they reached the database.
+        authorization = "Bearer %s" % json.loads(payload)["token"]
+    clients = [Client(port, authorization, None, None) for each in range(threads)]
+    status, payload = clients[0].request("GET", "/api/messages/summary/")
+    if status != 200:
+        print("The service could not summarize messages (HTTP %s); check the database and credentials." % status)
+        return False
+    before = json.loads(payload)["byName"].get(bench_name, {"total": 0, "unread": 0})
+    print("%-8s %7s %9s %9s" % ("round", "threads", "patched", "deleted"))
+    passed = True
+    for each in range(rounds):
+        status, payload = clients[0].request("POST", "/api/messages/", {
+            "name": bench_name, "timestamp": now(), "errorlevel": "info", "message": "Hammered message %d" % each})
+        message_id = json.loads(payload)["messageId"]
+        wins = {}
+        for method in ["PATCH", "DELETE"]:
+            barrier = threading.Barrier(threads)
+            statuses = []
+
+            def hit(client):
+                barrier.wait()
+                statuses.append(client.request(method, "/api/messages/", {"messageId": message_id})[0])
+
+            workers = [threading.Thread(target=hit, args=(client,)) for client in clients]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            wins[method] = statuses.count(200)
+            passed = passed and wins[method] == 1 and statuses.count(400) == threads - 1
+        print("%-8d %7d %9d %9d" % (each, threads, wins["PATCH"], wins["DELETE"]))
+
+    status, payload = clients[0].request("GET", "/api/messages/summary/")
+    after = json.loads(payload)["byName"].get(bench_name, {"total": 0, "unread": 0})
+    consistent = after["total"] == before["total"] and after["unread"] == before["unread"]
+    print("Summary for %s: %d total, %d unread before; %d total, %d unread after." % (
+        bench_name, before["total"], before["unread"], after["total"], after["unread"]))
+    print("PASSED" if passed and consistent else "FAILED")
+
+    return passed and consistent
+
+
+def report(results, wall_seconds):
+    total = sum(len(values) for values in results.latencies.values())
+    print("%-8s %7s %7s %9s %9s %9s %9s" % ("op", "count", "errors", "p50 ms", "p95 ms", "p99 ms", "queries"))
+    for operation in sorted(results.latencies):
+        values = sorted(results.latencies[operation])
+        print("%-8s %7d %7d %9.2f %9.2f %9.2f %9.2f" % (
+            operation, len(values), results.errors[operation],
+            percentile(values, 0.50) * 1000, percentile(values, 0.95) * 1000, percentile(values, 0.99) * 1000,
+            results.queries[operation] / len(values)))
+    print("%d requests in %.2fs: %.1f req/s" % (total, wall_seconds, total / wall_seconds))
+
+
+def runtime():
+    args = parse_args()
+    if args.validators:
+        bench_validators()
+        return
+    weights = parse_mix(args.mix)
+    operations = [operation for operation in weights for each in range(weights[operation])]
+    config = parse_env(parse_config(args.config))
+    if args.sqlite:
+        config.STORAGE = "sqlite"
+        config.SQLITE_PATH = args.sqlite
+    config = enforce_defaults(config)
+    if args.sqlite:
+        db_autoinit(vars(config))  # Uses the same PIMINDER_ADMIN_USER and PIMINDER_ADMIN_PASSWORD as below.
+    if args.ids:
+        bench_ids(config, args.ids, args.keep)
+        return
+    app = create_app(config)
+    admin_user = environ["PIMINDER_ADMIN_USER"]
+    admin_password = environ["PIMINDER_ADMIN_PASSWORD"]
+    authorization = "Basic %s" % base64.b64encode(("%s:%s" % (admin_user, admin_password)).encode('utf8')).decode()
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    if args.hammer:
+        passed = bench_hammer(server.port, authorization, args.hammer)
+        server.shutdown()
+        exit(0 if passed else 1)
+    message_ids = MessageIds()
+    results = Results()
+    clients = [Client(server.port, authorization, message_ids, results) for each in range(args.clients)]
+    status, payload = clients[0].request("GET", "/api/messages/")
+    if status != 200:
+        print("The service could not list messages (HTTP %s); check the database and credentials." % status)
+        server.shutdown()
+        exit(1)
+    message_ids.refill(payload)
+
+    threads = [threading.Thread(target=client.run, args=(operations, args.requests)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - start
+    report(results, wall_seconds)
+
+    if not args.keep:
+        status, payload = clients[0].request("GET", "/api/messages/")
+        message_ids.refill(payload)
+        for message_id in list(message_ids.ids):
+            clients[0].request("DELETE", "/api/messages/", {"messageId": message_id})
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    runtime()
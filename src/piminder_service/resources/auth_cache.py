@@ -0,0 +1,88 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource remembers basic auth credentials that have passed their bcrypt check, so that a client which sends the
+same Authorization header on every request pays for the check once every AUTH_CACHE_TTL seconds instead of every
+time. Headers are kept only as an HMAC under a key made fresh for each process. A remembered header is forgotten
+as soon as its user's bearer tokens are revoked, which happens whenever the user is changed or deactivated, so a new
+password or permission level takes effect just as it does for tokens. An AUTH_CACHE_TTL of 0 turns the cache off.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask import current_app
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from .bearer_tokens import revocations
+
+cache_key = secrets.token_bytes(32)
+max_entries = 1000  # Past this many, expired entries are dropped, and then everything if that was not enough.
+
+lock = threading.Lock()
+entries = {}  # HMAC of the header: (expiry, username, permlevel, verified in milliseconds since the epoch)
+
+
+def digest(header):
+    return hmac.new(cache_key, header.encode('utf8'), hashlib.sha256).digest()
+
+
+def lookup(header, store):
+    """:param header: the whole Authorization header.
+    :param store: a storage object, used only if the revocations are due to be reloaded.
+    :return: a tuple of the username and permission level header was last verified as, or None if it has not been
+    verified recently, or its user has been changed since.
+    """
+    key = digest(header)
+    with lock:
+        entry = entries.get(key)
+    if entry is None:
+        return None
+    expiry, username, permlevel, verified = entry
+    if expiry <= time.monotonic() or revocations.is_revoked(username, verified, store):
+        with lock:
+            entries.pop(key, None)
+        return None
+
+    return username, permlevel
+
+
+def cached_username(header):
+    """The username header was last verified as, if that was within AUTH_CACHE_TTL, without consulting the
+    revocations and so without the database; enough to tell whose rate limits a request comes under, but not to
+    authenticate it.
+
+    :param header: the whole Authorization header.
+    :return: the username, or None if header has not been verified recently.
+    """
+    with lock:
+        entry = entries.get(digest(header))
+    if entry is None or entry[0] <= time.monotonic():
+        return None
+
+    return entry[1]
+
+
+def remember(header, username, permlevel, verified):
+    """Remembers that header has just passed its bcrypt check, as username with permlevel.
+
+    :param verified: when the user's row was about to be read for the check, in milliseconds since the epoch; a
+    revocation since then, such as for a password change, could have been missed by the check and so forgets it.
+    """
+    ttl = float(current_app.config.get("AUTH_CACHE_TTL", 60))
+    if ttl <= 0:
+        return
+    now = time.monotonic()
+    with lock:
+        if len(entries) >= max_entries:
+            for key in [key for key, entry in entries.items() if entry[0] <= now]:
+                del entries[key]
+            if len(entries) >= max_entries:
+                entries.clear()
+        entries[digest(header)] = (now + ttl, username, permlevel, verified)
@@ -0,0 +1,155 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource issues and checks signed bearer tokens, which spare a client a bcrypt check on every request. A token
+carries its user's name, permission level, and issue and expiry times, signed with HMAC-SHA256 under TOKEN_SECRET, so
+checking one needs no database at all. A user's tokens are revoked whenever the user is changed or deactivated; the
+revocations are kept in the token_revocations table and cached in each process, which reloads them every
+TOKEN_REVOCATION_REFRESH seconds to learn of those made by other workers.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import base64
+from flask import current_app
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+
+generated_secret = secrets.token_bytes(32)  # Used if TOKEN_SECRET is unset; good only for this process's lifetime.
+
+
+class Revocations(object):
+    """The newest revocation per user, in milliseconds since the epoch; tokens issued at or before it are invalid."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.revoked = {}  # username, lowercased: revoked_at
+        self.loaded = None  # time.monotonic() of the last reload, or None before the first.
+
+    def is_revoked(self, username, issued, store):
+        """:param issued: when the token was issued, in milliseconds since the epoch.
+        :param store: a storage object to reload the revocations from, if they are due to be reloaded."""
+        now = time.monotonic()
+        with self.lock:
+            due = self.loaded is None or now - self.loaded >= float(current_app.config.get(
+                "TOKEN_REVOCATION_REFRESH", 5))
+            if due:
+                self.loaded = now  # Claimed, so other requests carry on with the revocations already loaded.
+        if due:
+            self.reload(store)
+
+        return issued <= self.revoked.get(username.lower(), -1)
+
+    def reload(self, store):
+        since = int((time.time() - float(current_app.config.get("TOKEN_TTL", 900))) * 1000)
+        revoked = {}
+        for row in store.list_token_revocations(since):  # Older revocations can only match expired tokens.
+            username = row["username"].lower()
+            revoked[username] = max(revoked.get(username, -1), int(row["revoked_at"]))
+        with self.lock:
+            for username, revoked_at in self.revoked.items():  # Keep any added here since the query ran.
+                revoked[username] = max(revoked.get(username, -1), revoked_at)
+            self.revoked = revoked
+
+    def add(self, username, revoked_at):
+        with self.lock:
+            self.revoked[username.lower()] = max(self.revoked.get(username.lower(), -1), revoked_at)
+
+
+revocations = Revocations()
+
+
+def secret():
+    configured = current_app.config.get("TOKEN_SECRET")
+    return str(configured).encode('utf8') if configured else generated_secret
+
+
+def encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode('ascii')
+
+
+def decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def sign(payload):
+    return encode(hmac.new(secret(), payload.encode('ascii'), hashlib.sha256).digest())
+
+
+def issue(username, permlevel):
+    """Issues a token for username, good for TOKEN_TTL seconds.
+
+    :param permlevel: the user's permission level, which the token carries.
+    :return: a tuple of the token and its lifetime in seconds.
+    """
+    ttl = int(current_app.config.get("TOKEN_TTL", 900))
+    now = time.time()
+    payload = encode(json.dumps({"sub": username, "lvl": int(permlevel), "iat": int(now * 1000),
+                                 "exp": int(now) + ttl}, separators=(",", ":")).encode('utf8'))
+
+    return "%s.%s" % (payload, sign(payload)), ttl
+
+
+def read_payload(token):
+    """The claims in a token, unverified.
+
+    :raises ValueError: if token is not shaped like one of ours.
+    """
+    payload, signature = token.split(".")
+    claims = json.loads(decode(payload))
+    if not isinstance(claims, dict):
+        raise ValueError("Not a token: %r" % token)
+
+    return claims
+
+
+def signed_claims(token):
+    """Checks a token's signature and expiry, which needs no database, but not whether it has been revoked.
+
+    :param token: the token, without its "Bearer " prefix.
+    :return: a tuple of the username, permission level and issue time it carries, or None if it is not valid.
+    """
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, sign(payload)):
+            return None
+        claims = read_payload(token)
+        username, permlevel = claims["sub"], int(claims["lvl"])
+        issued, expires = int(claims["iat"]), int(claims["exp"])
+    except (ValueError, KeyError, TypeError, OverflowError):  # Bad base64 and bad JSON both raise ValueErrors.
+        return None
+    if not isinstance(username, str) or expires <= time.time():
+        return None
+
+    return username, permlevel, issued
+
+
+def verify(token, store):
+    """Checks a token's signature, expiry and revocation.
+
+    :param token: the token, without its "Bearer " prefix.
+    :param store: a storage object, used only if the revocations are due to be reloaded.
+    :return: a tuple of the username and permission level it carries, or None if it is not valid.
+    """
+    claims = signed_claims(token)
+    if claims is None:
+        return None
+    username, permlevel, issued = claims
+    if revocations.is_revoked(username, issued, store):
+        return None
+
+    return username, permlevel
+
+
+def revoke(username, store):
+    """Revokes every token so far issued to username, once store's transaction commits."""
+    revoked_at = int(time.time() * 1000)
+    store.revoke_tokens(username, revoked_at)
+    store.after_commit(lambda: revocations.add(username, revoked_at))
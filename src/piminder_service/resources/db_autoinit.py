@@ -13,6 +13,8 @@ import bcrypt
 import getpass
 import os
 import pymysql
+import sqlite3
+from .storage import MariaDBStorage, SQLiteStorage, sqlite_connect
 
 __version__ = "1.0.0"  # This is the version of service that we can init, NOT the version of the script itself.
 
@@ -35,6 +37,126 @@ spec_tables = [
     )"""
 ]
 
+spec_tables_sqlite = [  # The same tables for the embedded backend; times are epoch seconds and read_flag is 0 or 1.
+    """CREATE TABLE IF NOT EXISTS messages (
+      id TEXT NOT NULL PRIMARY KEY,
+      name TEXT NOT NULL,
+      message TEXT DEFAULT NULL,
+      errorlevel TEXT DEFAULT NULL,
+      time_raised INTEGER,
+      read_flag INTEGER DEFAULT 0
+    )""",
+    """CREATE TABLE IF NOT EXISTS users (
+      username TEXT NOT NULL PRIMARY KEY,
+      password TEXT NOT NULL,
+      permlevel INTEGER DEFAULT 1,
+      memo TEXT DEFAULT NULL
+    )"""
+]
+
+# Changes to the tables above, applied in order once each, and recorded in schema_migrations. A new install runs them
+# all after creating the tables, so the CREATE statements above stay as they were first released. Each is a
+# (name, [statements]) pair; names must never be reused or renamed.
+spec_migrations = [
+    ("001_message_counts", [
+        """CREATE TABLE IF NOT EXISTS `message_counts` (
+          `name` VARCHAR(255) NOT NULL,
+          `errorlevel` CHAR(5) NOT NULL,
+          `total` INT NOT NULL DEFAULT 0,
+          `unread` INT NOT NULL DEFAULT 0,
+          PRIMARY KEY (`name`, `errorlevel`)
+        )""",
+        """INSERT INTO message_counts (name, errorlevel, total, unread)
+          SELECT name, errorlevel, COUNT(*), SUM(read_flag = 0) FROM messages
+          WHERE errorlevel IS NOT NULL GROUP BY name, errorlevel"""
+    ]),
+    ("002_message_occurrences", [
+        """ALTER TABLE `messages`
+          ADD COLUMN IF NOT EXISTS `occurrences` INT NOT NULL DEFAULT 1,
+          ADD COLUMN IF NOT EXISTS `first_seen` TIMESTAMP NULL DEFAULT NULL,
+          ADD COLUMN IF NOT EXISTS `last_seen` TIMESTAMP NULL DEFAULT NULL,
+          ADD INDEX IF NOT EXISTS `content` (`name`, `message`(255))""",
+        # time_raised is named so that a server which auto-updates the first TIMESTAMP column leaves it alone.
+        """UPDATE messages SET first_seen = time_raised, last_seen = time_raised, time_raised = time_raised
+          WHERE first_seen IS NULL"""
+    ]),
+    ("003_idempotency_keys", [
+        """CREATE TABLE IF NOT EXISTS `idempotency_keys` (
+          `username` CHAR(36) NOT NULL,
+          `idem_key` VARCHAR(255) NOT NULL,
+          `response` TEXT DEFAULT NULL,
+          `created` TIMESTAMP NULL DEFAULT NULL,
+          PRIMARY KEY (`username`, `idem_key`),
+          INDEX `created` (`created`)
+        )"""
+    ]),
+    ("004_token_revocations", [
+        """CREATE TABLE IF NOT EXISTS `token_revocations` (
+          `username` CHAR(36) NOT NULL,
+          `revoked_at` BIGINT NOT NULL,
+          PRIMARY KEY (`username`)
+        )"""
+    ]),
+    ("005_compact_messages", [  # 16-byte ids, a one-byte errorlevel and a boolean read flag.
+        # MariaDB commits each ALTER at once, so an id that would not convert must stop the migration before any does.
+        """BEGIN NOT ATOMIC
+          IF EXISTS (SELECT 1 FROM messages WHERE COALESCE(LENGTH(UNHEX(REPLACE(id, '-', ''))), 0) <> 16) THEN
+            SIGNAL SQLSTATE '45000'
+              SET MESSAGE_TEXT = 'Some message ids are not UUIDs; see First Run in SERVICE_SETUP.md';
+          END IF;
+        END""",
+        "ALTER TABLE `messages` ADD COLUMN IF NOT EXISTS `id_bin` BINARY(16) NULL",
+        # time_raised is named so that a server which auto-updates the first TIMESTAMP column leaves it alone.
+        """UPDATE messages SET id_bin = UNHEX(REPLACE(id, '-', '')), read_flag = COALESCE(read_flag, 0),
+          time_raised = time_raised""",
+        """ALTER TABLE `messages`
+          DROP PRIMARY KEY,
+          DROP COLUMN `id`,
+          CHANGE COLUMN `id_bin` `id` BINARY(16) NOT NULL FIRST,
+          ADD PRIMARY KEY (`id`),
+          MODIFY COLUMN `errorlevel` ENUM('info', 'minor', 'major') DEFAULT NULL,
+          MODIFY COLUMN `read_flag` BOOLEAN NOT NULL DEFAULT FALSE"""
+    ]),
+]
+
+spec_migrations_sqlite = [
+    ("001_message_counts", [
+        """CREATE TABLE IF NOT EXISTS message_counts (
+          name TEXT NOT NULL,
+          errorlevel TEXT NOT NULL,
+          total INTEGER NOT NULL DEFAULT 0,
+          unread INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY (name, errorlevel)
+        )""",
+        """INSERT INTO message_counts (name, errorlevel, total, unread)
+          SELECT name, errorlevel, COUNT(*), SUM(read_flag = 0) FROM messages
+          WHERE errorlevel IS NOT NULL GROUP BY name, errorlevel"""
+    ]),
+    ("002_message_occurrences", [
+        "ALTER TABLE messages ADD COLUMN occurrences INTEGER NOT NULL DEFAULT 1",
+        "ALTER TABLE messages ADD COLUMN first_seen INTEGER DEFAULT NULL",
+        "ALTER TABLE messages ADD COLUMN last_seen INTEGER DEFAULT NULL",
+        "CREATE INDEX IF NOT EXISTS messages_content ON messages (name, message)",
+        "UPDATE messages SET first_seen = time_raised, last_seen = time_raised WHERE first_seen IS NULL"
+    ]),
+    ("003_idempotency_keys", [
+        """CREATE TABLE IF NOT EXISTS idempotency_keys (
+          username TEXT NOT NULL,
+          idem_key TEXT NOT NULL,
+          response TEXT DEFAULT NULL,
+          created INTEGER DEFAULT NULL,
+          PRIMARY KEY (username, idem_key)
+        )""",
+        "CREATE INDEX IF NOT EXISTS idempotency_keys_created ON idempotency_keys (created)"
+    ]),
+    ("004_token_revocations", [
+        """CREATE TABLE IF NOT EXISTS token_revocations (
+          username TEXT NOT NULL PRIMARY KEY,
+          revoked_at INTEGER NOT NULL
+        )"""
+    ]),
+]
+
 
 def connect_to_db():
     """Detects if it is necessary to prompt for the root password, and either way,
@@ -69,29 +191,54 @@ def connect_to_db():
 def create_tables(list_tables, connection):
     """Accepts a list of create statements for tables and pushes them to the DB.
     :param list_tables: A list of CREATE statements in string form.
-    :param connection: a pymysql.connect() object, such as returned by connect_to_db
+    :param connection: a pymysql.connect() object, such as returned by connect_to_db, or a sqlite3 connection.
     :return:
     """
     cursor = connection.cursor()
-    connection.begin()
     for table in list_tables:
         try:
             cursor.execute(table)
-        except pymysql.err.ProgrammingError:
+        except (pymysql.err.ProgrammingError, sqlite3.Error):
             print("Error in the following statement; table was skipped.")
             print(table)
         except pymysql.err.OperationalError as error:
-            if str(error.args[0]) == 1050:  # This table already exists
+            if error.args[0] == 1050:  # This table already exists
                 print("%s, skipping" % error.args[1])
             else:
                 print(error)
     connection.commit()
 
 
-def create_administrative_user(connection):
+def apply_migrations(list_migrations, connection, placeholder):
+    """Applies each migration not yet recorded in schema_migrations, in order, committing after each one.
+
+    :param list_migrations: a list of (name, [statements]) pairs, such as spec_migrations.
+    :param connection: a pymysql or sqlite3 connection.
+    :param placeholder: the connection's parameter placeholder; "%s" for pymysql or "?" for sqlite3.
+    :return:
+    """
+    cursor = connection.cursor()
+    cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(64) NOT NULL PRIMARY KEY)")
+    cursor.execute("SELECT name FROM schema_migrations")
+    applied = {row["name"] for row in cursor.fetchall()}
+    for name, statements in list_migrations:
+        if name in applied:
+            continue
+        print("Applying migration %s" % name)
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+        except (pymysql.err.MySQLError, sqlite3.Error) as error:
+            print("Migration %s failed, and was not recorded as applied: %s" % (name, error))
+            exit(1)
+        cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)" % placeholder, (name,))
+        connection.commit()
+
+
+def create_administrative_user(store):
     """Creates an administrative user if it does not already exist.
 
-    :param connection:
+    :param store: a storage object wrapping the new database's connection.
     :return:
     """
 
@@ -102,32 +249,44 @@ def create_administrative_user(connection):
         print("Missing envvar: Piminder_ADMIN_USER")
         exit(1)
 
-    cur = connection.cursor()
-    command = "SELECT count(username) AS howmany FROM users WHERE permlevel like 3;"
     # Wait, how many admins are there?
-    cur.execute(command)
-    count = cur.fetchone()["howmany"]
+    count = store.count_admins()
 
     if count < 1:  # Only do this if no more than 0 exists.
-        command = "INSERT INTO users (username, password, memo, permlevel) VALUES (%s, %s, 'Default User', 3);"
         try:
             root_password = os.environ['PIMINDER_ADMIN_PASSWORD']
         except KeyError:
             print("Missing envvar: Piminder_ADMIN_PASSWORD")
             exit(1)
-        hashed_rootpw = bcrypt.hashpw(root_password.encode('utf8'), bcrypt.gensalt())
-        cur.execute(command, (admin_name, hashed_rootpw))
+        hashed_rootpw = bcrypt.hashpw(root_password.encode('utf8'), bcrypt.gensalt()).decode('utf8')
+        store.insert_user({"username": admin_name, "password": hashed_rootpw, "memo": "Default User",
+                           "permlevel": 3})
         print("Created administrative user: %s" % admin_name)
     else:
         print("Administrative user already exists, skipping.")
-    connection.commit()
+    store.commit()
+
 
+def runtime(config=None):
+    """Creates the tables and the first admin user on whichever backend config["STORAGE"] names.
 
-def runtime():
+    :param config: the service config as a dictionary; MariaDB is assumed if it is absent.
+    :return:
+    """
+    config = config or {}
     print("Now Creating Tables")
-    mariadb = connect_to_db()
-    create_tables(spec_tables, mariadb)
-    create_administrative_user(mariadb)
-    mariadb.commit()
-    mariadb.close()
+    if str(config.get("STORAGE", "mariadb")).lower() == "sqlite":
+        connection = sqlite_connect(config.get("SQLITE_PATH", "piminder.db"))
+        create_tables(spec_tables_sqlite, connection)
+        apply_migrations(spec_migrations_sqlite, connection, "?")
+        store = SQLiteStorage(connection)
+    else:
+        connection = connect_to_db()
+        connection.begin()
+        create_tables(spec_tables, connection)
+        apply_migrations(spec_migrations, connection, "%s")
+        store = MariaDBStorage(connection)
+    create_administrative_user(store)
+    store.commit()
+    store.close()
     print("Done.")
@@ -0,0 +1,141 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource is the optional group-commit ingestion mode (GROUP_COMMIT). Message inserts from concurrent requests
+are handed to a single committer thread, which writes everything that arrives within a short window in one
+transaction. Each request waits until the transaction holding its message has committed before it is answered, so
+a storm of alerts costs one commit per window instead of one per message, and nothing is acknowledged early. Posts
+with an Idempotency-Key are not group-committed, since their message must commit together with the key; see
+idempotency.py. Nor are unique posts, whose lookup has already taken the write lock the insert needs.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class PendingInsert(object):
+    """One request's message, waiting for its group to commit."""
+    def __init__(self, message):
+        self.message = message
+        self.done = threading.Event()
+        self.error = None
+
+
+class GroupCommitter(object):
+    """Collects inserts into groups and commits each group once.
+
+    :param open_store: a callable returning a new storage session on the database.
+    :param window: how long, in seconds, the first insert of a group waits for others to join it.
+    :param size: the most inserts in one group.
+    """
+    def __init__(self, open_store, window=0.005, size=100):
+        self.open_store = open_store
+        self.window = window
+        self.size = size
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="piminder-group-commit", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, message):
+        """Queues message for the next group and blocks until that group has committed. Raises whatever the
+        database raised if the message could not be committed.
+        """
+        insert = PendingInsert(message)
+        self.pending.put(insert)
+        insert.done.wait()
+        if insert.error is not None:
+            raise insert.error
+
+    def next_group(self):
+        group = [self.pending.get()]
+        deadline = time.monotonic() + self.window
+        while len(group) < self.size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                group.append(self.pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return group
+
+    def run(self):
+        while True:
+            group = self.next_group()
+            try:
+                self.commit([insert.message for insert in group])
+            except Exception as e:
+                # One bad message must not fail the rest of its group, so each is retried on its own.
+                logger.warning("Group commit of %d messages failed, committing them singly: %s", len(group), e)
+                for insert in group:
+                    try:
+                        self.commit([insert.message])
+                    except Exception as single_error:
+                        insert.error = single_error
+            for insert in group:
+                insert.done.set()
+
+    def commit(self, messages):
+        store = self.open_store()
+        try:
+            store.insert_messages(messages)
+            store.commit()
+        finally:
+            store.close()
+
+
+class GroupCommitStorage(object):
+    """One request's storage session, with insert_message routed through the group committer. Everything else goes
+    to the database session underneath.
+
+    :param backing: the request's storage session on the database.
+    :param committer: the process's GroupCommitter.
+    """
+    def __init__(self, backing, committer):
+        self.backing = backing
+        self.committer = committer
+
+    def __getattr__(self, name):
+        return getattr(self.backing, name)
+
+    def insert_message(self, message):
+        self.committer.submit(message)
+
+    def transactional(self):
+        """The database session underneath, whose inserts are in the request's own transaction instead of a group's."""
+        return self.backing
+
+
+committer = None
+startup_lock = threading.Lock()
+
+
+def attach(backing, config, open_store):
+    """Wraps a database session so its inserts are group-committed, starting the committer on first use.
+
+    :param backing: the request's storage session on the database.
+    :param config: the flask app config.
+    :param open_store: a callable returning a new storage session on the database, for the committer.
+    :return: a GroupCommitStorage.
+    """
+    global committer
+    with startup_lock:
+        if committer is None:
+            committer = GroupCommitter(open_store, float(config.get("GROUP_COMMIT_WINDOW_MS", 5)) / 1000,
+                                       int(config.get("GROUP_COMMIT_SIZE", 100)))
+            committer.start()
+
+    return GroupCommitStorage(backing, committer)
@@ -0,0 +1,68 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource makes message posts safe to retry. A client that sends an Idempotency-Key header has the response to
+its first post with that key recorded, in the same transaction as the post itself, and any retry with the same key
+is answered with that response instead of posting the message again. With GROUP_COMMIT on, such a post goes around
+the group committer, whose commit would be separate from the key's. Keys belong to the user who sent them and are
+forgotten after IDEMPOTENCY_TTL seconds.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask import current_app
+import json
+import threading
+import time
+
+max_key_length = 255  # The width of idempotency_keys.idem_key.
+purge_interval = 60  # Seconds between sweeps of expired keys, per process.
+
+last_purge = 0
+purge_lock = threading.Lock()
+
+
+def idempotent(func, username, key):
+    """Wraps a handler so that it runs at most once per key. The key is claimed before the handler runs, so a retry
+    arriving while the original is still running waits for it to commit and then gets its response.
+
+    :param func: a handler, which takes the request body and a storage object.
+    :param username: the authenticated user, whose keys are kept apart from everyone else's.
+    :param key: the request's Idempotency-Key header, or None; without one, func is returned as it is.
+    :return: a handler, which takes the request body and a storage object.
+    """
+    if not key:
+        return func
+
+    def run_once(body, store):
+        if len(key) > max_key_length:
+            return {"error": 400, "message": "Idempotency-Key may be at most %d characters." % max_key_length}
+        now = int(time.time())
+        cutoff = now - int(current_app.config.get("IDEMPOTENCY_TTL", 3600))
+        purge(store, now, cutoff)
+        existing = store.claim_idempotency_key(username, key, now, cutoff)
+        if existing is not None:
+            finished, response = existing
+            if finished:
+                return json.loads(response)
+            return {"error": 409, "message": "A request with this Idempotency-Key is still being processed."}
+        response = func(body, store.transactional())
+        store.save_idempotent_response(username, key, json.dumps(response))
+
+        return response
+
+    return run_once
+
+
+def purge(store, now, cutoff):
+    """Deletes expired keys, at most once every purge_interval seconds."""
+    global last_purge
+    with purge_lock:
+        if now - last_purge < purge_interval:
+            return
+        last_purge = now
+    store.purge_idempotency_keys(cutoff)
@@ -0,0 +1,46 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource generates message ids. They are version 7 UUIDs: the first 48 bits are the time in milliseconds and the
+rest is random, so ids generated later sort later, and new rows are appended at the end of the primary key index
+instead of being scattered through it. Older messages keep the random (version 4) UUIDs they were given; both are
+UUID strings to the API and to the storage layer.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import os
+import threading
+import time
+import uuid
+
+lock = threading.Lock()
+last_millis = 0
+last_sequence = 0
+
+
+def new_id():
+    """A new message id, as a version 7 UUID string. Ids made by one process always increase: within one millisecond,
+    the 12 bits after the timestamp count up from a random start, and if they run out the timestamp is advanced."""
+    global last_millis, last_sequence
+    random_bytes = os.urandom(10)
+    with lock:
+        millis = max(time.time_ns() // 1000000, last_millis)
+        if millis == last_millis:
+            last_sequence += 1
+            if last_sequence > 0xFFF:
+                millis += 1
+                last_sequence = random_bytes[0] & 0x7F  # Start low, leaving room to count.
+        else:
+            last_sequence = int.from_bytes(random_bytes[:2], "big") & 0x7FF
+        last_millis = millis
+        sequence = last_sequence
+
+    value = (millis << 80) | (0x7 << 76) | (sequence << 64) | (0b10 << 62) \
+        | (int.from_bytes(random_bytes[2:], "big") & ((1 << 62) - 1))
+
+    return str(uuid.UUID(int=value))
@@ -0,0 +1,129 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource times each API request by phase (limit, connect, auth, permission, handler, serialize), one for each
+stage of the request pipeline in pipeline.py, and counts the SQL it runs through sql.execute. Each response carries
+its own timings in a Server-Timing header, and process-wide totals are exposed in the Prometheus text format at
+/metrics.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from contextlib import contextmanager
+from flask import g, request, Response
+import threading
+import time
+
+list_phases = ["limit", "connect", "auth", "permission", "handler", "serialize"]
+list_buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0]  # Upper bounds in seconds, as Prometheus uses.
+
+
+@contextmanager
+def phase(name):
+    """Adds the time spent inside the with block to the named phase of the current request."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = g.setdefault("piminder_timings", {})
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def record_query(seconds):
+    """Counts one SQL statement against the current request. Called by sql.execute()."""
+    g.piminder_queries = g.get("piminder_queries", 0) + 1
+    g.piminder_query_seconds = g.get("piminder_query_seconds", 0.0) + seconds
+
+
+class Metrics(object):
+    """Process-wide request totals, keyed by (route, method)."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}     # (route, method, status): count
+        self.durations = {}    # (route, method): [count, sum, per-bucket counts]
+        self.phases = {}       # (route, method, phase): seconds
+        self.queries = {}      # (route, method): [count, seconds]
+
+    def observe(self, route, method, status, total, timings, queries, query_seconds):
+        key = (route, method)
+        with self.lock:
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            duration = self.durations.setdefault(key, [0, 0.0, [0] * len(list_buckets)])
+            duration[0] += 1
+            duration[1] += total
+            for index, bound in enumerate(list_buckets):
+                if total <= bound:
+                    duration[2][index] += 1
+            for name, seconds in timings.items():
+                self.phases[key + (name,)] = self.phases.get(key + (name,), 0.0) + seconds
+            query_totals = self.queries.setdefault(key, [0, 0.0])
+            query_totals[0] += queries
+            query_totals[1] += query_seconds
+
+    def render(self):
+        """Returns every metric in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            lines.append("# HELP piminder_requests_total API requests served.")
+            lines.append("# TYPE piminder_requests_total counter")
+            for (route, method, status), count in sorted(self.requests.items()):
+                lines.append('piminder_requests_total{route="%s",method="%s",status="%s"} %d'
+                             % (route, method, status, count))
+            lines.append("# HELP piminder_request_duration_seconds Time to serve API requests.")
+            lines.append("# TYPE piminder_request_duration_seconds histogram")
+            for (route, method), (count, total, buckets) in sorted(self.durations.items()):
+                labels = 'route="%s",method="%s"' % (route, method)
+                for bound, bucket_count in zip(list_buckets, buckets):
+                    lines.append('piminder_request_duration_seconds_bucket{%s,le="%s"} %d' % (labels, bound, bucket_count))
+                lines.append('piminder_request_duration_seconds_bucket{%s,le="+Inf"} %d' % (labels, count))
+                lines.append('piminder_request_duration_seconds_sum{%s} %f' % (labels, total))
+                lines.append('piminder_request_duration_seconds_count{%s} %d' % (labels, count))
+            lines.append("# HELP piminder_phase_seconds_total Time spent in each phase of API requests.")
+            lines.append("# TYPE piminder_phase_seconds_total counter")
+            for (route, method, name), seconds in sorted(self.phases.items()):
+                lines.append('piminder_phase_seconds_total{route="%s",method="%s",phase="%s"} %f'
+                             % (route, method, name, seconds))
+            lines.append("# HELP piminder_db_queries_total SQL statements executed by API requests.")
+            lines.append("# TYPE piminder_db_queries_total counter")
+            for (route, method), (count, seconds) in sorted(self.queries.items()):
+                lines.append('piminder_db_queries_total{route="%s",method="%s"} %d' % (route, method, count))
+            lines.append("# HELP piminder_db_query_seconds_total Time spent executing SQL for API requests.")
+            lines.append("# TYPE piminder_db_query_seconds_total counter")
+            for (route, method), (count, seconds) in sorted(self.queries.items()):
+                lines.append('piminder_db_query_seconds_total{route="%s",method="%s"} %f' % (route, method, seconds))
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def begin_request():
+    """before_request hook; starts the clock for the whole request."""
+    g.piminder_start = time.perf_counter()
+
+
+def end_request(response):
+    """after_request hook; records the request's totals and attaches its Server-Timing header."""
+    total = time.perf_counter() - g.get("piminder_start", time.perf_counter())
+    timings = g.get("piminder_timings", {})
+    queries = g.get("piminder_queries", 0)
+    query_seconds = g.get("piminder_query_seconds", 0.0)
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe(route, request.method, response.status_code, total, timings, queries, query_seconds)
+
+    list_timing = ["%s;dur=%.3f" % (name, timings[name] * 1000) for name in list_phases if name in timings]
+    list_timing.append('db;desc="%d queries";dur=%.3f' % (queries, query_seconds * 1000))
+    list_timing.append("total;dur=%.3f" % (total * 1000))
+    response.headers["Server-Timing"] = ", ".join(list_timing)
+
+    return response
+
+
+def metrics_view():
+    """Serves the process-wide metrics for a Prometheus scraper."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
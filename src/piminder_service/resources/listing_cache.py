@@ -0,0 +1,145 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource is a read-through cache of message listings, so that a monitor polling an unchanged listing does not
+cost a query each time. Listings are cached per query string under a generation number, and every committed change
+to the messages table bumps the generation, which retires every cached listing at once. The cache is either local to
+the process or, so that several workers stay coherent, kept in Redis. Chosen with the LISTING_CACHE config value.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from collections import OrderedDict
+from flask import current_app
+import json
+import threading
+import time
+
+
+class LocalListingCache(object):
+    """Listings cached in this process only. Expired listings are dropped as they are found, and past max_entries
+    the least recently used is dropped to make room."""
+    def __init__(self, ttl, max_entries=64):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.entries = OrderedDict()  # key: (expiry, listing), all for the current generation; most recently used last.
+
+    def get(self, key):
+        """:return: a tuple of the current generation and the cached listing, or None in its place on a miss."""
+        with self.lock:
+            expiry, listing = self.entries.get(key, (0, None))
+            if expiry <= time.monotonic():
+                self.entries.pop(key, None)
+                return self.generation, None
+            self.entries.move_to_end(key)
+            return self.generation, listing
+
+    def put(self, generation, key, listing):
+        now = time.monotonic()
+        with self.lock:
+            if generation != self.generation:  # The listing was read before a change; don't keep it.
+                return
+            for stale in [stale for stale, (expiry, cached) in self.entries.items() if expiry <= now]:
+                del self.entries[stale]
+            self.entries[key] = (now + self.ttl, listing)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.generation += 1
+            self.entries = OrderedDict()
+
+
+class RedisListingCache(object):
+    """Listings cached in Redis, shared by every worker pointed at it. Each listing is stored under its generation,
+    so one that was read before a change is stored under a key that is never read again, and simply expires.
+    """
+    generation_key = "piminder:listing:generation"
+
+    def __init__(self, url, ttl):
+        import redis  # Only needed by those who use this backend.
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def entry_key(self, generation, key):
+        return "piminder:listing:%d:%s" % (generation, key)
+
+    def get(self, key):
+        generation = int(self.client.get(self.generation_key) or 0)
+        raw = self.client.get(self.entry_key(generation, key))
+        return generation, json.loads(raw) if raw else None
+
+    def put(self, generation, key, listing):
+        self.client.set(self.entry_key(generation, key), json.dumps(listing), ex=max(1, int(self.ttl)))
+
+    def invalidate(self):
+        self.client.incr(self.generation_key)
+
+
+cache = None
+cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Builds the cache the app config asks for on first use.
+
+    :return: a LocalListingCache or RedisListingCache, or None if LISTING_CACHE is off.
+    """
+    global cache
+    with cache_lock:
+        if cache is None:
+            backend = str(current_app.config.get("LISTING_CACHE", "off")).lower()
+            ttl = float(current_app.config.get("LISTING_CACHE_TTL", 30))
+            if backend == "local":
+                cache = LocalListingCache(ttl, int(current_app.config.get("LISTING_CACHE_SIZE", 64)))
+            elif backend == "redis":
+                cache = RedisListingCache(current_app.config.get("LISTING_CACHE_URL", "redis://localhost:6379/0"), ttl)
+            else:
+                cache = False
+
+    return cache or None
+
+
+def read_through(key, build):
+    """Returns the cached listing for key, or builds, caches and returns it. A cache that cannot be reached is
+    treated as a miss, never as a failed request.
+
+    :param key: a string identifying the listing, made only from the arguments it depends on.
+    :param build: a callable returning the listing, as a JSON-serializable dictionary.
+    :return: the listing.
+    """
+    listing_cache = get_cache()
+    if listing_cache is None:
+        return build()
+    try:
+        generation, listing = listing_cache.get(key)
+    except Exception as e:
+        current_app.logger.warning("Listing cache unavailable: %s", e)
+        return build()
+    if listing is None:
+        listing = build()
+        try:
+            listing_cache.put(generation, key, listing)
+        except Exception as e:
+            current_app.logger.warning("Listing cache unavailable: %s", e)
+
+    return listing
+
+
+def invalidate():
+    """Retires every cached listing. Handlers register this to run once their change to messages has committed."""
+    listing_cache = get_cache()
+    if listing_cache is None:
+        return
+    try:
+        listing_cache.invalidate()
+    except Exception as e:  # Listings cached elsewhere will be stale until LISTING_CACHE_TTL runs out.
+        current_app.logger.warning("Listing cache could not be invalidated: %s", e)
@@ -0,0 +1,350 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource is the optional in-memory message store (STORAGE_MODE = memory). The live message set is held in this
+process, indexed by id, by time raised and by name and text, and every message request is served from it. A request's
+changes are held until its transaction commits, and only then applied to the store and journaled, so a request that
+fails or rolls back changes nothing. Journaled changes are written behind to the configured database in batches by a
+background thread, and the store is rebuilt from the database when the service starts. Users are still read from and
+written to the database directly. The store lives in one process, so the service must run as a single process in this
+mode.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import atexit
+import bisect
+from functools import partial
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+claim_timeout = 10.0  # Seconds a request waits for another to commit a change to the same messages before giving up.
+
+
+class MessageIndex(object):
+    """The live message set. Each message is the dictionary SQLStorage.list_messages() returns for it."""
+    def __init__(self, messages):
+        self.lock = threading.Condition()  # Notified whenever claims are released.
+        self.claims = {}      # Message id, or (name, message): the MemoryStorage with an uncommitted change to it.
+        self.by_id = {}
+        self.by_time = []     # (time_raised, id), ascending; read backwards for the newest-first listing.
+        self.by_content = {}  # (name, message): [ids], which is what unique posts look up.
+        self.counts = {}      # (name, errorlevel): [total, unread], as the message_counts table keeps them.
+        for message in messages:
+            self.add(message)
+
+    def add(self, message):
+        self.by_id[message["id"]] = message
+        bisect.insort(self.by_time, (message["time_raised"], message["id"]))
+        self.by_content.setdefault((message["name"], message["message"]), []).append(message["id"])
+        counts = self.counts.setdefault((message["name"], message["errorlevel"]), [0, 0])
+        counts[0] += 1
+        counts[1] += not message["read"]
+
+    def remove(self, message_id):
+        message = self.by_id.pop(message_id)
+        self.unindex_time(message)
+        same_content = self.by_content[(message["name"], message["message"])]
+        same_content.remove(message_id)
+        if not same_content:
+            del self.by_content[(message["name"], message["message"])]
+        counts = self.counts[(message["name"], message["errorlevel"])]
+        counts[0] -= 1
+        counts[1] -= not message["read"]
+
+    def set_read(self, message, read):
+        if message["read"] != read:
+            self.counts[(message["name"], message["errorlevel"])][1] += -1 if read else 1
+            message["read"] = read
+
+    def mark_read(self, ids):
+        for message_id in ids:
+            if message_id in self.by_id:
+                self.set_read(self.by_id[message_id], True)
+
+    def delete(self, ids):
+        for message_id in ids:
+            if message_id in self.by_id:
+                self.remove(message_id)
+
+    def record_occurrence(self, ids, timestamp, update_time):
+        for message_id in ids:
+            stored = self.by_id.get(message_id)
+            if stored is None:
+                continue
+            self.set_read(stored, False)
+            stored["occurrences"] += 1
+            stored["last_seen"] = timestamp
+            if update_time:
+                self.unindex_time(stored)
+                stored["time_raised"] = timestamp
+                bisect.insort(self.by_time, (timestamp, message_id))
+
+    def unindex_time(self, message):
+        position = bisect.bisect_left(self.by_time, (message["time_raised"], message["id"]))
+        del self.by_time[position]
+
+
+class WriteBehind(object):
+    """Replays journaled changes against the database from a background thread. Each batch is replayed through a
+    fresh storage session and committed once; a batch that fails is retried whole until it succeeds.
+
+    :param open_store: a callable returning a new storage session on the database.
+    :param interval: the longest a change waits in the journal, in seconds.
+    :param batch_size: the most changes committed together.
+    """
+    def __init__(self, open_store, interval=1.0, batch_size=500):
+        self.open_store = open_store
+        self.interval = interval
+        self.batch_size = batch_size
+        self.journal = queue.Queue()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="piminder-write-behind", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def append(self, method, *args):
+        """Journals one call to a storage method, to be replayed against the database in order."""
+        self.journal.put((method, args))
+
+    def stop(self):
+        """Flushes whatever is still journaled and stops the thread."""
+        self.stopping.set()
+        self.thread.join()
+
+    def next_batch(self):
+        batch = []
+        try:
+            batch.append(self.journal.get(timeout=self.interval))
+            while len(batch) < self.batch_size:
+                batch.append(self.journal.get_nowait())
+        except queue.Empty:
+            pass
+
+        return batch
+
+    def run(self):
+        batch = []
+        while True:
+            batch = batch or self.next_batch()
+            if not batch:
+                if self.stopping.is_set():
+                    return
+                continue
+            try:
+                store = self.open_store()
+                try:
+                    for method, args in batch:
+                        getattr(store, method)(*args)
+                    store.commit()
+                finally:
+                    store.close()
+                batch = []
+            except Exception as e:  # The database may be down for a while; keep the batch and try it again.
+                if self.stopping.is_set():
+                    logger.error("Shutting down with %d changes not written to the database: %s",
+                                 len(batch) + self.journal.qsize(), e)
+                    return
+                logger.warning("Write-behind of %d changes failed, retrying: %s", len(batch), e)
+                self.stopping.wait(self.interval)
+
+
+class MemoryStorage(object):
+    """One request's session with the in-memory store. Message methods match SQLStorage's and are served from the
+    index; anything else, including users and commit(), goes to the database session underneath.
+
+    Changes work as they would in a transaction. Each is held as pending, and is applied to the index and journaled
+    only once the database session commits, or dropped if it rolls back. Until then, the session holds a claim on each
+    message it changes, and on the name and text of any message it posts, and other sessions wait for those claims
+    before deciding what to change themselves. This is what keeps, say, two concurrent requests from both marking the
+    same message read.
+
+    :param backing: the request's storage session on the database.
+    :param index: the process's MessageIndex.
+    :param writer: the process's WriteBehind.
+    """
+    def __init__(self, backing, index, writer):
+        self.backing = backing
+        self.index = index
+        self.writer = writer
+        self.pending = []   # (index change, journaled method, its arguments), in the order they were made.
+        self.claims = set()
+
+    def __getattr__(self, name):
+        return getattr(self.backing, name)
+
+    def transactional(self):
+        return self
+
+    def rollback(self):
+        with self.index.lock:
+            self.pending = []
+            self.release()
+        self.backing.rollback()
+
+    def close(self):
+        with self.index.lock:
+            self.pending = []
+            self.release()
+        self.backing.close()
+
+    def claim(self, keys):
+        """Claims message ids or (name, message) pairs until this session commits or rolls back. The keys are taken all
+        at once, only when no other session holds any of them, so a session never holds some while it waits for the
+        rest. A session that already holds claims from an earlier call does not wait at all, since another session may
+        be waiting on those; it gives up at once instead. The caller holds the index lock.
+
+        :param keys: a list of keys, or a callable returning one, which is called again after each wait so that the
+        keys can depend on the index as other sessions change it.
+        :raises TimeoutError: if the keys could not be claimed; the pipeline answers 409.
+        """
+        find_keys = keys if callable(keys) else lambda: keys
+        deadline = time.monotonic() + claim_timeout
+        keys = set(find_keys())
+        while any(self.index.claims.get(key, self) is not self for key in keys):
+            remaining = deadline - time.monotonic()
+            if self.claims or remaining <= 0:
+                raise TimeoutError("Messages are held by another request's uncommitted changes.")
+            self.index.lock.wait(remaining)
+            keys = set(find_keys())
+        for key in keys:
+            self.index.claims[key] = self
+        self.claims.update(keys)
+        self.backing.after_commit(self.apply)
+
+    def release(self):
+        """Releases this session's claims. The caller holds the index lock."""
+        for key in self.claims:
+            if self.index.claims.get(key) is self:
+                del self.index.claims[key]
+        self.claims = set()
+        self.index.lock.notify_all()
+
+    def defer(self, change, method, *args):
+        """Holds change, a callable on the index, and the journal entry for it until the database session commits."""
+        self.pending.append((change, method, args))
+
+    def apply(self):
+        """Run when the database session commits: applies and journals the pending changes, and releases claims."""
+        with self.index.lock:
+            pending, self.pending = self.pending, []
+            for change, method, args in pending:
+                change()
+                self.writer.append(method, *args)
+            self.release()
+
+    def list_messages(self):
+        with self.index.lock:
+            return [dict(self.index.by_id[message_id]) for time_raised, message_id in reversed(self.index.by_time)]
+
+    def insert_message(self, message):
+        timestamp = int(message["timestamp"])
+        stored = {"id": message["id"], "name": message["name"], "message": message["message"],
+                  "errorlevel": message["errorlevel"], "time_raised": timestamp, "read": bool(message["read"]),
+                  "occurrences": 1, "first_seen": timestamp, "last_seen": timestamp}
+        with self.index.lock:
+            self.claim([(message["name"], message["message"])])
+            self.defer(partial(self.index.add, stored), "insert_message", dict(message))
+
+    def record_occurrence(self, name, message, timestamp, update_time=False):
+        timestamp = int(timestamp)
+        with self.index.lock:
+            # So no other session can post another message like it, or delete one of these.
+            self.claim(lambda: [(name, message)] + self.index.by_content.get((name, message), []))
+            same_content = list(self.index.by_content.get((name, message), []))
+            if same_content:
+                self.defer(partial(self.index.record_occurrence, same_content, timestamp, update_time),
+                           "record_occurrence", name, message, timestamp, update_time)
+            return len(same_content)
+
+    def get_message(self, message_id):
+        with self.index.lock:
+            message = self.index.by_id.get(message_id)
+            return {"id": message_id, "read": message["read"]} if message else None
+
+    def mark_read(self, message_id):
+        with self.index.lock:
+            self.claim([message_id])
+            message = self.index.by_id.get(message_id)
+            if message is None or message["read"]:
+                return False
+            self.defer(partial(self.index.mark_read, [message_id]), "mark_read", message_id)
+            return True
+
+    def delete_message(self, message_id):
+        with self.index.lock:
+            self.claim([message_id])
+            if message_id not in self.index.by_id:
+                return False
+            self.defer(partial(self.index.delete, [message_id]), "delete_message", message_id)
+            return True
+
+    def find_messages(self, ids=None, criteria=None):
+        with self.index.lock:
+            if ids is not None:
+                found = [self.index.by_id[message_id] for message_id in ids if message_id in self.index.by_id]
+            else:
+                if not criteria:
+                    raise ValueError("At least one criterion is needed.")
+                found = [message for message in self.index.by_id.values() if matches(message, criteria)]
+            return [{"id": message["id"], "read": message["read"]} for message in found]
+
+    def mark_read_many(self, ids):
+        with self.index.lock:
+            self.claim(list(ids))
+            ids = [message_id for message_id in ids if message_id in self.index.by_id]
+            self.defer(partial(self.index.mark_read, ids), "mark_read_many", ids)
+
+    def delete_messages(self, ids):
+        with self.index.lock:
+            self.claim(list(ids))
+            ids = [message_id for message_id in ids if message_id in self.index.by_id]
+            self.defer(partial(self.index.delete, ids), "delete_messages", ids)
+
+    def message_counts(self):
+        with self.index.lock:
+            return [{"name": name, "errorlevel": errorlevel, "total": total, "unread": unread}
+                    for (name, errorlevel), (total, unread) in self.index.counts.items() if total > 0]
+
+
+def matches(message, criteria):
+    """Whether a message meets criteria, as SQLStorage.find_messages takes them."""
+    for key in ["name", "errorlevel", "read"]:
+        if key in criteria and message[key] != criteria[key]:
+            return False
+
+    return "before" not in criteria or message["time_raised"] < criteria["before"]
+
+
+index = None
+writer = None
+startup_lock = threading.Lock()
+
+
+def attach(backing, config, open_store):
+    """Wraps a database session in the in-memory store, loading the store from the database and starting the
+    write-behind thread on first use.
+
+    :param backing: the request's storage session on the database.
+    :param config: the flask app config.
+    :param open_store: a callable returning a new storage session on the database, for the writer.
+    :return: a MemoryStorage.
+    """
+    global index, writer
+    with startup_lock:
+        if index is None:
+            index = MessageIndex(backing.list_messages())
+            writer = WriteBehind(open_store, float(config.get("WRITE_BEHIND_INTERVAL", 1.0)),
+                                 int(config.get("WRITE_BEHIND_BATCH", 500)))
+            writer.start()
+
+    return MemoryStorage(backing, index, writer)
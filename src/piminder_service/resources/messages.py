@@ -10,15 +10,29 @@ Full license and documentation to be found at:
 https://github.com/ZAdamMac/Enumpi-C2
 """
 
-import datetime
+from collections import Counter
 from flask_restful import Resource
-from flask import current_app, request, make_response
-import pymysql
-import uuid
-from .utilities import authenticated_exec, basic_auth, json_validate
+from piminder_helpers.timestamps import format_timestamp, to_epoch
+import time
+from . import listing_cache, pipeline
+from .ids import new_id
+from .schema import OneOf, Optional, Schema
 
 __version__ = "1.1.0"
 
+list_errorlevels = ["info", "minor", "major"]
+schema_message = Schema({"name": "", "timestamp": ("", 0, 0.0),  # An ISO 8601 string, or epoch seconds
+                         "errorlevel": OneOf(*list_errorlevels, message="Error level not one of info, minor, or major."),
+                         "message": ""})
+schema_message_id = Schema({"messageId": ""})
+schema_bulk_ids = Schema({"messageIds": []})
+schema_bulk_filter = Schema({"filter": {"name": Optional(""),
+                                        "errorlevel": Optional(OneOf(*list_errorlevels,
+                                                                     message="Error level not one of info, minor, "
+                                                                             "or major.")),
+                                        "olderThan": Optional((0, 0.0)),  # Age in seconds
+                                        "read": Optional(False)}})
+
 
 class MessageAPI(Resource):
     def get(self):
@@ -27,54 +41,14 @@ class MessageAPI(Resource):
 
         :return: In the valid case, a json dictionary of (row, action) pairs
         """
-        cookie = request.headers.get("Authorization")
-        try:
-            connection = pymysql.connect(host=current_app.config["DBHOST"],
-                                         user=current_app.config["USERNAME"],
-                                         password=current_app.config["PASSPHRASE"],
-                                         db='Piminder',
-                                         cursorclass=pymysql.cursors.DictCursor)
-            connection.ping(reconnect=True)
-        except KeyError:
-            return {'message': 'Internal Server Error'}, 500
-        except pymysql.Error:
-            return {'message': 'Internal Server Error'}, 500
-        proceed, user = basic_auth(cookie, connection)
-        if proceed:  # A chicken ain't nothing but a bird.
-            dict_return = authenticated_exec(user, 2, connection, messages_get, "")
-            resp = make_response(dict_return)
-            resp.status_code = dict_return["error"]
-            resp.content_type = "application/json"
-            return resp
-        else:
-            return {'message': 'unauthorized'}, 401
+        return pipeline.run(messages_get, 2, body=pipeline.query_args)
 
     def post(self):
         """The post method allows the listing of a new message in the database.
 
         :return:
         """
-        cookie = request.headers.get("Authorization")
-        try:
-            connection = pymysql.connect(host=current_app.config["DBHOST"],
-                                         user=current_app.config["USERNAME"],
-                                         password=current_app.config["PASSPHRASE"],
-                                         db='Piminder',
-                                         cursorclass=pymysql.cursors.DictCursor)
-            connection.ping(reconnect=True)
-        except KeyError:
-            return {'message': 'Internal Server Error, Key error'}, 500
-        except pymysql.Error as e:
-            return {'message': 'Internal Server Error, sql error'}, 501
-        proceed, user = basic_auth(cookie, connection)
-        if proceed:  # A chicken ain't nothing but a bird.
-            dict_return = authenticated_exec(user, 1, connection, messages_post, request.get_json())
-            resp = make_response(dict_return)
-            resp.status_code = dict_return["error"]
-            resp.content_type = "application/json"
-            return resp
-        else:
-            return {'message': 'unauthorized'}, 401
+        return pipeline.run(messages_post, 1, stages=pipeline.posting_stages)
 
     def patch(self):
         """This will mark a specified message as read. The message is not wholly discarded immediately, but will be
@@ -82,212 +56,175 @@ class MessageAPI(Resource):
 
         :return:
         """
-
-        cookie = request.headers.get("Authorization")
-        try:
-            connection = pymysql.connect(host=current_app.config["DBHOST"],
-                                         user=current_app.config["USERNAME"],
-                                         password=current_app.config["PASSPHRASE"],
-                                         db='Piminder',
-
-                                         cursorclass=pymysql.cursors.DictCursor)
-            connection.ping(reconnect=True)
-        except KeyError:
-            return {'message': 'Internal Server Error'}, 500
-        except pymysql.Error:
-            return {'message': 'Internal Server Error'}, 500
-        proceed, user = basic_auth(cookie, connection)
-        if proceed:  # A chicken ain't nothing but a bird.
-            dict_return = authenticated_exec(user, 2, connection, messages_patch, request.get_json())
-            resp = make_response(dict_return)
-            resp.status_code = dict_return["error"]
-            resp.content_type = "application/json"
-            return resp
-        else:
-            return {'message': 'unauthorized'}, 401
+        return pipeline.run(messages_patch, 2)
 
     def delete(self):
         """This removes a selected message from the DB entirely.
 
         :return:
         """
-
-        cookie = request.headers.get("Authorization")
-        try:
-            connection = pymysql.connect(host=current_app.config["DBHOST"],
-                                         user=current_app.config["USERNAME"],
-                                         password=current_app.config["PASSPHRASE"],
-                                         db='Piminder',
-
-                                         cursorclass=pymysql.cursors.DictCursor)
-            connection.ping(reconnect=True)
-        except KeyError:
-            return {'message': 'Internal Server Error'}, 500
-        except pymysql.Error:
-            return {'message': 'Internal Server Error'}, 500
-        proceed, user = basic_auth(cookie, connection)
-        if proceed:  # A chicken ain't nothing but a bird.
-            dict_return = authenticated_exec(user, 2, connection, messages_delete, request.get_json())
-            resp = make_response(dict_return)
-            resp.status_code = dict_return["error"]
-            resp.content_type = "application/json"
-            return resp
-        else:
-            return {'message': 'unauthorized'}, 401
+        return pipeline.run(messages_delete, 2)
 
 # Here follow the actual actions!
 
 
-def messages_get(body, connection):
+def messages_get(body, store):
     """A stored join function that gets all the currently registered commands,
     their relevant metadata, the name of the client they are associated with
     and the message, if any. This is returned to the requestor in a JSON
-    format for further processing."""
-    cur = connection.cursor()
-    del body
-    # Unwieldy command handles most of the data processing in SQL which is faster than doing this in python.
-
-    cmd = "SELECT * FROM messages ORDER BY time_raised desc;"
-    cur.execute(cmd)
-    messages = cur.fetchall()
+    format for further processing. The listing is read through listing_cache, keyed by the time format, which is
+    the only argument it depends on.
+
+    Timestamps are ISO 8601 unless the query string has timeFormat=epoch, which returns epoch seconds instead.
+    With changedSince, an ISO 8601 timestamp or epoch seconds, only messages raised or seen again since then are
+    listed; such a listing is built fresh rather than cached."""
+    epoch = body.get("timeFormat") == "epoch"
+    if "changedSince" in body:
+        since = body["changedSince"]
+        try:
+            since = to_epoch(int(since) if since.isdigit() else since)
+        except ValueError:
+            return {"all_errors": {"changedSince": "Timestamp is not ISO 8601, such as 2021-06-01T04:00:00Z, or "
+                                                  "epoch seconds, between 1970 and 2038."}, "error": 400}
+        return build_listing(store, epoch, since)
+
+    key = "timeFormat=%s" % ("epoch" if epoch else "iso")
+
+    return listing_cache.read_through(key, lambda: build_listing(store, epoch))
+
+
+def build_listing(store, epoch=False, since=None):
+    messages = store.list_messages()
+    if since is not None:
+        messages = [message for message in messages
+                    if max(message["time_raised"], message["last_seen"] or message["time_raised"]) >= since]
     response = {}
     counter = -1
     for message in messages:
-        output_keys = {"id": "messageId", "name": "name", "read_flag": "read", "errorlevel": "errorLevel",
-                       "time_raised": "timestamp", "message": "message"}
+        output_keys = {"id": "messageId", "name": "name", "read": "read", "errorlevel": "errorLevel",
+                       "time_raised": "timestamp", "message": "message", "occurrences": "occurrences",
+                       "first_seen": "firstSeen", "last_seen": "lastSeen"}
         counter += 1
         this_message = {}
         for key in output_keys.keys():
             this_message.update({output_keys[key]: message[key]})
-        if this_message["read"] == b'\x00':
-            this_message.update({"read": False})
-        else:
-            this_message.update({"read": True})
-        time_out = this_message["timestamp"].strftime("%Y-%m-%dT%H:%M:%SZ")  # It is nice to have ISO 8601 compliance
-        this_message.update({"timestamp": time_out})
+        if not epoch:  # It is nice to have ISO 8601 compliance
+            for key in ["timestamp", "firstSeen", "lastSeen"]:
+                if this_message[key] is not None:
+                    this_message.update({key: format_timestamp(this_message[key])})
         response.update({str(counter): this_message})
     response.update({"error": 200})
 
     return response
 
 
-def messages_post(body, connection):
+def messages_post(body, store):
     """A very simplistic function that adds a fresh command to the commands table."""
-    cur = connection.cursor()
-    dict_schema = {"name": "", "timestamp": "", "errorlevel": "", "message": ""}
-    json_valid, errors = json_validate(body, dict_schema)
-    if body["errorlevel"] not in ["info", "minor", "major"]:
-        json_valid = False
-        errors.update({"errorlevel": "Error level not one of info, minor, or major."})
+    json_valid, errors = schema_message.validate(body)
+    if json_valid:
+        try:
+            timestamp = to_epoch(body["timestamp"])
+        except ValueError:
+            json_valid = False
+            errors.update({"timestamp": "Timestamp is not ISO 8601, such as 2021-06-01T04:00:00Z, or epoch "
+                                        "seconds, between 1970 and 2038."})
 
     if json_valid:
         d_message = {}
         d_message.update(body)
-        d_message.update({"id": str(uuid.uuid4())})
+        d_message.update({"id": new_id()})
         d_message.update({"read": False})
-        d_message.update({"timestamp": datetime.datetime.strptime(body["timestamp"], "%Y-%m-%dT%H:%M:%SZ").timestamp()})
-        cmd = "INSERT INTO messages " \
-              "(id, name, time_raised, errorlevel, message, read_flag) " \
-              "VALUES (%(id)s, %(name)s, FROM_UNIXTIME(%(timestamp)s), %(errorlevel)s, " \
-              "%(message)s, %(read)s)"
-        cur.execute(cmd, d_message)
-        response = {"error": 200}
-        connection.commit()
+        d_message.update({"timestamp": timestamp})
+        store.insert_message(d_message)
+        store.after_commit(listing_cache.invalidate)
+        response = {"error": 200, "messageId": d_message["id"]}
     else:
         response = {"all_errors": errors, "error": 400}
 
     return response
 
 
-def messages_patch(body, connection):
+def messages_patch(body, store):
     """This function indicates in the DB that a message has been read.
     A stored procedure or cron job will garbage collect."""
-    cur = connection.cursor()
-    dict_schema = {"messageId": ""}
-    json_valid, errors = json_validate(body, dict_schema)
+    if is_bulk(body):
+        return messages_bulk(body, store, "read")
+    json_valid, errors = schema_message_id.validate(body)
 
     if json_valid:
-        # First, make sure this hasn't already been executed.
-        cmd = "SELECT id, read_flag " \
-              "FROM messages " \
-              "WHERE id=%s"
-        cur.execute(cmd, body["messageId"])
-        response = cur.fetchone()
-        #print(response)
-        # Gotta be a better way to do the following line, but...
-        try:
-            if response["read_flag"] == b'\x00':
-                cmd = "UPDATE messages " \
-                      "SET read_flag=TRUE " \
-                      "WHERE id=%s"
-                cur.execute(cmd, body["messageId"])
-                response = {"error": 200}
-                connection.commit()
-            else:
-                response = {"error": 400, "message": "Could not delete command - already acknowledged."}
-        except KeyError:
+        # The update only matches an unread message, so of many concurrent requests exactly one succeeds.
+        if store.mark_read(body["messageId"]):
+            store.after_commit(listing_cache.invalidate)
+            response = {"error": 200}
+        elif store.get_message(body["messageId"]) is None:  # Only now is it worth asking why.
             response = {"error": 400, "message": "The indicated ID does not exist in the messages table."}
+        else:
+            response = {"error": 400, "message": "Could not mark message as read; already read."}
     else:
         response = {"all_errors": errors, "error": 400}
 
     return response
 
 
-def messages_patch(body, connection):
-    """This function indicates in the DB that a message has been read.
-    A stored procedure or cron job will garbage collect."""
-    cur = connection.cursor()
-    dict_schema = {"messageId": ""}
-    json_valid, errors = json_validate(body, dict_schema)
+def messages_delete(body, store):
+    """This function removes the selected entity from database prior to garbage collection."""
+    if is_bulk(body):
+        return messages_bulk(body, store, "delete")
+    json_valid, errors = schema_message_id.validate(body)
 
     if json_valid:
-        # First, make sure this hasn't already been executed.
-        cmd = "SELECT id, read_flag FROM messages WHERE id=%s"
-        cur.execute(cmd, body["messageId"])
-        response = cur.fetchone()
-        # Gotta be a better way to do the following line, but...
-        try:
-            if response["read_flag"] == b'\x00':
-                cmd = "UPDATE messages " \
-                      "SET read_flag=TRUE " \
-                      "WHERE id=%s"
-                cur.execute(cmd, body["messageId"])
-                response = {"error": 200}
-                connection.commit()
-            else:
-                response = {"error": 400, "message": "Could not mark message as read; already read."}
-        except KeyError:
-            response = {"error": 400, "message": "The indicated ID does not exist in the messages table."}
+        if store.delete_message(body["messageId"]):
+            store.after_commit(listing_cache.invalidate)
+            response = {"error": 200}
+        else:
+            response = {"error": 400, "message": "Could not delete message, already deleted?"}
     else:
         response = {"all_errors": errors, "error": 400}
 
     return response
 
 
-def messages_delete(body, connection):
-    """This function removes the selected entity from database prior to garbage collection."""
-    cur = connection.cursor()
-    dict_schema = {"messageId": ""}
-    json_valid, errors = json_validate(body, dict_schema)
+def is_bulk(body):
+    return isinstance(body, dict) and ("messageIds" in body or "filter" in body)
 
-    if json_valid:
-        # First, make sure this hasn't already been executed.
-        cmd = "SELECT id FROM messages WHERE id=%s"
-        cur.execute(cmd, body["messageId"])
-        response = cur.fetchone()
-        # Gotta be a better way to do the following line, but...
-        try:
-            if response:
-                cmd = "DELETE FROM messages WHERE id=%s"
-                cur.execute(cmd, body["messageId"])
-                response = {"error": 200}
-                connection.commit()
-            else:
-                response = {"error": 400, "message": "Could not delete message, already deleted?"}
-        except KeyError:
-            response = {"error": 400, "message": "The indicated ID does not exist in the messages table."}
-    else:
-        response = {"all_errors": errors, "error": 400}
 
-    return response
+def messages_bulk(body, store, action):
+    """Marks read ("read") or deletes ("delete") every message named in messageIds, or every message matching filter,
+    with set-based statements in the request's one transaction. Reports what became of each message."""
+    if "messageIds" in body:
+        json_valid, errors = schema_bulk_ids.validate(body)
+        if json_valid and not all(isinstance(message_id, str) for message_id in body["messageIds"]):
+            json_valid = False
+            errors.update({"messageIds": "Every message id must be a string."})
+    else:
+        json_valid, errors = schema_bulk_filter.validate(body)
+        if json_valid and not body["filter"]:
+            json_valid = False
+            errors.update({"filter": "Give at least one of name, errorlevel, olderThan or read."})
+    if not json_valid:
+        return {"all_errors": errors, "error": 400}
+
+    if "messageIds" in body:
+        ids = list(dict.fromkeys(body["messageIds"]))  # Drops repeats, keeping the order given.
+        results = {message_id: "not found" for message_id in ids}
+        found = store.find_messages(ids=ids)
+    else:
+        criteria = {key: body["filter"][key] for key in ["name", "errorlevel", "read"] if key in body["filter"]}
+        if "olderThan" in body["filter"]:
+            criteria["before"] = int(time.time() - body["filter"]["olderThan"])
+        results = {}
+        found = store.find_messages(criteria=criteria)
+
+    if action == "read":
+        targets = [message["id"] for message in found if not message["read"]]
+        results.update({message["id"]: "already read" for message in found if message["read"]})
+        results.update({message_id: "read" for message_id in targets})
+        store.mark_read_many(targets)
+    else:
+        targets = [message["id"] for message in found]
+        results.update({message_id: "deleted" for message_id in targets})
+        store.delete_messages(targets)
+    if targets:
+        store.after_commit(listing_cache.invalidate)
 
+    return {"error": 200, "results": results, "counts": dict(Counter(results.values()))}
@@ -0,0 +1,152 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource is the pipeline every API method runs its request through. A request passes through a list of stages,
+each timed as its own phase of the request (see instrumentation.py): by default, checking a session out of the pool,
+authenticating, checking permission, and running the handler. A stage that returns a response ends the request there.
+Whatever the response, it is then serialized, and the session checked back in. A method that needs more, such as
+message posts with their rate limit and Idempotency-Key, passes its own list of stages.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask import current_app, g, request
+from . import pool, rate_limit, storage
+from .idempotency import idempotent
+from .instrumentation import phase
+from .storage import storage_errors
+from .utilities import basic_auth, json_response
+
+
+class Call(object):
+    """One request on its way through the pipeline; each stage reads from and adds to it.
+
+    :param handler: the action, which takes the request body and a storage object, in that order.
+    :param permission: the integer representing the minimum permission level (1-3) needed to run handler.
+    :param body: a callable taking this Call and returning the body to give handler.
+    """
+    def __init__(self, handler, permission, body):
+        self.handler = handler
+        self.permission = permission
+        self.body = body
+        self.authorization = request.headers.get("Authorization")
+        self.session = None  # The backend session from the pool, once checked out.
+        self.store = None    # The same session, wrapped as storage.connect() would wrap it.
+        self.user = None
+
+
+# Bodies
+
+
+def json_body(call):
+    return request.get_json()
+
+
+def query_args(call):
+    return request.args.to_dict()
+
+
+def no_body(call):
+    return ""
+
+
+# Stages
+
+
+def limit(call):
+    """Applies the rate limits to a message post, before any SQL is run, so a flood costs the database nothing."""
+    return rate_limit.check(call.authorization, request.get_json(silent=True))
+
+
+def checkout(call):
+    try:
+        call.session = pool.checkout(current_app.config)
+        call.store = storage.connect(current_app.config, call.session)
+    except KeyError:
+        return {'message': 'Internal Server Error'}, 500
+    except storage_errors:
+        return {'message': 'Internal Server Error'}, 500
+
+
+def authenticate(call):
+    if not call.authorization:
+        return {'message': 'unauthorized'}, 401
+    try:
+        proceed, call.user = basic_auth(call.authorization, call.store)
+    except (IndexError, ValueError):  # A malformed header, such as "Basic" alone, or not base64 or UTF-8.
+        return {'message': 'unauthorized'}, 401
+    if not proceed:
+        return {'message': 'unauthorized'}, 401
+
+
+def basic_only(call):
+    """Refuses anything but basic auth, for the exchange of basic credentials for a bearer token."""
+    if not str(call.authorization).lower().startswith("basic "):
+        return {'message': 'unauthorized'}, 401
+
+
+def authorize(call):
+    user_permission_level = g.get("piminder_permlevel")  # Set by basic_auth.
+    if user_permission_level is None:
+        user_permission_level = call.store.get_user(call.user)["permlevel"]
+    if user_permission_level < call.permission:  # This is a highly simplistic check, but it works.
+        return {'error': 400, 'msg': "Unauthorized"}
+
+
+def idempotency(call):
+    """Wraps the handler so that a retried post with the same Idempotency-Key gets the first one's response."""
+    call.handler = idempotent(call.handler, call.user, request.headers.get("Idempotency-Key"))
+
+
+def execute(call):
+    try:
+        response = call.handler(call.body(call), call.store)
+    except TimeoutError:  # The memory store gave up waiting on another request's changes to the same messages.
+        return {"error": 409, "message": "The messages are being changed by another request; try again."}
+    call.store.commit()
+
+    return response
+
+
+default_stages = [("connect", checkout), ("auth", authenticate), ("permission", authorize), ("handler", execute)]
+posting_stages = [("limit", limit), ("connect", checkout), ("auth", authenticate), ("permission", authorize),
+                  ("handler", idempotency), ("handler", execute)]
+token_stages = [("auth", basic_only)] + default_stages
+
+
+def serialize(response):
+    """A handler's dictionary becomes a JSON response with its "error" key as the status; anything a stage returned
+    instead is already a response flask_restful can send."""
+    if isinstance(response, dict) and "error" in response:
+        return json_response(response)
+
+    return response
+
+
+def run(handler, permission, body=json_body, stages=None):
+    """Runs a request through the stages and returns its response.
+
+    :param handler: the action, which takes the request body and a storage object, in that order.
+    :param permission: the integer representing the minimum permission level (1-3) needed to run handler.
+    :param body: a callable taking the Call and returning the body to give handler; the request's JSON by default.
+    :param stages: a list of (phase name, stage) pairs, run in order; default_stages if None. A stage takes the Call
+    and returns None to go on, or a response to end the request with.
+    :return: a response for flask_restful to send.
+    """
+    call = Call(handler, permission, body)
+    response = None
+    try:
+        for name, stage in stages or default_stages:
+            with phase(name):
+                response = stage(call)
+            if response is not None:
+                break
+    finally:
+        if call.session is not None:
+            pool.checkin(call.store or call.session)  # Through the wrapper, so the memory store rolls back too.
+    with phase("serialize"):
+        return serialize(response)
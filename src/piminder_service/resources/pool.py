@@ -0,0 +1,106 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource pools database sessions, so that a request checks out a session that is already connected instead of
+opening a new connection of its own, and checks it back in when it is done. Up to POOL_SIZE idle sessions are kept
+per process. A session idle for longer than POOL_RECYCLE seconds is closed instead of reused, since the server may
+have dropped it by then. A POOL_SIZE of 0 turns pooling off, and every request connects and disconnects as before.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import threading
+import time
+from .storage import connect_backend, storage_errors
+
+
+class SessionPool(object):
+    """Idle sessions on the backend, behind one lock.
+
+    :param size: the most idle sessions kept.
+    :param recycle: seconds a session may sit idle and still be reused.
+    """
+    def __init__(self, size, recycle):
+        self.lock = threading.Lock()
+        self.size = size
+        self.recycle = recycle
+        self.idle = []  # (time.monotonic() when checked in, session), oldest first.
+
+    def checkout(self, config):
+        """:return: a session on the backend, idle in the pool or newly opened."""
+        now = time.monotonic()
+        session = None
+        with self.lock:
+            if self.idle:
+                returned, session = self.idle.pop()  # The most recently used, which is the least likely stale.
+                if now - returned >= self.recycle:
+                    self.idle.append((returned, session))  # Stale, and so is everything older; prune() closes them.
+                    session = None
+        self.prune(now)
+        if session is None:
+            session = connect_backend(config)
+
+        return session
+
+    def checkin(self, store):
+        """Takes a session back, rolling back whatever its request left uncommitted so the next does not inherit it.
+        A session that cannot be rolled back, or that the pool has no room for, is closed.
+
+        :param store: the session, or the storage object storage.connect() wrapped it in, which is rolled back too.
+        """
+        session = getattr(store, "backing", store)
+        try:
+            store.rollback()
+        except storage_errors:
+            self.close(session)
+            return
+        session.on_commit = []
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((time.monotonic(), session))
+                return
+        self.close(session)
+
+    def prune(self, now):
+        with self.lock:
+            stale = [session for returned, session in self.idle if now - returned >= self.recycle]
+            self.idle = [(returned, session) for returned, session in self.idle if now - returned < self.recycle]
+        for session in stale:
+            self.close(session)
+
+    @staticmethod
+    def close(session):
+        try:
+            session.close()
+        except storage_errors:  # It is being thrown away regardless.
+            pass
+
+
+pool = None
+pool_lock = threading.Lock()
+
+
+def checkout(config):
+    """Checks a session on the backend out of this process's pool, creating the pool on first use.
+
+    :param config: the flask app config.
+    :return: a MariaDBStorage or SQLiteStorage, to be wrapped by storage.connect() and given back to checkin().
+    """
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = SessionPool(int(config.get("POOL_SIZE", 8)), float(config.get("POOL_RECYCLE", 300)))
+
+    return pool.checkout(config)
+
+
+def checkin(store):
+    """Returns a session from checkout() to the pool, or closes it if the pool is full or turned off.
+
+    :param store: the session, or the storage object storage.connect() wrapped it in.
+    """
+    pool.checkin(store)
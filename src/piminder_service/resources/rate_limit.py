@@ -0,0 +1,169 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource limits how fast messages may be posted, so that one reporter stuck in a loop cannot saturate the
+database for everyone. Each client, each message name and the service as a whole has a token bucket, held in memory
+and checked before the request touches the database. A post that would overdraw any of them is refused with 429 and a
+Retry-After header. Since the check comes before authentication, a client is only charged as a user, and to the
+buckets of the names it posts, when it presents a bearer token with a good signature or basic credentials that
+auth_cache.py holds as verified, neither of which needs the database to check. Anything else could name any user, so
+it is charged to a bucket for its remote address instead; basic credentials are charged that way only on the first
+post after their cache entry expires. The service-wide bucket is drawn on by priority: info messages may only take it
+down to half full and minor ones to a fifth, so under load info is shed first. Major messages are admitted however
+low it is, though never past their own client's and name's buckets, so a reporter looping on major messages is still
+limited. Turned on with the RATE_LIMIT config value.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask import current_app, request
+import math
+import threading
+import time
+from . import auth_cache
+from .bearer_tokens import signed_claims
+
+dict_reserves = {"info": 0.5, "minor": 0.2}  # The share of the service-wide bucket each level may not draw on.
+max_buckets = 10000  # Past this many, full buckets are dropped; a full bucket is the same as a new one.
+
+
+class TokenBucket(object):
+    """Admits rate posts per second on average, and up to burst at once.
+
+    :param rate: tokens added per second.
+    :param burst: the most tokens the bucket holds.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, reserve=0.0):
+        """:return: how many seconds until a token can be taken without going below reserve tokens; 0 if now."""
+        if self.tokens - 1 >= reserve:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+
+        return (reserve + 1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens = max(0.0, self.tokens - 1)  # Major messages are admitted even from an empty service-wide bucket.
+
+
+class RateLimiter(object):
+    """Every bucket for the process, behind one lock.
+
+    :param config: the flask app config.
+    """
+    def __init__(self, config):
+        self.lock = threading.Lock()
+        self.user_limits = (float(config.get("RATE_LIMIT_USER_RATE", 10)),
+                            float(config.get("RATE_LIMIT_USER_BURST", 50)))
+        self.name_limits = (float(config.get("RATE_LIMIT_NAME_RATE", 2)),
+                            float(config.get("RATE_LIMIT_NAME_BURST", 20)))
+        self.total = TokenBucket(float(config.get("RATE_LIMIT_TOTAL_RATE", 200)),
+                                 float(config.get("RATE_LIMIT_TOTAL_BURST", 400)))
+        self.buckets = {}  # ("user", username), ("address", remote address) or ("name", name): TokenBucket
+
+    def bucket(self, key, limits):
+        if key not in self.buckets:
+            if len(self.buckets) >= max_buckets:
+                self.prune()
+            self.buckets[key] = TokenBucket(*limits)
+        return self.buckets[key]
+
+    def prune(self):
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+
+    def admit(self, client, name, errorlevel):
+        """Takes a token from each bucket the post draws on, if every one of them has one to give.
+
+        :param client: the key of the client's bucket, as client_key() returns it.
+        :param name: the message's name, or None if it should not be charged to a name's bucket.
+        :param errorlevel: the message's errorlevel, or None if the body has none.
+        :return: 0 if the post is admitted; otherwise the seconds to wait before trying again, and nothing is taken.
+        """
+        now = time.monotonic()
+        with self.lock:
+            buckets = [self.bucket(client, self.user_limits)]
+            if name is not None:
+                buckets.append(self.bucket(("name", name), self.name_limits))
+            for bucket in buckets + [self.total]:
+                bucket.refill(now)
+            waits = [bucket.wait() for bucket in buckets]
+            if errorlevel != "major":  # Major messages may take the service-wide bucket down to nothing, and past it.
+                waits.append(self.total.wait(dict_reserves.get(errorlevel, dict_reserves["info"]) * self.total.burst))
+            wait = max(waits)
+            if wait > 0:
+                return wait
+            for bucket in buckets + [self.total]:
+                bucket.take()
+
+        return 0
+
+
+limiter = None
+limiter_lock = threading.Lock()
+
+
+def client_key(token):
+    """The bucket to charge a post to, chosen without touching the database: the user's, if token is a bearer token
+    with a good signature or basic credentials verified recently, and otherwise the remote address's.
+
+    :param token: the value from the authorization header, or None.
+    :return: a tuple of ("user", username) or ("address", remote address).
+    """
+    token_type, sep, token_value = str(token).partition(" ")
+    if token_type.lower() == "bearer":
+        claims = signed_claims(token_value)
+        if claims is not None:
+            return "user", str(claims[0])
+    elif token_type.lower() == "basic":
+        username = auth_cache.cached_username(str(token))
+        if username is not None:
+            return "user", username
+
+    return "address", request.remote_addr
+
+
+def check(token, body):
+    """Applies the rate limits to a message post, if RATE_LIMIT is set.
+
+    :param token: the value from the authorization header.
+    :param body: the request's JSON body, or None if it has none.
+    :return: None if the post may go ahead, otherwise the 429 response to return instead.
+    """
+    global limiter
+    if not current_app.config.get("RATE_LIMIT"):
+        return None
+    with limiter_lock:
+        if limiter is None:
+            limiter = RateLimiter(current_app.config)
+
+    if not isinstance(body, dict):
+        body = {}
+    client = client_key(token)
+    # Only authenticated clients are charged to names; an unverified one could otherwise drain the bucket of a name
+    # that someone else reports under.
+    name = body.get("name") if isinstance(body.get("name"), str) and client[0] == "user" else None
+    errorlevel = body.get("errorlevel") if isinstance(body.get("errorlevel"), str) else None
+    wait = limiter.admit(client, name, errorlevel)
+    if not wait:
+        return None
+    retry_after = 3600 if math.isinf(wait) else max(1, math.ceil(wait))
+
+    return {'message': 'Too many requests', 'retryAfter': retry_after}, 429, {'Retry-After': str(retry_after)}
@@ -0,0 +1,91 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource compiles request body schemas into validator objects. Each endpoint declares its schema once, at import
+time, in the same form json_validate used to take: a dictionary of field names to an example value of the expected
+type. A tuple of examples accepts any of their types, nested dictionaries describe nested objects, OneOf lists the
+values a field may take, and Optional marks a field that may be left out.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+missing = object()  # Stands in for a field absent from the body, which no JSON value can be.
+
+
+class OneOf(object):
+    """A field that must be one of a fixed set of values, such as an errorlevel.
+
+    :param values: the permitted values.
+    :param message: the error reported for any other value; by default, one listing the permitted values.
+    """
+    def __init__(self, *values, message=None):
+        self.values = frozenset(values)
+        self.message = message or "Value not one of %s." % ", ".join(str(value) for value in values)
+
+
+class Optional(object):
+    """A field that may be absent; if present, it must match expect, which is anything a schema value may be."""
+    def __init__(self, expect):
+        self.expect = expect
+
+
+class Schema(object):
+    """A compiled request schema. Compiling turns the schema into a flat list of checks, so validating a body does
+    no more than one lookup and one test per field.
+
+    :param dict_schema: a dictionary of field names to an example value of the expected type, a tuple of examples,
+    a nested dictionary for a nested object, a OneOf, or any of those wrapped in Optional.
+    """
+    def __init__(self, dict_schema):
+        self.checks = []  # (field, kind, expected, required); kind is "type", "object" or "enum"
+        for field, expect in dict_schema.items():
+            required = not isinstance(expect, Optional)
+            if not required:
+                expect = expect.expect
+            if isinstance(expect, OneOf):
+                self.checks.append((field, "enum", expect, required))
+            elif isinstance(expect, dict):
+                self.checks.append((field, "object", Schema(expect), required))
+            elif isinstance(expect, tuple):
+                self.checks.append((field, "type", tuple(type(example) for example in expect), required))
+            else:
+                self.checks.append((field, "type", type(expect), required))
+
+    def validate(self, body):
+        """Checks body against the schema.
+
+        :param body: a deserialized JSON body.
+        :return: a tuple of whether the body is valid and a dictionary of errors keyed by field, dotted for nested
+        fields.
+        """
+        errors = {}
+        if not isinstance(body, dict):
+            return False, {"body": "Request body must be a JSON object"}
+        self.collect(body, "", errors)
+
+        return not errors, errors
+
+    def collect(self, body, prefix, errors):
+        for field, kind, expected, required in self.checks:
+            value = body.get(field, missing)
+            if kind == "type":
+                if value.__class__ is expected or isinstance(value, expected):  # The first test is the cheap one.
+                    continue
+            elif kind == "enum":
+                if not isinstance(value, (dict, list)) and value in expected.values:  # Those two can't be hashed.
+                    continue
+            elif isinstance(value, dict):
+                expected.collect(value, prefix + str(field) + ".", errors)
+                continue
+            if value is missing:
+                if required:
+                    errors[prefix + str(field)] = "Field missing from request"
+            elif kind == "enum":
+                errors[prefix + str(field)] = expected.message
+            else:
+                errors[prefix + str(field)] = "Value is not of the expected type: %s" % (dict if kind == "object"
+                                                                                          else expected,)
@@ -0,0 +1,105 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource is the single path by which request handlers execute SQL. Every statement is timed and counted for the
+request's instrumentation, and statements slower than SLOW_QUERY_MS are logged with the shape of their parameters
+and, if SLOW_QUERY_EXPLAIN is set, the database's plan for them.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask import current_app, has_app_context
+import sqlite3
+import time
+from .instrumentation import record_query
+
+explainable = ("SELECT", "INSERT", "UPDATE", "DELETE")
+
+
+def execute(cursor, command, args=None):
+    """Executes one statement on cursor. Outside of a request (the database initializer, background writers) the
+    statement simply runs, untimed.
+
+    :param cursor: a pymysql or sqlite3 cursor.
+    :param command: the SQL statement.
+    :param args: the statement's parameters, if any.
+    :return: the cursor's rowcount afterward.
+    """
+    if not has_app_context():
+        run(cursor, command, args)
+        return cursor.rowcount
+    start = time.perf_counter()
+    try:
+        run(cursor, command, args)
+        return cursor.rowcount
+    finally:
+        elapsed = time.perf_counter() - start
+        record_query(elapsed)
+        if elapsed * 1000 >= float(current_app.config.get("SLOW_QUERY_MS", 250)):
+            log_slow_query(cursor, command, args, elapsed)
+
+
+def execute_many(cursor, command, list_args):
+    """Executes one statement on cursor once for each set of parameters in list_args, timed as a single query.
+
+    :return: the cursor's rowcount afterward.
+    """
+    if not has_app_context():
+        cursor.executemany(command, list_args)
+        return cursor.rowcount
+    start = time.perf_counter()
+    try:
+        cursor.executemany(command, list_args)
+        return cursor.rowcount
+    finally:
+        elapsed = time.perf_counter() - start
+        record_query(elapsed)
+        if elapsed * 1000 >= float(current_app.config.get("SLOW_QUERY_MS", 250)):
+            current_app.logger.warning("Slow query (%.1fms): %s x%d", elapsed * 1000, " ".join(command.split()),
+                                       len(list_args))
+
+
+def run(cursor, command, args):
+    if args is None:  # sqlite3 will not take None for "no parameters"
+        cursor.execute(command)
+    else:
+        cursor.execute(command, args)
+
+
+def parameter_shape(args):
+    """Describes parameters by type and length only, so that passwords and message bodies never reach the log."""
+    def describe(value):
+        if isinstance(value, (str, bytes)):
+            return "%s(%d)" % (type(value).__name__, len(value))
+        return type(value).__name__
+
+    if isinstance(args, dict):
+        return {key: describe(value) for key, value in args.items()}
+    if isinstance(args, (list, tuple)):
+        return [describe(value) for value in args]
+    if args is None:
+        return None
+
+    return describe(args)
+
+
+def log_slow_query(cursor, command, args, elapsed):
+    current_app.logger.warning("Slow query (%.1fms): %s params=%s", elapsed * 1000, " ".join(command.split()),
+                               parameter_shape(args))
+    if current_app.config.get("SLOW_QUERY_EXPLAIN") and command.lstrip().upper().startswith(explainable):
+        explain_cursor = cursor.connection.cursor()  # A separate cursor, so the caller's results are left alone.
+        try:
+            if isinstance(cursor, sqlite3.Cursor):
+                run(explain_cursor, "EXPLAIN QUERY PLAN " + command, args)
+            else:
+                run(explain_cursor, "EXPLAIN " + command, args)
+            for row in explain_cursor.fetchall():
+                current_app.logger.warning("  plan: %s", row)
+        except Exception as e:  # The plan is a courtesy; failing to get one must never fail the request.
+            current_app.logger.warning("  plan unavailable: %s", e)
+        finally:
+            explain_cursor.close()
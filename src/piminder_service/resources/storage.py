@@ -0,0 +1,505 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource is the storage interface the request handlers use instead of writing SQL themselves. Two backends
+implement it: MariaDB through pymysql, as always, and an embedded SQLite database in WAL mode for small single-host
+deployments. The backend is chosen with the STORAGE config value. With STORAGE_MODE = memory, messages are served
+from memory instead and written behind to the backend; see memstore.py.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import abc
+import pymysql
+import sqlite3
+import uuid
+from . import group_commit, memstore
+from .sql import execute, execute_many
+
+storage_errors = (pymysql.Error, sqlite3.Error)  # What a resource should catch when the database is unavailable.
+
+
+class SQLStorage(abc.ABC):
+    """One request's session with the database. Subclasses supply the statements in their own dialect; every
+    statement takes a dictionary of named parameters and runs through sql.execute.
+
+    Nothing is committed until commit() is called, which the request pipeline does once the handler returns.
+    """
+    cmd_get_user = None
+    cmd_count_admins = None
+    cmd_list_users = None
+    cmd_insert_user = None
+    cmd_update_user = None
+    cmd_find_user = None
+    cmd_deactivate_user = None
+    cmd_list_messages = None
+    cmd_insert_message = None
+    cmd_record_occurrence = None
+    cmd_record_occurrence_timestamp = None
+    cmd_get_message = None
+    cmd_mark_read = None
+    cmd_delete_message = None
+    cmd_find_messages = "SELECT id, read_flag FROM messages WHERE %s"  # Each %s is filled with a WHERE clause.
+    cmd_mark_read_many = None
+    cmd_delete_messages = "DELETE FROM messages WHERE %s"
+    # message_counts keeps a total and unread count per (name, errorlevel), adjusted in the same transaction as every
+    # change to messages. Statements that change messages by id adjust the counts first, from the rows they will change.
+    cmd_count_inserted = None
+    cmd_message_counts = "SELECT name, errorlevel, total, unread FROM message_counts WHERE total > 0"
+    count_match = "FROM messages m WHERE m.name = message_counts.name AND m.errorlevel = message_counts.errorlevel " \
+                  "AND {clause}"
+    count_targets = "WHERE (name, errorlevel) IN (SELECT name, errorlevel FROM messages m WHERE {clause})"
+    cmd_count_removed = "UPDATE message_counts SET total = total - (SELECT COUNT(*) " + count_match + "), " \
+                        "unread = unread - (SELECT COUNT(*) " + count_match + " AND m.read_flag = 0) " + count_targets
+    cmd_count_read = "UPDATE message_counts SET unread = unread - (SELECT COUNT(*) " + count_match + \
+                     " AND m.read_flag = 0) " + count_targets
+    cmd_count_unread = "UPDATE message_counts SET unread = unread + (SELECT COUNT(*) " + count_match + \
+                       " AND m.read_flag <> 0) " + count_targets
+    cmd_count_marked_read = "UPDATE message_counts SET unread = unread - 1 " + count_targets  # Once it has been.
+    # Idempotency keys record the response to a post made with an Idempotency-Key header, so a retry can be answered
+    # with it instead of being run again; see idempotency.py.
+    cmd_expire_idempotency_key = None
+    cmd_claim_idempotency_key = None
+    cmd_get_idempotent_response = None
+    cmd_save_idempotent_response = None
+    cmd_purge_idempotency_keys = None
+    cmd_revoke_tokens = None
+    cmd_list_token_revocations = "SELECT username, revoked_at FROM token_revocations WHERE revoked_at > %s"
+    chunk_size = 500  # Ids per IN list, keeping well within SQLite's limit on bound parameters.
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.cur = connection.cursor()
+        self.on_commit = []
+
+    def commit(self):
+        self.connection.commit()
+        callbacks, self.on_commit = self.on_commit, []
+        for callback in callbacks:
+            callback()
+
+    def after_commit(self, callback):
+        """Runs callback (once) when this session's changes next commit, such as to invalidate a cache of them."""
+        if callback not in self.on_commit:
+            self.on_commit.append(callback)
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def transactional(self):
+        """This session, such that every change it makes is in the request's own transaction. The wrappers in
+        group_commit.py and memstore.py return what suits them."""
+        return self
+
+    def close(self):
+        self.connection.close()
+
+    def fetch_one(self, command, args=None):
+        execute(self.cur, command, args)
+        return self.cur.fetchone()
+
+    def fetch_all(self, command, args=None):
+        execute(self.cur, command, args)
+        return self.cur.fetchall()
+
+    # Users
+
+    def get_user(self, username):
+        """:return: a dictionary of username, password (the bcrypt hash), permlevel and memo; or None."""
+        return self.fetch_one(self.cmd_get_user, {"username": username})
+
+    def count_admins(self):
+        return self.fetch_one(self.cmd_count_admins)["howmany"]
+
+    def list_users(self):
+        """:return: a list of dictionaries of username, memo and permlevel, ordered by username."""
+        return self.fetch_all(self.cmd_list_users)
+
+    def insert_user(self, user):
+        """:param user: a dictionary of username, password (already hashed), memo and permlevel."""
+        execute(self.cur, self.cmd_insert_user, user)
+
+    def update_user(self, user):
+        """:param user: a dictionary of username, password (already hashed), memo and permlevel."""
+        execute(self.cur, self.cmd_update_user, user)
+
+    def user_exists(self, username):
+        return self.fetch_one(self.cmd_find_user, {"username": username}) is not None
+
+    def deactivate_user(self, username):
+        """:return: how many users were changed. MariaDB does not count a user who was already deactivated."""
+        return execute(self.cur, self.cmd_deactivate_user, {"username": username})
+
+    # Messages
+
+    def list_messages(self):
+        """:return: a list of dictionaries of id, name, message, errorlevel, time_raised (epoch seconds), read (a
+        bool), occurrences, first_seen and last_seen (epoch seconds), newest first."""
+        return [self.message_from_row(row) for row in self.fetch_all(self.cmd_list_messages)]
+
+    def insert_message(self, message):
+        """:param message: a dictionary of id, name, timestamp (epoch seconds), errorlevel, message and read."""
+        execute(self.cur, self.cmd_insert_message, self.row_for_insert(message))
+        execute(self.cur, self.cmd_count_inserted, self.count_for_insert(message))
+
+    def insert_messages(self, messages):
+        """Inserts several messages with one executemany; each is a dictionary as for insert_message."""
+        execute_many(self.cur, self.cmd_insert_message, [self.row_for_insert(message) for message in messages])
+        execute_many(self.cur, self.cmd_count_inserted, [self.count_for_insert(message) for message in messages])
+
+    def row_for_insert(self, message):
+        return dict(message, id=self.id_param(message["id"]))
+
+    def count_for_insert(self, message):
+        return {"name": message["name"], "errorlevel": message["errorlevel"], "unread": 0 if message["read"] else 1}
+
+    def record_occurrence(self, name, message, timestamp, update_time=False):
+        """Records another occurrence of the message with exactly this name and text, if there is one, in a single
+        UPDATE: it is marked unread again, its occurrences counted up and its last_seen set to timestamp.
+
+        :param timestamp: when it occurred, in epoch seconds.
+        :param update_time: whether to move time_raised to timestamp as well.
+        :return: how many messages were updated; if none, the caller should insert the message instead.
+        """
+        args = {"name": name, "message": message, "timestamp": timestamp}
+        clause = "m.name = %s AND m.message = %s" % (self.param("name"), self.param("message"))
+        self.adjust_counts(self.cmd_count_unread, clause, {"name": name, "message": message})
+        if update_time:
+            return execute(self.cur, self.cmd_record_occurrence_timestamp, args)
+
+        return execute(self.cur, self.cmd_record_occurrence, args)
+
+    def get_message(self, message_id):
+        """:return: a dictionary of id and read (a bool), or None if there is no such message."""
+        row = self.fetch_one(self.cmd_get_message, {"id": self.id_param(message_id)})
+        return {"id": message_id, "read": self.read_from_row(row)} if row else None
+
+    def mark_read(self, message_id):
+        """Marks a message read with one conditional UPDATE, which only matches it while it is unread.
+
+        :return: whether it was marked read; False if it does not exist or was already read.
+        """
+        if not execute(self.cur, self.cmd_mark_read, {"id": self.id_param(message_id)}):
+            return False
+        self.adjust_counts(self.cmd_count_marked_read, *self.ids_clause([message_id], "m.id"))
+
+        return True
+
+    def delete_message(self, message_id):
+        """:return: whether the message was deleted; False if it does not exist."""
+        self.adjust_counts(self.cmd_count_removed, *self.ids_clause([message_id], "m.id"))
+        return execute(self.cur, self.cmd_delete_message, {"id": self.id_param(message_id)}) > 0
+
+    def message_counts(self):
+        """:return: a list of dictionaries of name, errorlevel, total and unread, for every pair with messages."""
+        return [{"name": row["name"], "errorlevel": row["errorlevel"], "total": int(row["total"]),
+                 "unread": int(row["unread"])} for row in self.fetch_all(self.cmd_message_counts)]
+
+    def adjust_counts(self, command, clause, args):
+        """Runs one of the cmd_count_* statements for the messages matching clause, before they are changed. The
+        clause refers to messages as m."""
+        execute(self.cur, command.format(clause=clause), args)
+
+    # Idempotency keys
+
+    def claim_idempotency_key(self, username, key, now, cutoff):
+        """Claims key for username in this transaction, unless it was claimed already since cutoff. A claim made by a
+        transaction not yet committed is waited for.
+
+        :param now: the time of the claim, in epoch seconds.
+        :param cutoff: claims older than this, in epoch seconds, have expired and are replaced.
+        :return: None if the key is now claimed; otherwise a tuple of whether the original request has finished, and
+        its JSON response if so.
+        """
+        args = {"username": username, "key": key, "now": now, "cutoff": cutoff}
+        execute(self.cur, self.cmd_expire_idempotency_key, args)
+        if execute(self.cur, self.cmd_claim_idempotency_key, args) == 1:
+            return None
+        row = self.fetch_one(self.cmd_get_idempotent_response, args)
+
+        return (row["response"] is not None, row["response"]) if row else (False, None)
+
+    def save_idempotent_response(self, username, key, response):
+        """:param response: the JSON response to replay to retries using this key."""
+        execute(self.cur, self.cmd_save_idempotent_response, {"username": username, "key": key, "response": response})
+
+    def purge_idempotency_keys(self, cutoff):
+        """Deletes every claim older than cutoff, in epoch seconds."""
+        execute(self.cur, self.cmd_purge_idempotency_keys, {"cutoff": cutoff})
+
+    # Bearer token revocations, in milliseconds since the epoch; see bearer_tokens.py.
+
+    def revoke_tokens(self, username, revoked_at):
+        execute(self.cur, self.cmd_revoke_tokens, {"username": username, "revoked_at": revoked_at})
+
+    def list_token_revocations(self, since):
+        """:return: a list of dictionaries of username and revoked_at, for revocations made after since."""
+        return self.fetch_all(self.cmd_list_token_revocations % self.param("since"), {"since": since})
+
+    # Bulk operations on messages, each as one set-based statement per chunk of ids.
+
+    def find_messages(self, ids=None, criteria=None):
+        """Looks up messages by id or by criteria.
+
+        :param ids: a list of message ids.
+        :param criteria: used if ids is None; a dictionary of any of name, errorlevel, before (epoch seconds) and read
+        (a bool). Messages must match every criterion given, and at least one must be.
+        :return: a list of dictionaries of id and read (a bool), for the messages found.
+        """
+        rows = []
+        if ids is not None:
+            for chunk in chunked(ids, self.chunk_size):
+                clause, args = self.ids_clause(chunk)
+                rows.extend(self.fetch_all(self.cmd_find_messages % clause, args))
+        else:
+            clause, args = self.criteria_clause(criteria)
+            rows = self.fetch_all(self.cmd_find_messages % clause, args)
+
+        return [{"id": self.id_from_row(row["id"]), "read": self.read_from_row(row)} for row in rows]
+
+    def mark_read_many(self, ids):
+        for chunk in chunked(ids, self.chunk_size):
+            self.adjust_counts(self.cmd_count_read, *self.ids_clause(chunk, "m.id"))
+            clause, args = self.ids_clause(chunk)
+            execute(self.cur, self.cmd_mark_read_many % clause, args)
+
+    def delete_messages(self, ids):
+        for chunk in chunked(ids, self.chunk_size):
+            self.adjust_counts(self.cmd_count_removed, *self.ids_clause(chunk, "m.id"))
+            clause, args = self.ids_clause(chunk)
+            execute(self.cur, self.cmd_delete_messages % clause, args)
+
+    def ids_clause(self, ids, column="id"):
+        args = {"id_%d" % position: self.id_param(message_id) for position, message_id in enumerate(ids)}
+
+        return "%s IN (%s)" % (column, ", ".join(self.param(name) for name in args)), args
+
+    def criteria_clause(self, criteria):
+        conditions = []
+        for key in ["name", "errorlevel"]:
+            if key in criteria:
+                conditions.append("%s=%s" % (key, self.param(key)))
+        if "before" in criteria:
+            conditions.append("time_raised < %s" % self.time_param("before"))
+        if "read" in criteria:
+            conditions.append("read_flag=%s" % self.param("read"))
+        if not conditions:
+            raise ValueError("At least one criterion is needed.")
+        args = {key: criteria[key] for key in ["name", "errorlevel", "before"] if key in criteria}
+        if "read" in criteria:
+            args["read"] = int(criteria["read"])
+
+        return " AND ".join(conditions), args
+
+    @abc.abstractmethod
+    def param(self, name):
+        """The placeholder for the named parameter, in this backend's dialect."""
+
+    def time_param(self, name):
+        """The placeholder for a named parameter in epoch seconds, compared with time_raised."""
+        return self.param(name)
+
+    def id_param(self, message_id):
+        """A message id as the API gives it, a UUID string, in the form this backend stores it."""
+        return message_id
+
+    def id_from_row(self, value):
+        return value
+
+    def message_from_row(self, row):
+        return {"id": self.id_from_row(row["id"]), "name": row["name"], "message": row["message"],
+                "errorlevel": row["errorlevel"],
+                "time_raised": self.time_from_row(row, "time_raised"), "read": self.read_from_row(row),
+                "occurrences": int(row["occurrences"]), "first_seen": self.time_from_row(row, "first_seen"),
+                "last_seen": self.time_from_row(row, "last_seen")}
+
+    def time_from_row(self, row, column):
+        return None if row[column] is None else int(row[column])
+
+    def read_from_row(self, row):
+        return bool(row["read_flag"])
+
+
+class MariaDBStorage(SQLStorage):
+    cmd_get_user = "SELECT username, password, permlevel, memo FROM users WHERE username=%(username)s"
+    cmd_count_admins = "SELECT count(username) AS howmany FROM users WHERE permlevel like 3;"
+    cmd_list_users = "SELECT username, memo, permlevel FROM users ORDER BY username asc;"  # we don't want the passwords!
+    cmd_insert_user = "INSERT INTO users " \
+                      "(username, password, memo, permlevel) " \
+                      "VALUES (%(username)s, %(password)s, %(memo)s, %(permlevel)s);"
+    cmd_update_user = "UPDATE users " \
+                      "SET password=%(password)s, memo=%(memo)s, permlevel=%(permlevel)s " \
+                      "WHERE username=%(username)s;"
+    cmd_find_user = "SELECT username FROM users WHERE username=%(username)s;"
+    cmd_deactivate_user = "UPDATE users SET permlevel=0 WHERE username=%(username)s;"
+    cmd_list_messages = "SELECT id, name, message, errorlevel, UNIX_TIMESTAMP(time_raised) AS time_raised, read_flag, " \
+                        "occurrences, UNIX_TIMESTAMP(first_seen) AS first_seen, UNIX_TIMESTAMP(last_seen) AS last_seen " \
+                        "FROM messages ORDER BY messages.time_raised desc;"
+    cmd_insert_message = "INSERT INTO messages " \
+                         "(id, name, time_raised, errorlevel, message, read_flag, occurrences, first_seen, last_seen) " \
+                         "VALUES (%(id)s, %(name)s, FROM_UNIXTIME(%(timestamp)s), %(errorlevel)s, " \
+                         "%(message)s, %(read)s, 1, FROM_UNIXTIME(%(timestamp)s), FROM_UNIXTIME(%(timestamp)s))"
+    # time_raised is named in each UPDATE that should leave it alone, since a server may auto-update the first
+    # TIMESTAMP column of a table on any change to a row.
+    cmd_record_occurrence = "UPDATE messages " \
+                            "SET read_flag=FALSE, occurrences=occurrences + 1, last_seen=FROM_UNIXTIME(%(timestamp)s), " \
+                            "time_raised=time_raised WHERE name=%(name)s AND message=%(message)s"
+    cmd_record_occurrence_timestamp = "UPDATE messages " \
+                                      "SET read_flag=FALSE, occurrences=occurrences + 1, " \
+                                      "last_seen=FROM_UNIXTIME(%(timestamp)s), time_raised=FROM_UNIXTIME(%(timestamp)s) " \
+                                      "WHERE name=%(name)s AND message=%(message)s"
+    cmd_get_message = "SELECT id, read_flag FROM messages WHERE id=%(id)s"
+    cmd_mark_read = "UPDATE messages SET read_flag=TRUE, time_raised=time_raised WHERE id=%(id)s AND read_flag=FALSE"
+    cmd_delete_message = "DELETE FROM messages WHERE id=%(id)s RETURNING name, errorlevel, read_flag"
+    cmd_count_deleted = "UPDATE message_counts SET total = total - 1, unread = unread - %(unread)s " \
+                        "WHERE name=%(name)s AND errorlevel=%(errorlevel)s"
+    cmd_mark_read_many = "UPDATE messages SET read_flag=TRUE, time_raised=time_raised WHERE %s"
+    cmd_count_inserted = "INSERT INTO message_counts (name, errorlevel, total, unread) " \
+                         "VALUES (%(name)s, %(errorlevel)s, 1, %(unread)s) " \
+                         "ON DUPLICATE KEY UPDATE total = total + 1, unread = unread + VALUES(unread)"
+    cmd_expire_idempotency_key = "DELETE FROM idempotency_keys WHERE username=%(username)s AND idem_key=%(key)s " \
+                                 "AND created < FROM_UNIXTIME(%(cutoff)s)"
+    cmd_claim_idempotency_key = "INSERT IGNORE INTO idempotency_keys (username, idem_key, created) " \
+                                "VALUES (%(username)s, %(key)s, FROM_UNIXTIME(%(now)s))"
+    # A locking read, so it sees a claim committed since this transaction's snapshot was taken.
+    cmd_get_idempotent_response = "SELECT response FROM idempotency_keys " \
+                                  "WHERE username=%(username)s AND idem_key=%(key)s FOR UPDATE"
+    cmd_save_idempotent_response = "UPDATE idempotency_keys SET response=%(response)s " \
+                                   "WHERE username=%(username)s AND idem_key=%(key)s"
+    cmd_purge_idempotency_keys = "DELETE FROM idempotency_keys WHERE created < FROM_UNIXTIME(%(cutoff)s)"
+    cmd_revoke_tokens = "INSERT INTO token_revocations (username, revoked_at) VALUES (%(username)s, %(revoked_at)s) " \
+                        "ON DUPLICATE KEY UPDATE revoked_at = VALUES(revoked_at)"
+
+    def param(self, name):
+        return "%%(%s)s" % name
+
+    def time_param(self, name):
+        return "FROM_UNIXTIME(%s)" % self.param(name)
+
+    def delete_message(self, message_id):
+        """Deletes first and adjusts the counts from the row it returns. Adjusting first, from a read of the row, could
+        count the message twice were it deleted by two requests at once."""
+        row = self.fetch_one(self.cmd_delete_message, {"id": self.id_param(message_id)})
+        if row is None:
+            return False
+        execute(self.cur, self.cmd_count_deleted, {"name": row["name"], "errorlevel": row["errorlevel"],
+                                                   "unread": 0 if row["read_flag"] else 1})
+
+        return True
+
+    def id_param(self, message_id):
+        """Ids are stored as BINARY(16) since migration 005."""
+        try:
+            return uuid.UUID(message_id).bytes
+        except (AttributeError, TypeError, ValueError):  # Not a UUID, so no message has it; NULL matches no row.
+            return None
+
+    def id_from_row(self, value):
+        return str(uuid.UUID(bytes=value))
+
+
+class SQLiteStorage(SQLStorage):
+    """Times are stored as integer epoch seconds and flags as 0/1 integers. SQLite has one writer at a time, so a
+    change and the count adjustment before it are never interleaved with another request's."""
+    cmd_get_user = "SELECT username, password, permlevel, memo FROM users WHERE username=:username"
+    cmd_count_admins = "SELECT count(username) AS howmany FROM users WHERE permlevel=3"
+    cmd_list_users = "SELECT username, memo, permlevel FROM users ORDER BY username asc"
+    cmd_insert_user = "INSERT INTO users (username, password, memo, permlevel) " \
+                      "VALUES (:username, :password, :memo, :permlevel)"
+    cmd_update_user = "UPDATE users SET password=:password, memo=:memo, permlevel=:permlevel " \
+                      "WHERE username=:username"
+    cmd_find_user = "SELECT username FROM users WHERE username=:username"
+    cmd_deactivate_user = "UPDATE users SET permlevel=0 WHERE username=:username"
+    cmd_list_messages = "SELECT * FROM messages ORDER BY time_raised desc"
+    cmd_insert_message = "INSERT INTO messages " \
+                         "(id, name, time_raised, errorlevel, message, read_flag, occurrences, first_seen, last_seen) " \
+                         "VALUES (:id, :name, :timestamp, :errorlevel, :message, :read, 1, :timestamp, :timestamp)"
+    cmd_record_occurrence = "UPDATE messages SET read_flag=0, occurrences=occurrences + 1, last_seen=:timestamp " \
+                            "WHERE name=:name AND message=:message"
+    cmd_record_occurrence_timestamp = "UPDATE messages " \
+                                      "SET read_flag=0, occurrences=occurrences + 1, last_seen=:timestamp, " \
+                                      "time_raised=:timestamp WHERE name=:name AND message=:message"
+    cmd_get_message = "SELECT id, read_flag FROM messages WHERE id=:id"
+    cmd_mark_read = "UPDATE messages SET read_flag=1 WHERE id=:id AND read_flag=0"
+    cmd_delete_message = "DELETE FROM messages WHERE id=:id"
+    cmd_mark_read_many = "UPDATE messages SET read_flag=1 WHERE %s"
+    cmd_count_inserted = "INSERT INTO message_counts (name, errorlevel, total, unread) " \
+                         "VALUES (:name, :errorlevel, 1, :unread) " \
+                         "ON CONFLICT (name, errorlevel) DO UPDATE SET total = total + 1, unread = unread + excluded.unread"
+    cmd_expire_idempotency_key = "DELETE FROM idempotency_keys WHERE username=:username AND idem_key=:key " \
+                                 "AND created < :cutoff"
+    cmd_claim_idempotency_key = "INSERT OR IGNORE INTO idempotency_keys (username, idem_key, created) " \
+                                "VALUES (:username, :key, :now)"
+    cmd_get_idempotent_response = "SELECT response FROM idempotency_keys WHERE username=:username AND idem_key=:key"
+    cmd_save_idempotent_response = "UPDATE idempotency_keys SET response=:response " \
+                                   "WHERE username=:username AND idem_key=:key"
+    cmd_purge_idempotency_keys = "DELETE FROM idempotency_keys WHERE created < :cutoff"
+    cmd_revoke_tokens = "INSERT INTO token_revocations (username, revoked_at) VALUES (:username, :revoked_at) " \
+                        "ON CONFLICT (username) DO UPDATE SET revoked_at = excluded.revoked_at"
+
+    def param(self, name):
+        return ":%s" % name
+
+    def row_for_insert(self, message):
+        return dict(message, timestamp=int(message["timestamp"]), read=int(message["read"]))
+
+    def record_occurrence(self, name, message, timestamp, update_time=False):
+        return super().record_occurrence(name, message, int(timestamp), update_time)
+
+
+def chunked(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def dict_factory(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def sqlite_connect(path):
+    """Opens the SQLite database at path, in WAL mode so that readers never wait on the writer. The connection may be
+    pooled and so used from more than one thread, though only ever by one at a time."""
+    connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+    connection.row_factory = dict_factory
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; a power cut can lose only the latest commits.
+
+    return connection
+
+
+def connect(config, store=None):
+    """Opens a storage session on the backend named by config["STORAGE"], wrapped in the in-memory message store if
+    config["STORAGE_MODE"] is "memory", or with its inserts group-committed if config["GROUP_COMMIT"] is set.
+
+    :param config: the flask app config, or any mapping with the same keys.
+    :param store: a session already open on the backend, such as one from the pool, to wrap instead of a new one.
+    :return: a MariaDBStorage, SQLiteStorage, memstore.MemoryStorage or group_commit.GroupCommitStorage.
+    """
+    if store is None:
+        store = connect_backend(config)
+    if str(config.get("STORAGE_MODE", "direct")).lower() == "memory":
+        return memstore.attach(store, config, lambda: connect_backend(config))
+    if config.get("GROUP_COMMIT"):
+        return group_commit.attach(store, config, lambda: connect_backend(config))
+
+    return store
+
+
+def connect_backend(config):
+    """Opens a session directly on the database named by config["STORAGE"]."""
+    backend = str(config.get("STORAGE", "mariadb")).lower()
+    if backend == "sqlite":
+        return SQLiteStorage(sqlite_connect(config.get("SQLITE_PATH", "piminder.db")))
+    if backend == "mariadb":
+        connection = pymysql.connect(host=config["DBHOST"],
+                                     user=config["USERNAME"],
+                                     password=config["PASSPHRASE"],
+                                     db='Piminder',
+                                     cursorclass=pymysql.cursors.DictCursor)
+        connection.ping(reconnect=True)
+        return MariaDBStorage(connection)
+    raise ValueError("Unknown STORAGE backend: %s" % backend)
@@ -0,0 +1,48 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource reports how many messages there are, and how many are unread, by errorlevel and by name, without
+sending the messages themselves. The counts come from the message_counts table, which the storage layer keeps up to
+date in the same transaction as every change to messages.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask_restful import Resource
+from . import pipeline
+
+__version__ = "1.1.0"
+
+
+class SummaryAPI(Resource):
+    def get(self):
+        """An authenticated user with reporting permissions may retrieve the message counts.
+
+        :return: In the valid case, a json dictionary of totals, as described in summary_get.
+        """
+        return pipeline.run(summary_get, 2, body=pipeline.no_body)
+
+# Here follow the actual actions!
+
+
+def summary_get(body, store):
+    """Totals every (name, errorlevel) count into overall, per-level and per-name totals. Each total is a dictionary
+    of total and unread; byName also breaks each name down by level, and every level appears in byLevel even at 0."""
+    del body
+    response = {"total": 0, "unread": 0,
+                "byLevel": {level: {"total": 0, "unread": 0} for level in ["info", "minor", "major"]},
+                "byName": {}}
+    for count in store.message_counts():
+        by_name = response["byName"].setdefault(count["name"], {"total": 0, "unread": 0, "byLevel": {}})
+        by_name["byLevel"][count["errorlevel"]] = {"total": count["total"], "unread": count["unread"]}
+        by_level = response["byLevel"].setdefault(count["errorlevel"], {"total": 0, "unread": 0})
+        for totals in [response, by_level, by_name]:
+            totals["total"] += count["total"]
+            totals["unread"] += count["unread"]
+    response.update({"error": 200})
+
+    return response
@@ -0,0 +1,38 @@
+"""
+This script is a component of Piminder's back-end controller.
+This resource exchanges a user's basic auth credentials for a signed bearer token, which the other endpoints accept in
+their place until it expires; see bearer_tokens.py.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from flask_restful import Resource
+from . import bearer_tokens, pipeline
+
+__version__ = "1.1.0"
+
+
+class TokenAPI(Resource):
+    def post(self):
+        """Any active user may exchange their basic auth credentials for a bearer token. A bearer token cannot be
+        used to get another, so a stolen one lapses when it expires.
+
+        :return: In the valid case, a json dictionary of the token and its lifetime in seconds.
+        """
+        return pipeline.run(tokens_post, 1, body=lambda call: {"username": call.user},
+                            stages=pipeline.token_stages)
+
+# Here follow the actual actions!
+
+
+def tokens_post(body, store):
+    """Issues a token carrying the user's current permission level."""
+    d_user = store.get_user(body["username"])
+    token, ttl = bearer_tokens.issue(d_user["username"], d_user["permlevel"])
+
+    return {"token": token, "expiresIn": ttl, "error": 200}
@@ -12,15 +12,20 @@ Full license and documentation to be found at:
 https://github.com/ZAdamMac/piminder
 """
 
-import datetime
 from flask_restful import Resource
-from flask import current_app, request, make_response
-import pymysql
-import uuid
-from .utilities import authenticated_exec, basic_auth, json_validate
+from piminder_helpers.timestamps import to_epoch
+from . import listing_cache, pipeline
+from .ids import new_id
+from .messages import list_errorlevels
+from .schema import OneOf, Schema
 
 __version__ = "1.1.0"
 
+schema_unique_message = Schema({"name": "", "timestamp": ("", 0, 0.0),
+                                "errorlevel": OneOf(*list_errorlevels,
+                                                    message="Error level not one of info, minor, or major."),
+                                "message": "", "updateTimestamp": False})
+
 
 class UniqueMessageAPI(Resource):
     def post(self):
@@ -28,79 +33,40 @@ class UniqueMessageAPI(Resource):
 
         :return:
         """
-        cookie = request.headers.get("Authorization")
-        try:
-            connection = pymysql.connect(host=current_app.config["DBHOST"],
-                                         user=current_app.config["USERNAME"],
-                                         password=current_app.config["PASSPHRASE"],
-                                         db='Piminder',
-                                         cursorclass=pymysql.cursors.DictCursor)
-            connection.ping(reconnect=True)
-        except KeyError:
-            return {'message': 'Internal Server Error, Key error'}, 500
-        except pymysql.Error as e:
-            return {'message': 'Internal Server Error, sql error'}, 501
-        proceed, user = basic_auth(cookie, connection)
-        if proceed:  # A chicken ain't nothing but a bird.
-            dict_return = authenticated_exec(user, 1, connection, unique_messages_post, request.get_json())
-            resp = make_response(dict_return)
-            resp.status_code = dict_return["error"]
-            resp.content_type = "application/json"
-            return resp
-        else:
-            return {'message': 'unauthorized'}, 401
+        return pipeline.run(unique_messages_post, 1, stages=pipeline.posting_stages)
 
 # Here follow the actual actions!
 
 
-def unique_messages_post(body, connection):
+def unique_messages_post(body, store):
     """Check if the given message exists on the messages table already and either create or update it."""
-    cur = connection.cursor()
-    dict_schema = {"name": "", "timestamp": "", "errorlevel": "", "message": "", "updateTimestamp": False}
-    json_valid, errors = json_validate(body, dict_schema)
-    if body["errorlevel"] not in ["info", "minor", "major"]:
-        json_valid = False
-        errors.update({"errorlevel": "Error level not one of info, minor, or major."})
+    json_valid, errors = schema_unique_message.validate(body)
+    if json_valid:
+        try:
+            timestamp = to_epoch(body["timestamp"])
+        except ValueError:
+            json_valid = False
+            errors.update({"timestamp": "Timestamp is not ISO 8601, such as 2021-06-01T04:00:00Z, or epoch "
+                                        "seconds, between 1970 and 2038."})
 
     if json_valid:
-        # Find if it exists already
-        cmd = "SELECT id " \
-              "FROM messages " \
-              "WHERE name=%s AND message=%s"
-        rows = cur.execute(cmd, (body["name"], body["message"]))
-        if rows:
-            result = cur.fetchone()
+        # Count another occurrence if it exists already, marking it unread again and moving its timestamp if asked
+        # for in body; all in one statement, so there is no window between finding the message and updating it.
+        updated = store.record_occurrence(body["name"], body["message"], timestamp, body["updateTimestamp"])
         # If not, create it
-        if rows == 0:
+        if not updated:
             d_message = {}
             d_message.update(body)
-            d_message.update({"id": str(uuid.uuid4())})
+            d_message.update({"id": new_id()})
             d_message.update({"read": False})
-            d_message.update({"timestamp": datetime.datetime.strptime(body["timestamp"], "%Y-%m-%dT%H:%M:%SZ").timestamp()})
-            cmd = "INSERT INTO messages " \
-                "(id, name, time_raised, errorlevel, message, read_flag) " \
-                "VALUES (%(id)s, %(name)s, FROM_UNIXTIME(%(timestamp)s), %(errorlevel)s, " \
-                "%(message)s, %(read)s)"
-            cur.execute(cmd, d_message)
-            response = {"error": 200}
-            connection.commit()
-        # If so, and asked for in body
-        if rows:
-            if body["updateTimestamp"]:
-                cmd = "UPDATE messages " \
-                      "SET read_flag=FALSE, time_raised=FROM_UNIXTIME(%(timestamp)s) " \
-                      "WHERE id=%(id)s"
-            else:
-                cmd = "UPDATE messages " \
-                      "SET read_flag=FALSE " \
-                      "WHERE id=%(id)s"
-            result.update({"timestamp": datetime.datetime.strptime(body["timestamp"], "%Y-%m-%dT%H:%M:%SZ").timestamp()})
-            cur.execute(cmd, result)
-            response = {"error": 200}
-            connection.commit()
+            d_message.update({"timestamp": timestamp})
+            # In the request's own transaction: the UPDATE above already holds the write lock the insert needs, so
+            # handing it to the group committer would leave this request waiting on itself.
+            store.transactional().insert_message(d_message)
+        store.after_commit(listing_cache.invalidate)
+        response = {"error": 200}
 
     else:
         response = {"all_errors": errors, "error": 400}
 
     return response
-
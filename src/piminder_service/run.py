@@ -13,8 +13,14 @@ https://github.com/ZAdamMac/Piminder
 
 from flask import Flask
 from configparser import ConfigParser
+import os
 from os import environ
-from resources.db_autoinit import runtime as db_autoinit
+import sys
+
+# In a checkout, piminder_helpers is next to this directory rather than installed or copied in beside it.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resources.db_autoinit import runtime as db_autoinit  # noqa: E402
 
 __version__ = "v.1.0.0"  # This is the most recent version of the service that this script can initialize.
 
@@ -28,6 +34,34 @@ env_mapping = {  # This dictionary maps environment variable keys to the expecte
     "USE_SSL": "USE_SSL",
     "SSL_CERT": "SSL_CERT",
     "SSL_KEY": "SSL_KEY",
+    "PIMINDER_SLOW_QUERY_MS": "SLOW_QUERY_MS",
+    "PIMINDER_SLOW_QUERY_EXPLAIN": "SLOW_QUERY_EXPLAIN",
+    "PIMINDER_STORAGE": "STORAGE",
+    "PIMINDER_SQLITE_PATH": "SQLITE_PATH",
+    "PIMINDER_STORAGE_MODE": "STORAGE_MODE",
+    "PIMINDER_WRITE_BEHIND_INTERVAL": "WRITE_BEHIND_INTERVAL",
+    "PIMINDER_WRITE_BEHIND_BATCH": "WRITE_BEHIND_BATCH",
+    "PIMINDER_LISTING_CACHE": "LISTING_CACHE",
+    "PIMINDER_LISTING_CACHE_TTL": "LISTING_CACHE_TTL",
+    "PIMINDER_LISTING_CACHE_SIZE": "LISTING_CACHE_SIZE",
+    "PIMINDER_LISTING_CACHE_URL": "LISTING_CACHE_URL",
+    "PIMINDER_GROUP_COMMIT": "GROUP_COMMIT",
+    "PIMINDER_GROUP_COMMIT_WINDOW_MS": "GROUP_COMMIT_WINDOW_MS",
+    "PIMINDER_GROUP_COMMIT_SIZE": "GROUP_COMMIT_SIZE",
+    "PIMINDER_RATE_LIMIT": "RATE_LIMIT",
+    "PIMINDER_RATE_LIMIT_USER_RATE": "RATE_LIMIT_USER_RATE",
+    "PIMINDER_RATE_LIMIT_USER_BURST": "RATE_LIMIT_USER_BURST",
+    "PIMINDER_RATE_LIMIT_NAME_RATE": "RATE_LIMIT_NAME_RATE",
+    "PIMINDER_RATE_LIMIT_NAME_BURST": "RATE_LIMIT_NAME_BURST",
+    "PIMINDER_RATE_LIMIT_TOTAL_RATE": "RATE_LIMIT_TOTAL_RATE",
+    "PIMINDER_RATE_LIMIT_TOTAL_BURST": "RATE_LIMIT_TOTAL_BURST",
+    "PIMINDER_IDEMPOTENCY_TTL": "IDEMPOTENCY_TTL",
+    "PIMINDER_TOKEN_SECRET": "TOKEN_SECRET",
+    "PIMINDER_TOKEN_TTL": "TOKEN_TTL",
+    "PIMINDER_TOKEN_REVOCATION_REFRESH": "TOKEN_REVOCATION_REFRESH",
+    "PIMINDER_POOL_SIZE": "POOL_SIZE",
+    "PIMINDER_POOL_RECYCLE": "POOL_RECYCLE",
+    "PIMINDER_AUTH_CACHE_TTL": "AUTH_CACHE_TTL",
 }
 
 defaults = {  # Specifies default values for all configuration values in case for some reason they are absent.
@@ -39,7 +73,35 @@ defaults = {  # Specifies default values for all configuration values in case fo
     "PASSPHRASE": None,  # This will probably cause a crash but it's the sane default.
     "USE_SSL": False,
     "SSL_CERT": "cert.pem",
-    "SSL_KEY": "key.pem"
+    "SSL_KEY": "key.pem",
+    "SLOW_QUERY_MS": 250,  # Statements slower than this are logged by resources/sql.py
+    "SLOW_QUERY_EXPLAIN": False,
+    "STORAGE": "mariadb",  # Or "sqlite", for a single-host install without a database server.
+    "SQLITE_PATH": "piminder.db",
+    "STORAGE_MODE": "direct",  # Or "memory", to serve messages from memory and write them behind; see memstore.py
+    "WRITE_BEHIND_INTERVAL": 1.0,
+    "WRITE_BEHIND_BATCH": 500,
+    "LISTING_CACHE": "off",  # Or "local" or "redis"; see resources/listing_cache.py
+    "LISTING_CACHE_TTL": 30,
+    "LISTING_CACHE_SIZE": 64,
+    "LISTING_CACHE_URL": "redis://localhost:6379/0",
+    "GROUP_COMMIT": False,  # Commit concurrent message inserts together; see resources/group_commit.py
+    "GROUP_COMMIT_WINDOW_MS": 5,
+    "GROUP_COMMIT_SIZE": 100,
+    "RATE_LIMIT": False,  # Limit how fast messages may be posted; see resources/rate_limit.py
+    "RATE_LIMIT_USER_RATE": 10,  # Posts per second, on average
+    "RATE_LIMIT_USER_BURST": 50,
+    "RATE_LIMIT_NAME_RATE": 2,
+    "RATE_LIMIT_NAME_BURST": 20,
+    "RATE_LIMIT_TOTAL_RATE": 200,
+    "RATE_LIMIT_TOTAL_BURST": 400,
+    "IDEMPOTENCY_TTL": 3600,  # Seconds an Idempotency-Key is remembered; see resources/idempotency.py
+    "TOKEN_SECRET": "",  # Signs bearer tokens; if unset, a random one is used. See resources/bearer_tokens.py
+    "TOKEN_TTL": 900,
+    "TOKEN_REVOCATION_REFRESH": 5,
+    "POOL_SIZE": 8,  # Idle database sessions kept for reuse; 0 to connect per request. See resources/pool.py
+    "POOL_RECYCLE": 300,
+    "AUTH_CACHE_TTL": 60  # Seconds verified basic credentials are remembered; see resources/auth_cache.py
 }
 
 def create_app(config_object):
@@ -52,7 +114,9 @@ def create_app(config_object):
     app.config.from_object(config_object)
 
     from app import api_bp
+    from resources.instrumentation import metrics_view
     app.register_blueprint(api_bp, url_prefix='/api')
+    app.add_url_rule('/metrics', view_func=metrics_view)
 
     return app
 
@@ -98,23 +162,36 @@ def enforce_defaults(conf):  # This currently appears to superenforce. Why?
         if key not in extant:
             setattr(conf, key, defaults[key])
 
-    if str(conf.USE_SSL.lower()) in ['yes', 'y', 'true', '1']:
-        conf.USE_SSL = True
-    else:
-        conf.USE_SSL = False
-
-    if str(conf.DEBUG.lower()) in ['yes', 'y', 'true', '1']:
-        conf.DEBUG = True
-    else:
-        conf.DEBUG = False
+    # Config values arrive as strings, but these are booleans.
+    for flag in ["USE_SSL", "DEBUG", "SLOW_QUERY_EXPLAIN", "GROUP_COMMIT", "RATE_LIMIT"]:
+        setattr(conf, flag, str(getattr(conf, flag)).lower() in ['yes', 'y', 'true', '1'])
+
+    conf.SLOW_QUERY_MS = float(conf.SLOW_QUERY_MS)
+    conf.STORAGE = str(conf.STORAGE).lower()
+    conf.STORAGE_MODE = str(conf.STORAGE_MODE).lower()
+    conf.WRITE_BEHIND_INTERVAL = float(conf.WRITE_BEHIND_INTERVAL)
+    conf.WRITE_BEHIND_BATCH = int(conf.WRITE_BEHIND_BATCH)
+    conf.LISTING_CACHE_TTL = float(conf.LISTING_CACHE_TTL)
+    conf.LISTING_CACHE_SIZE = int(conf.LISTING_CACHE_SIZE)
+    conf.GROUP_COMMIT_WINDOW_MS = float(conf.GROUP_COMMIT_WINDOW_MS)
+    conf.GROUP_COMMIT_SIZE = int(conf.GROUP_COMMIT_SIZE)
+    for key in ["RATE_LIMIT_USER_RATE", "RATE_LIMIT_USER_BURST", "RATE_LIMIT_NAME_RATE", "RATE_LIMIT_NAME_BURST",
+                "RATE_LIMIT_TOTAL_RATE", "RATE_LIMIT_TOTAL_BURST"]:
+        setattr(conf, key, float(getattr(conf, key)))
+    conf.IDEMPOTENCY_TTL = int(conf.IDEMPOTENCY_TTL)
+    conf.TOKEN_TTL = int(conf.TOKEN_TTL)
+    conf.TOKEN_REVOCATION_REFRESH = float(conf.TOKEN_REVOCATION_REFRESH)
+    conf.POOL_SIZE = int(conf.POOL_SIZE)
+    conf.POOL_RECYCLE = float(conf.POOL_RECYCLE)
+    conf.AUTH_CACHE_TTL = float(conf.AUTH_CACHE_TTL)
 
     return conf
 
 if __name__ == "__main__":
-    db_autoinit()
     config = parse_config("piminder-service.conf")
     config = parse_env(config)
     config = enforce_defaults(config)
+    db_autoinit(vars(config))
     app = create_app(config)
     if config.USE_SSL:
         app.run(host=config.LISTENHOST, port=config.LISTENPORT, debug=config.DEBUG,
@@ -0,0 +1,68 @@
+"""
+This script is a component of Piminder's back-end controller.
+It sets up the service's tests: the service is imported the way run.py imports it, from its own directory, alongside
+piminder_helpers, and each test gets an app on a fresh SQLite database with an administrative user.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import base64
+import os
+import sys
+
+import pytest
+
+service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(service_dir))  # For piminder_helpers.
+sys.path.insert(0, service_dir)
+
+from resources import auth_cache, group_commit, listing_cache, memstore, pool, rate_limit  # noqa: E402
+from resources.db_autoinit import runtime as db_autoinit  # noqa: E402
+from run import create_app, enforce_defaults, parse_config, parse_env  # noqa: E402
+
+
+@pytest.fixture
+def settings():
+    """Config values for the app, by their PIMINDER_ environment variable names less the prefix; a test module
+    overrides this fixture to try the service with other settings."""
+    return {}
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, settings):
+    monkeypatch.setenv("PIMINDER_ADMIN_USER", "admin")
+    monkeypatch.setenv("PIMINDER_ADMIN_PASSWORD", "password")
+    for key, value in settings.items():
+        monkeypatch.setenv("PIMINDER_%s" % key, str(value))
+    monkeypatch.setattr(pool, "pool", None)  # Sessions pooled by an earlier test are on an earlier database.
+    monkeypatch.setattr(rate_limit, "limiter", None)  # The same goes for buckets, and the settings they were made with.
+    monkeypatch.setattr(listing_cache, "cache", None)
+    monkeypatch.setattr(auth_cache, "entries", {})
+    monkeypatch.setattr(group_commit, "committer", None)
+    monkeypatch.setattr(memstore, "index", None)
+    monkeypatch.setattr(memstore, "writer", None)
+    config = parse_env(parse_config(str(tmp_path / "piminder-service.conf")))
+    config.STORAGE = "sqlite"
+    config.SQLITE_PATH = str(tmp_path / "piminder.db")
+    config = enforce_defaults(config)
+    db_autoinit(vars(config))
+
+    return create_app(config).test_client()
+
+
+@pytest.fixture
+def admin():
+    return {"Authorization": "Basic %s" % base64.b64encode(b"admin:password").decode()}
+
+
+@pytest.fixture
+def bearer(client, admin):
+    """A bearer token for the administrative user, which spares each request a bcrypt check."""
+    token = client.post("/api/tokens/", headers=admin).get_json()["token"]
+
+    return {"Authorization": "Bearer %s" % token}
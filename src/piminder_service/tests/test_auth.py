@@ -0,0 +1,20 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests how the service answers a malformed Authorization header.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize("header", ["Basic", "Basic !!!", "Basic /w==", "Basic bm9jb2xvbg==", "Bearer"])
+def test_malformed_authorization_is_unauthorized(client, header):
+    resp = client.get("/api/messages/", headers={"Authorization": header})
+
+    assert resp.status_code == 401
@@ -0,0 +1,34 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests the bulk mark-read and delete forms of /api/messages/.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+
+
+@pytest.mark.parametrize("method", ["PATCH", "DELETE"])
+def test_wrongly_typed_older_than_is_refused(client, admin, method):
+    resp = client.open("/api/messages/", method=method, headers=admin,
+                       json={"filter": {"errorlevel": "x", "olderThan": "y"}})
+
+    assert resp.status_code == 400
+    assert "filter.olderThan" in resp.get_json()["all_errors"]
+
+
+def test_older_than_filter_marks_old_messages_read(client, admin):
+    for timestamp in [1500000000, 2000000000]:
+        client.post("/api/messages/", headers=admin, json={"name": "test", "timestamp": timestamp,
+                                                          "errorlevel": "info", "message": "At %d" % timestamp})
+    resp = client.patch("/api/messages/", headers=admin, json={"filter": {"olderThan": 3600}})
+
+    assert resp.status_code == 200
+    listing = client.get("/api/messages/?timeFormat=epoch", headers=admin).get_json()
+    assert {message["timestamp"]: message["read"] for key, message in listing.items() if key != "error"} == \
+        {1500000000: True, 2000000000: False}
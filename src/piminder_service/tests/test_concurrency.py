@@ -0,0 +1,57 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that marking a message read and deleting it are safe when many clients try the same message at once.
+These run on SQLite, which serializes writers, so they cannot catch races that only MariaDB's concurrent writers
+allow; benchmark.py --hammer runs the same check against MariaDB (see SERVICE_SETUP.md).
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import sqlite3
+import threading
+
+threads = 16
+
+
+def hammer(client, headers, method, message_id):
+    """Has threads clients send the same request at the same moment, and returns their statuses."""
+    barrier = threading.Barrier(threads)
+    statuses = []
+
+    def hit():
+        own_client = client.application.test_client()
+        barrier.wait()
+        statuses.append(own_client.open("/api/messages/", method=method, headers=headers,
+                                        json={"messageId": message_id}).status_code)
+
+    workers = [threading.Thread(target=hit) for each in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return statuses
+
+
+def test_one_patch_and_one_delete_win(client, bearer):
+    client.post("/api/messages/", headers=bearer, json={"name": "test", "timestamp": 1600000000,
+                                                        "errorlevel": "info", "message": "Kept"})
+    for each in range(5):
+        message_id = client.post("/api/messages/", headers=bearer, json={
+            "name": "test", "timestamp": 1600000000, "errorlevel": "info", "message": "Hammered"}).get_json()["messageId"]
+        for method in ["PATCH", "DELETE"]:
+            statuses = hammer(client, bearer, method, message_id)
+
+            assert statuses.count(200) == 1
+            assert set(statuses) - {200} == {400}
+
+    summary = client.get("/api/messages/summary/", headers=bearer).get_json()
+    with sqlite3.connect(client.application.config["SQLITE_PATH"]) as connection:
+        total, unread = connection.execute("SELECT COUNT(*), SUM(read_flag = 0) FROM messages").fetchone()
+
+    assert (summary["total"], summary["unread"]) == (total, unread) == (1, 1)
@@ -0,0 +1,112 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that with GROUP_COMMIT on, concurrent posts share commits, unique posts still go through, and a group that
+fails is committed row by row so that one bad message fails only its own request.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import sqlite3
+import threading
+
+import pytest
+from resources.group_commit import GroupCommitter
+
+threads = 8
+
+
+@pytest.fixture
+def settings():
+    return {"GROUP_COMMIT": "true", "GROUP_COMMIT_WINDOW_MS": 200}
+
+
+class FakeStore(object):
+    """Stands in for a storage session, refusing any group that holds a message whose text is "bad"."""
+    def __init__(self, committed):
+        self.committed = committed
+        self.messages = []
+
+    def insert_messages(self, messages):
+        if any(message["message"] == "bad" for message in messages):
+            raise sqlite3.IntegrityError("bad message")
+        self.messages = messages
+
+    def commit(self):
+        self.committed.append([message["message"] for message in self.messages])
+
+    def close(self):
+        pass
+
+
+def submit_together(committer, texts):
+    """Submits a message per text from its own thread, all at once; returns each one's error, or None."""
+    barrier = threading.Barrier(len(texts))
+    errors = {}
+
+    def submit(text):
+        barrier.wait()
+        try:
+            committer.submit({"message": text})
+            errors[text] = None
+        except sqlite3.Error as e:
+            errors[text] = e
+
+    workers = [threading.Thread(target=submit, args=(text,)) for text in texts]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    return errors
+
+
+def test_concurrent_posts_share_commits(client, bearer, monkeypatch):
+    groups = []
+    commit = GroupCommitter.commit
+    monkeypatch.setattr(GroupCommitter, "commit", lambda self, messages: (groups.append(len(messages)),
+                                                                           commit(self, messages)))
+    barrier = threading.Barrier(threads)
+    statuses = []
+
+    def post(number):
+        own_client = client.application.test_client()
+        barrier.wait()
+        statuses.append(own_client.post("/api/messages/", headers=bearer, json={
+            "name": "test", "timestamp": 1600000000, "errorlevel": "info", "message": "Post %d" % number}).status_code)
+
+    workers = [threading.Thread(target=post, args=(number,)) for number in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    summary = client.get("/api/messages/summary/", headers=bearer).get_json()
+
+    assert statuses == [200] * threads
+    assert sum(groups) == summary["total"] == threads
+    assert len(groups) < threads
+
+
+def test_unique_posts_are_not_left_waiting_on_themselves(client, bearer):
+    body = {"name": "test", "timestamp": 1600000000, "errorlevel": "major", "message": "Unique",
+            "updateTimestamp": False}
+    for each in range(2):
+        assert client.post("/api/messages/unique/", headers=bearer, json=body).status_code == 200
+    listing = client.get("/api/messages/", headers=bearer).get_json()
+
+    assert listing["0"]["occurrences"] == 2
+
+
+def test_failed_group_is_committed_row_by_row():
+    committed = []
+    committer = GroupCommitter(lambda: FakeStore(committed), window=0.2)
+    committer.start()
+    errors = submit_together(committer, ["good", "bad", "fine"])
+
+    assert errors["good"] is None and errors["fine"] is None
+    assert isinstance(errors["bad"], sqlite3.IntegrityError)
+    assert sorted(sum(committed, [])) == ["fine", "good"]
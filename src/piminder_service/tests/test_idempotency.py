@@ -0,0 +1,43 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that a post retried with the same Idempotency-Key is answered as the first was and stored only once, in
+each way the service can store messages.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import sqlite3
+
+import pytest
+from resources import memstore
+
+
+@pytest.fixture(params=[{}, {"GROUP_COMMIT": "true"}, {"STORAGE_MODE": "memory"}],
+                ids=["direct", "group-commit", "memory"])
+def settings(request):
+    return request.param
+
+
+def stored_rows(client):
+    if memstore.writer is not None:
+        memstore.writer.stop()  # Flushes whatever is still to be written behind.
+    with sqlite3.connect(client.application.config["SQLITE_PATH"]) as connection:
+        return connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+
+def test_retry_is_answered_from_the_first_post(client, admin):
+    headers = dict(admin, **{"Idempotency-Key": "retry-1"})
+    body = {"name": "test", "timestamp": 1622520000, "errorlevel": "info", "message": "Once"}
+    first = client.post("/api/messages/", headers=headers, json=body)
+    retry = client.post("/api/messages/", headers=headers, json=body)
+    other = client.post("/api/messages/", headers=dict(admin, **{"Idempotency-Key": "retry-2"}), json=body)
+
+    assert first.status_code == retry.status_code == other.status_code == 200
+    assert retry.get_json() == first.get_json()
+    assert other.get_json()["messageId"] != first.get_json()["messageId"]
+    assert stored_rows(client) == 2
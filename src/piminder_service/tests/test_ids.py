@@ -0,0 +1,48 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that message ids are version 7 UUIDs which sort in the order they were made.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import time
+import uuid
+
+from resources import ids
+
+
+def test_ids_are_version_7_and_carry_the_time():
+    before = time.time_ns() // 1000000
+    message_id = uuid.UUID(ids.new_id())
+    after = time.time_ns() // 1000000
+
+    assert (message_id.version, message_id.variant) == (7, uuid.RFC_4122)
+    assert before <= message_id.int >> 80 <= after
+
+
+def test_ids_sort_in_creation_order():
+    made = [ids.new_id() for each in range(20000)]  # Enough to fill several milliseconds' sequences.
+
+    assert sorted(made) == made
+    assert len(set(made)) == len(made)
+
+
+def test_ids_keep_increasing_when_a_millisecond_runs_out(monkeypatch):
+    monkeypatch.setattr(ids.time, "time_ns", lambda: 1622520000000 * 1000000)
+    made = [ids.new_id() for each in range(0x1000 + 10)]
+
+    assert sorted(made) == made
+    assert uuid.UUID(made[-1]).int >> 80 > 1622520000000
+
+
+def test_posted_messages_get_increasing_ids(client, admin):
+    made = [client.post("/api/messages/", headers=admin, json={
+        "name": "test", "timestamp": 1622520000, "errorlevel": "info", "message": "Post %d" % each}
+    ).get_json()["messageId"] for each in range(5)]
+
+    assert sorted(made) == made
@@ -0,0 +1,65 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests the changedSince form of the message listing, which the monitor uses to catch up after an outage.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from resources import listing_cache
+
+
+def post(client, admin, timestamp, text):
+    client.post("/api/messages/unique/", headers=admin, json={"name": "test", "timestamp": timestamp,
+                                                             "errorlevel": "info", "message": text,
+                                                             "updateTimestamp": False})
+
+
+@pytest.mark.parametrize("since", ["1700000000", "2023-11-14T22:13:20Z"])
+def test_changed_since_lists_only_later_messages(client, admin, since):
+    post(client, admin, 1600000000, "Old")
+    post(client, admin, 1800000000, "New")
+    post(client, admin, 1600000000, "Seen again")
+    post(client, admin, 1900000000, "Seen again")
+    resp = client.get("/api/messages/?changedSince=%s" % since, headers=admin)
+    listing = resp.get_json()
+
+    assert resp.status_code == 200
+    assert sorted(message["message"] for key, message in listing.items() if key != "error") == ["New", "Seen again"]
+
+
+def test_bad_changed_since_is_refused(client, admin):
+    resp = client.get("/api/messages/?changedSince=yesterday", headers=admin)
+
+    assert resp.status_code == 400
+    assert "changedSince" in resp.get_json()["all_errors"]
+
+
+def test_local_listing_cache_drops_expired_and_least_recently_used(monkeypatch):
+    clock = [0.0]
+    monkeypatch.setattr(listing_cache.time, "monotonic", lambda: clock[0])
+    cache = listing_cache.LocalListingCache(ttl=10, max_entries=2)
+    cache.put(0, "a", {"a": 1})
+    cache.put(0, "b", {"b": 1})
+    cache.get("a")  # So b is now the least recently used.
+    cache.put(0, "c", {"c": 1})
+
+    assert list(cache.entries) == ["a", "c"]
+
+    clock[0] = 20.0
+    assert cache.get("a") == (0, None)
+    cache.put(0, "d", {"d": 1})
+    assert list(cache.entries) == ["d"]
+
+
+def test_listing_is_cached_by_time_format_only(client, admin, monkeypatch):
+    monkeypatch.setattr(listing_cache, "cache", listing_cache.LocalListingCache(30))
+    for query in ["", "?x=1", "?x=2", "?timeFormat=epoch", "?changedSince=1700000000"]:
+        assert client.get("/api/messages/%s" % query, headers=admin).status_code == 200
+
+    assert sorted(listing_cache.cache.entries) == ["timeFormat=epoch", "timeFormat=iso"]
@@ -0,0 +1,57 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that the in-memory message store's claims neither deadlock two requests nor fail one with a traceback.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import time
+
+import pytest
+from resources import memstore, storage
+
+
+@pytest.fixture
+def settings():
+    return {"STORAGE_MODE": "memory"}
+
+
+def post(client, admin, text):
+    return client.post("/api/messages/", headers=admin, json={
+        "name": "test", "timestamp": 1600000000, "errorlevel": "info", "message": text}).get_json()["messageId"]
+
+
+def other_session(client):
+    """A session on the memory store, as another request would have, outside the app."""
+    return storage.connect(client.application.config)
+
+
+def test_held_message_is_answered_with_409(client, admin, monkeypatch):
+    message_id = post(client, admin, "Held")
+    monkeypatch.setattr(memstore, "claim_timeout", 0.1)
+    holder = other_session(client)
+    holder.delete_message(message_id)
+    response = client.patch("/api/messages/", headers=admin, json={"messageId": message_id})
+    holder.rollback()
+
+    assert response.status_code == 409
+    assert client.patch("/api/messages/", headers=admin, json={"messageId": message_id}).status_code == 200
+
+
+def test_session_holding_claims_does_not_wait_for_more(client, admin):
+    first, second = post(client, admin, "First"), post(client, admin, "Second")
+    holder, other = other_session(client), other_session(client)
+    holder.mark_read(first)
+    other.mark_read(second)
+    started = time.monotonic()
+    with pytest.raises(TimeoutError):
+        other.delete_messages([second, first])  # Held by holder, which would in turn wait on second.
+
+    assert time.monotonic() - started < memstore.claim_timeout
+    holder.rollback()
+    other.rollback()
@@ -0,0 +1,27 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that a migration which fails stops the service and is not recorded as applied.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from resources.db_autoinit import apply_migrations
+from resources.storage import sqlite_connect
+
+
+def test_failed_migration_is_not_recorded(tmp_path):
+    connection = sqlite_connect(str(tmp_path / "piminder.db"))
+    migrations = [("001_good", ["CREATE TABLE kept (id INTEGER)"]),
+                  ("002_bad", ["CREATE TABLE half (id INTEGER)", "SELECT * FROM missing"])]
+    with pytest.raises(SystemExit):
+        apply_migrations(migrations, connection, "?")
+    connection.rollback()
+    applied = [row["name"] for row in connection.execute("SELECT name FROM schema_migrations").fetchall()]
+
+    assert applied == ["001_good"]
@@ -0,0 +1,54 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that repeated unique posts are counted as occurrences of one message, with and without group commit.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+
+
+@pytest.fixture(params=[{}, {"GROUP_COMMIT": "true"}], ids=["direct", "group-commit"])
+def settings(request):
+    return request.param
+
+
+def post_unique(client, admin, timestamp, text="Disk full", update=False):
+    return client.post("/api/messages/unique/", headers=admin, json={
+        "name": "test", "timestamp": timestamp, "errorlevel": "major", "message": text, "updateTimestamp": update})
+
+
+def messages(client, admin):
+    listing = client.get("/api/messages/?timeFormat=epoch", headers=admin).get_json()
+
+    return [message for key, message in listing.items() if key != "error"]
+
+
+def test_repeats_are_counted_on_one_message(client, admin):
+    for timestamp in [1600000000, 1600000100, 1600000200]:
+        assert post_unique(client, admin, timestamp).status_code == 200
+    post_unique(client, admin, 1600000300, text="Disk fine")
+    listing = {message["message"]: message for message in messages(client, admin)}
+
+    assert len(listing) == 2
+    repeated = listing["Disk full"]
+    assert (repeated["occurrences"], repeated["firstSeen"], repeated["lastSeen"]) == (3, 1600000000, 1600000200)
+    assert repeated["timestamp"] == 1600000000  # Left alone without updateTimestamp.
+    assert listing["Disk fine"]["occurrences"] == 1
+
+
+def test_repeat_marks_read_message_unread_and_can_move_it(client, admin):
+    post_unique(client, admin, 1600000000)
+    message_id = messages(client, admin)[0]["messageId"]
+    client.patch("/api/messages/", headers=admin, json={"messageId": message_id})
+    post_unique(client, admin, 1600000500, update=True)
+    message = messages(client, admin)[0]
+    summary = client.get("/api/messages/summary/", headers=admin).get_json()
+
+    assert (message["read"], message["occurrences"], message["timestamp"]) == (False, 2, 1600000500)
+    assert (summary["total"], summary["unread"]) == (1, 1)
@@ -0,0 +1,60 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests the rate limits on message posts, and that a client cannot spend another user's allowance.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import base64
+
+import pytest
+
+
+@pytest.fixture
+def settings():
+    return {"RATE_LIMIT": "true", "RATE_LIMIT_USER_RATE": 0.01, "RATE_LIMIT_USER_BURST": 3}
+
+
+def post(client, headers, errorlevel="info"):
+    return client.post("/api/messages/", headers=headers, json={"name": "test", "timestamp": 1622520000,
+                                                                "errorlevel": errorlevel, "message": "Limited"})
+
+
+def test_exhausted_bucket_is_refused_with_retry_after(client, bearer):
+    assert [post(client, bearer).status_code for each in range(3)] == [200, 200, 200]
+    resp = post(client, bearer)
+
+    assert resp.status_code == 429
+    assert int(resp.headers["Retry-After"]) == resp.get_json()["retryAfter"] >= 1
+
+
+def test_looping_major_reporter_is_limited_by_its_own_bucket(client, bearer):
+    assert [post(client, bearer, "major").status_code for each in range(4)] == [200, 200, 200, 429]
+
+
+@pytest.mark.parametrize("settings", [{"RATE_LIMIT": "true", "RATE_LIMIT_TOTAL_RATE": 0.01,
+                                       "RATE_LIMIT_TOTAL_BURST": 3}])  # Info may use only the top half: one post.
+def test_major_messages_are_admitted_past_the_service_reserve(client, bearer):
+    assert [post(client, bearer).status_code for each in range(2)] == [200, 429]
+    assert [post(client, bearer, "major").status_code for each in range(3)] == [200, 200, 200]
+
+
+def test_unverified_client_cannot_spend_a_users_bucket(client, bearer):
+    spoofed = {"Authorization": "Basic %s" % base64.b64encode(b"admin:wrong").decode()}
+    statuses = [post(client, spoofed).status_code for each in range(4)]
+
+    assert statuses == [401, 401, 401, 429]  # Charged to its address, which is spent, not to the admin.
+    assert post(client, spoofed, "major").status_code == 429  # Major posts are no way past it.
+    assert [post(client, bearer).status_code for each in range(3)] == [200, 200, 200]
+
+
+def test_verified_basic_client_is_charged_as_its_user(client, admin, bearer):
+    statuses = [post(client, admin).status_code for each in range(4)]  # Cached as verified by the token exchange.
+
+    assert statuses == [200, 200, 200, 429]
+    assert post(client, bearer).status_code == 429  # The same user, however it authenticates.
@@ -0,0 +1,52 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests the compiled request schemas and the errors they report.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+from resources.schema import OneOf, Optional, Schema
+
+schema = Schema({"name": "", "count": (0, 0.0), "level": OneOf("info", "major", message="Bad level."),
+                 "filter": {"older": Optional(0)}, "memo": Optional("")})
+valid = {"name": "test", "count": 1.5, "level": "info", "filter": {}}
+
+
+def test_valid_body_passes():
+    assert schema.validate(valid) == (True, {})
+    assert schema.validate(dict(valid, count=2, memo="", filter={"older": 5})) == (True, {})
+
+
+def test_each_kind_of_error_is_reported():
+    valid_body, errors = schema.validate({"count": "many", "level": "minor", "filter": {"older": "old"},
+                                          "memo": 5})
+
+    assert not valid_body
+    assert errors == {"name": "Field missing from request",
+                      "count": "Value is not of the expected type: (<class 'int'>, <class 'float'>)",
+                      "level": "Bad level.",
+                      "filter.older": "Value is not of the expected type: <class 'int'>",
+                      "memo": "Value is not of the expected type: <class 'str'>"}
+
+
+def test_unhashable_values_fail_enums_and_objects():
+    valid_body, errors = schema.validate(dict(valid, level=["info"], filter=["older"]))
+
+    assert errors == {"level": "Bad level.", "filter": "Value is not of the expected type: <class 'dict'>"}
+
+
+def test_body_must_be_an_object():
+    assert schema.validate(["name"]) == (False, {"body": "Request body must be a JSON object"})
+
+
+def test_message_post_with_wrongly_typed_timestamp_is_refused(client, admin):
+    resp = client.post("/api/messages/", headers=admin, json={"name": "test", "timestamp": [1],
+                                                              "errorlevel": "info", "message": "Typed"})
+
+    assert resp.status_code == 400
+    assert resp.get_json()["all_errors"]["timestamp"].startswith("Value is not of the expected type")
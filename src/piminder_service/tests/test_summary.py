@@ -0,0 +1,55 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests that /api/messages/summary/ keeps count through posts, mark-reads and deletes.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import sqlite3
+
+
+def post(client, admin, name, errorlevel):
+    return client.post("/api/messages/", headers=admin, json={"name": name, "timestamp": 1622520000,
+                                                              "errorlevel": errorlevel,
+                                                              "message": "From %s" % name}).get_json()["messageId"]
+
+
+def counted(summary):
+    return summary["total"], summary["unread"]
+
+
+def test_summary_follows_changes(client, admin):
+    first = post(client, admin, "alpha", "info")
+    second = post(client, admin, "alpha", "major")
+    third = post(client, admin, "beta", "major")
+    post(client, admin, "beta", "minor")
+    client.patch("/api/messages/", headers=admin, json={"messageId": first})
+    client.patch("/api/messages/", headers=admin, json={"messageId": first})  # A second marking changes nothing.
+    client.delete("/api/messages/", headers=admin, json={"messageId": second})
+    client.delete("/api/messages/", headers=admin, json={"messageId": second})
+    client.patch("/api/messages/", headers=admin, json={"messageIds": [third]})
+    summary = client.get("/api/messages/summary/", headers=admin).get_json()
+
+    assert counted(summary) == (3, 1)
+    assert {level: counted(totals) for level, totals in summary["byLevel"].items()} == {
+        "info": (1, 0), "minor": (1, 1), "major": (1, 0)}
+    assert counted(summary["byName"]["alpha"]) == (1, 0)
+    assert counted(summary["byName"]["beta"]) == (2, 1)
+    assert counted(summary["byName"]["beta"]["byLevel"]["minor"]) == (1, 1)
+    with sqlite3.connect(client.application.config["SQLITE_PATH"]) as connection:
+        assert connection.execute("SELECT COUNT(*), SUM(read_flag = 0) FROM messages").fetchone() == (3, 1)
+
+
+def test_bulk_delete_is_counted(client, admin):
+    for name in ["alpha", "alpha", "beta"]:
+        post(client, admin, name, "info")
+    client.delete("/api/messages/", headers=admin, json={"filter": {"name": "alpha"}})
+    summary = client.get("/api/messages/summary/", headers=admin).get_json()
+
+    assert counted(summary) == (1, 1)
+    assert "alpha" not in summary["byName"]
@@ -0,0 +1,59 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests the timestamp codec the service shares with the helpers, and how message posts use it.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import pytest
+from piminder_helpers.timestamps import format_timestamp, max_epoch, min_epoch, parse_timestamp, to_epoch
+
+
+@pytest.mark.parametrize("value, epoch", [("2021-06-01T04:00:00Z", 1622520000),
+                                          ("2021-06-01T06:00:00+02:00", 1622520000),
+                                          ("2021-06-01T04:00:00", 1622520000),
+                                          ("2024-02-29T00:00:00Z", 1709164800),
+                                          (1622520000, 1622520000),
+                                          (1622520000.9, 1622520000),
+                                          (0, 0),
+                                          (max_epoch, max_epoch)])
+def test_to_epoch_accepts(value, epoch):
+    assert to_epoch(value) == epoch
+
+
+@pytest.mark.parametrize("value", ["2023-02-29T00:00:00Z", "2021-13-01T00:00:00Z", "2021-06-01T24:00:00Z",
+                                   "yesterday", "", True, -1, max_epoch + 1, float("inf"), float("nan"),
+                                   "1969-12-31T23:59:59Z", "2038-01-19T03:14:08Z"])
+def test_to_epoch_refuses(value):
+    with pytest.raises(ValueError):
+        to_epoch(value)
+
+
+def test_fast_and_slow_parses_agree():
+    for epoch in range(0, max_epoch, 86400 * 397 + 3907):
+        text = format_timestamp(epoch)
+
+        assert parse_timestamp(text) == parse_timestamp(text.replace("Z", "+00:00")) == epoch
+
+
+def test_format_timestamp_clamps_to_the_storable_range():
+    assert format_timestamp(-5) == format_timestamp(min_epoch) == "1970-01-01T00:00:00Z"
+    assert format_timestamp(2 ** 40) == format_timestamp(max_epoch) == "2038-01-19T03:14:07Z"
+    assert format_timestamp(1622520000.7) == "2021-06-01T04:00:00Z"
+
+
+@pytest.mark.parametrize("timestamp, status", [(1622520000.5, 200), ("2021-06-01T04:00:00Z", 200),
+                                               (2 ** 31, 400), (-1, 400), ("June", 400)])
+def test_message_post_timestamps(client, admin, timestamp, status):
+    resp = client.post("/api/messages/", headers=admin, json={"name": "test", "timestamp": timestamp,
+                                                              "errorlevel": "info", "message": "Timed"})
+
+    assert resp.status_code == status
+    if status == 200:
+        listing = client.get("/api/messages/?timeFormat=epoch", headers=admin).get_json()
+        assert listing["0"]["timestamp"] == 1622520000
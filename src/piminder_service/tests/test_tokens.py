@@ -0,0 +1,59 @@
+"""
+This script is a component of Piminder's back-end controller.
+It tests bearer tokens from /api/tokens/: their use in place of basic auth, their revocation, and the refusal of
+tokens that are signed but malformed.
+
+Author: Zac Adam-MacEwen (zadammac@kenshosec.com)
+An Arcana Labs utility.
+
+Produced under license.
+Full license and documentation to be found at:
+https://github.com/ZAdamMac/Piminder
+"""
+
+import base64
+import json
+
+import pytest
+from resources import bearer_tokens
+
+
+def basic(username, password):
+    return {"Authorization": "Basic %s" % base64.b64encode(("%s:%s" % (username, password)).encode()).decode()}
+
+
+def test_token_is_refused_once_its_user_is_changed(client, admin):
+    user = {"username": "monitor", "permissionLevel": "monitor", "memo": "", "password": "first"}
+    assert client.post("/api/users/", headers=admin, json=user).status_code == 200
+    resp = client.post("/api/tokens/", headers=basic("monitor", "first"))
+    bearer = {"Authorization": "Bearer %s" % resp.get_json()["token"]}
+
+    assert resp.status_code == 200
+    assert client.get("/api/messages/", headers=bearer).status_code == 200
+    assert client.post("/api/tokens/", headers=bearer).status_code == 401  # A token cannot be used to get another.
+
+    assert client.patch("/api/users/", headers=admin, json=dict(user, password="second")).status_code == 200
+    assert client.get("/api/messages/", headers=bearer).status_code == 401
+
+
+def test_username_is_matched_exactly_not_as_a_pattern(client, admin):
+    user = {"username": "alice", "permissionLevel": "monitor", "memo": "", "password": "first"}
+    client.post("/api/users/", headers=admin, json=user)
+    token = client.post("/api/tokens/", headers=basic("alice", "first")).get_json()["token"]
+    bearer = {"Authorization": "Bearer %s" % token}
+
+    assert client.delete("/api/users/", headers=admin, json={"username": "al%"}).status_code == 400
+    assert client.get("/api/messages/", headers=bearer).status_code == 200  # Neither deactivated nor left a token.
+
+
+@pytest.mark.parametrize("claims", [{"sub": "admin", "lvl": 3, "iat": 0, "exp": "never"},
+                                    {"sub": "admin", "lvl": 3, "iat": 0, "exp": None},
+                                    {"sub": "admin", "lvl": 3, "iat": 0},
+                                    {"sub": ["admin"], "lvl": 3, "iat": 0, "exp": 2 ** 31 - 1},
+                                    {"sub": "admin", "lvl": "high", "iat": 0, "exp": 2 ** 31 - 1}])
+def test_signed_token_with_bad_claims_is_unauthorized(client, claims):
+    with client.application.app_context():
+        payload = bearer_tokens.encode(json.dumps(claims).encode('utf8'))
+        token = "%s.%s" % (payload, bearer_tokens.sign(payload))
+
+    assert client.get("/api/messages/", headers={"Authorization": "Bearer %s" % token}).status_code == 401